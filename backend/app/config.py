@@ -1,3 +1,4 @@
+from typing import Dict
 from pydantic_settings import BaseSettings
 
 
@@ -8,7 +9,100 @@ class Settings(BaseSettings):
     image_prompt_model: str = "anthropic/claude-3.5-sonnet"
     image_generation_model: str = "openai/dall-e-3"
     default_scenes_count: int = 10
-
+    
+    # 共享 HTTP 连接池
+    http2_enabled: bool = True
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http_connect_timeout: float = 10.0
+    http_timeout: float = 120.0
+    
+    # LLM 响应缓存（structured_completion）
+    llm_cache_enabled: bool = False
+    llm_cache_dir: str = "./output/cache/llm"
+    llm_cache_max_bytes: int = 256 * 1024 * 1024
+    llm_cache_ttl_seconds: float = 7 * 24 * 3600
+    
+    # Stage3 图像输出格式：png / webp / jpeg；PNG 压缩级别 -1 表示原样保存模型返回的 PNG，0-9 表示重新压缩
+    stage3_image_format: str = "png"
+    stage3_png_compress_level: int = -1
+    stage3_image_quality: int = 90
+    
+    # Stage3 图像缓存：按 (提示词, 负向提示词, 模型, 尺寸, 质量) 寻址，命中时硬链接到任务目录
+    image_cache_enabled: bool = False
+    image_cache_dir: str = "./output/cache/images"
+    image_cache_max_bytes: int = 2 * 1024 * 1024 * 1024
+    
+    # 结构化输出因 max_tokens 截断时最多续写的次数
+    llm_max_continuations: int = 2
+    
+    # 按模型的 AIMD 自适应并发控制
+    llm_concurrency_enabled: bool = True
+    llm_concurrency_initial: int = 4
+    llm_concurrency_min: int = 1
+    llm_concurrency_max: int = 32
+    llm_concurrency_increase: float = 1.0
+    llm_concurrency_decrease: float = 0.5
+    
+    # 外部调用重试与熔断
+    retry_max_attempts: int = 4
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 20.0
+    retry_budget_ratio: float = 0.2
+    retry_budget_min_tokens: float = 10.0
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: float = 30.0
+    
+    # 对冲请求：补全超过该模型 p95 延迟仍未返回时发出备份请求
+    hedging_enabled: bool = False
+    hedging_quantile: float = 0.95
+    hedging_min_samples: int = 20
+    hedging_min_delay: float = 1.0
+    # 备份请求改用的模型，如 {"anthropic/claude-3.5-sonnet": "openai/gpt-4o-mini"}；未配置时用原模型
+    hedging_fallback_models: Dict[str, str] = {}
+    
+    # 相同请求的 single-flight 合并
+    single_flight_enabled: bool = True
+    
+    # Stage2 并发提示词生成
+    stage2_max_concurrency: int = 8
+    
+    # Stage2 批量提示词生成
+    stage2_batch_enabled: bool = False
+    stage2_batch_max_scenes: int = 8
+    stage2_batch_max_tokens: int = 4096
+    stage2_tokens_per_scene: int = 350
+    
+    # Stage3 并发图像生成：并发上限、每个场景最多尝试次数、重试的初始退避间隔（秒，逐次翻倍）
+    stage3_max_concurrency: int = 4
+    stage3_scene_attempts: int = 2
+    stage3_retry_delay: float = 1.0
+    
+    # Stage1 后端：llm（调用模型）或 draft（规则分镜，不调用模型，用于预览和压测）
+    stage1_mode: str = "llm"
+    
+    # Stage1 融合模式：分析时顺带输出每个场景的图像提示词，Stage2 只为缺少提示词的场景调用模型
+    stage1_fused_prompts: bool = False
+    
+    # LLM 结构化输出使用紧凑格式（短键名、无空白），本地展开为完整 schema，减少输出 token
+    llm_compact_output: bool = False
+    
+    # 在提示词的固定前缀和角色表末尾加 cache_control 断点（Anthropic 模型需要显式断点才会缓存提示词）
+    llm_prompt_cache_control: bool = True
+    
+    # Stage1 流式输出：场景一生成完就开始 Stage2
+    stage1_streaming: bool = True
+    
+    # Stage1 长文本分块分析（map-reduce）：超过阈值的文本按章节/段落切块并发分析
+    stage1_chunk_threshold_chars: int = 12000
+    stage1_chunk_max_chars: int = 8000
+    stage1_max_concurrency: int = 4
+    
+    # Stage1 先出大纲再分批展开：场景数较多时避免单次输出过长、被截断
+    stage1_outline_min_scenes: int = 30
+    stage1_outline_batch_size: int = 10
+    
     class Config:
         env_file = ".env"
 
@@ -1,14 +1,35 @@
+import json
+from contextlib import asynccontextmanager
+from pathlib import Path
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
 from app.models.schemas import Stage1Output, Stage2Output, Stage3Output, Stage4Output, Stage5Output
 from app.api.router import api_router
+from app.services.http_pool import close_http_client
+from app.services.llm_cache import get_llm_cache
+from app.services.adaptive_limiter import model_limiters
+from app.services.resilience import resilience_policies
+from app.services.single_flight import single_flights
+from app.services.usage_tracker import usage_tracker
+from app.services.hedging import model_latencies
+from app.services.task_orchestrator import DEFAULT_OUTPUT_BASE_DIR
+from app.services.stage1_validation import Stage1ValidationError
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 关闭所有阶段共享的 HTTP 连接池
+    await close_http_client()
+
 
 app = FastAPI(
     title="Big Niu - Text to Video API",
     description="智能文字生成视频系统",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -28,6 +49,8 @@ app.include_router(api_router)
 class TextAnalysisRequest(BaseModel):
     story_text: str
     scenes_count: Optional[int] = 10
+    # llm 或 draft（规则分镜草稿，不调用模型）；默认读取 STAGE1_MODE
+    mode: Optional[str] = None
 
 
 class ImagePromptRequest(BaseModel):
@@ -59,25 +82,91 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/api/v1/metrics")
+async def metrics():
+    llm_cache = get_llm_cache()
+    return {
+        "llm_cache": llm_cache.stats() if llm_cache else {"enabled": False},
+        "concurrency": model_limiters.stats(),
+        "resilience": resilience_policies.stats(),
+        "single_flight": single_flights.stats(),
+        "latency": model_latencies.stats(),
+    }
+
+
+@app.get("/api/v1/usage")
+async def usage():
+    return usage_tracker.stats()
+
+
+def _load_task_metadata(task_id: str) -> dict:
+    metadata_file = Path(DEFAULT_OUTPUT_BASE_DIR) / task_id / "task_metadata.json"
+    if not task_id.startswith("task_") or ".." in task_id or not metadata_file.is_file():
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    
+    with open(metadata_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@app.get("/api/v1/usage/{task_id}")
+async def task_usage(task_id: str):
+    # 进程内有统计时直接返回；否则读取已落盘的 task_metadata.json
+    summary = usage_tracker.task_summary(task_id)
+    if summary is not None:
+        return {"task_id": task_id, "usage": summary}
+    
+    metadata = _load_task_metadata(task_id)
+    return {"task_id": task_id, "usage": metadata.get("usage")}
+
+
+@app.get("/api/v1/tasks/{task_id}/images")
+async def task_images(task_id: str):
+    # Stage3 运行中每完成一张图像就会更新 output.json，这里返回目前已完成的图像
+    stage3 = _load_task_metadata(task_id).get("stages", {}).get("stage3", {})
+    
+    output_file = Path(DEFAULT_OUTPUT_BASE_DIR) / task_id / "stage3" / "output.json"
+    output = {}
+    if stage3.get("status") in ("running", "completed", "failed") and output_file.is_file():
+        with open(output_file, "r", encoding="utf-8") as f:
+            output = json.load(f)
+    
+    images = output.get("images", [])
+    return {
+        "task_id": task_id,
+        "status": stage3.get("status", "pending"),
+        "completed_images": stage3.get("completed_images", stage3.get("images_count", len(images))),
+        "total_images": stage3.get("total_images"),
+        "images": images,
+        "failures": output.get("failures", []),
+    }
+
+
 @app.post("/api/v1/stage1/analyze", response_model=Stage1Output)
 async def stage1_analyze_text(request: TextAnalysisRequest):
     try:
         from app.services.stage1_text_analysis import Stage1TextAnalysisService
         
-        service = Stage1TextAnalysisService()
+        service = Stage1TextAnalysisService(mode=request.mode)
         result = await service.analyze_text(
             story_text=request.story_text,
             scenes_count=request.scenes_count
         )
         
-        if not service.validate_output(result):
-            raise HTTPException(
-                status_code=500,
-                detail="Generated output validation failed"
-            )
+        issues = service.validation_issues(result)
+        if issues:
+            raise Stage1ValidationError(issues)
         
         return result
     
+    except Stage1ValidationError as e:
+        # 本地修复和重新请求后仍有问题，逐条返回
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "message": "Generated output validation failed",
+                "errors": [issue.to_dict() for issue in e.issues],
+            }
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -7,6 +7,7 @@ class Character(BaseModel):
     name: str = Field(..., description="角色名称")
     description: str = Field(..., description="外貌特征描述")
     personality: Optional[str] = Field(None, description="性格特点")
+    aliases: List[str] = Field(default_factory=list, description="别名/其他称呼")
 
 
 class Dialogue(BaseModel):
@@ -23,6 +24,10 @@ class Scene(BaseModel):
     characters: List[str] = Field(default_factory=list, description="涉及角色ID列表")
     narration: str = Field(..., description="旁白文字")
     dialogues: List[Dialogue] = Field(default_factory=list, description="对话列表")
+    # 融合模式下 Stage1 直接给出的图像提示词，Stage2 原样使用
+    image_prompt: Optional[str] = Field(None, description="图像生成提示词(融合模式)")
+    negative_prompt: Optional[str] = Field(None, description="负向提示词(融合模式)")
+    style_tags: List[str] = Field(default_factory=list, description="风格标签(融合模式)")
 
 
 class Metadata(BaseModel):
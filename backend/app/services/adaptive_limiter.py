@@ -0,0 +1,185 @@
+"""
+自适应并发控制 - 按模型的 AIMD 并发窗口
+
+- 请求成功：窗口加性增长（每完成一个窗口的请求 +additive_increase）
+- 收到 429/5xx 过载响应或超时：窗口乘性收缩（× multiplicative_decrease）
+- 响应带 Retry-After 时，在该时间点之前不再放行新请求
+
+这样吞吐量会自动收敛到服务商的真实限额，而不是一次性把所有场景打过去被限流。
+"""
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, Optional
+
+from app.config import settings
+
+
+# 视为服务端过载的状态码
+OVERLOAD_STATUS_CODES = {429, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AIMDLimiter:
+    def __init__(
+        self,
+        initial_limit: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 32,
+        additive_increase: float = 1.0,
+        multiplicative_decrease: float = 0.5,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        
+        self.in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        
+        self._started = 0
+        self._decrease_epoch = 0
+        self._blocked_until = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+    
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+    
+    def _wake_waiters(self):
+        self._wake_handle = None
+        
+        delay = self._blocked_until - time.monotonic()
+        if delay > 0:
+            # Retry-After 期间排队中的请求也不放行，到期后再唤醒
+            self._schedule_wake(delay)
+            return
+        
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if waiter.done() or waiter.get_loop().is_closed():
+                continue
+            # 先占住名额再唤醒，避免被新来的请求插队
+            self.in_flight += 1
+            waiter.set_result(None)
+    
+    def _schedule_wake(self, delay: float):
+        waiter = next((w for w in self._waiters if not w.done() and not w.get_loop().is_closed()), None)
+        if waiter is None:
+            return
+        
+        if self._wake_handle is not None:
+            self._wake_handle.cancel()
+        self._wake_handle = waiter.get_loop().call_later(delay, self._wake_waiters)
+    
+    async def acquire(self) -> int:
+        """
+        占用一个并发名额，返回本次请求的序号
+        
+        序号用于判断过载信号属于哪一轮窗口：同一窗口内的多次 429 只收缩一次。
+        """
+        delay = self._blocked_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._blocked_until - time.monotonic()
+        
+        if self._has_capacity() and not self._waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 已经分到名额但调用方被取消，归还名额
+                    self.in_flight -= 1
+                    self._wake_waiters()
+                raise
+        
+        self._started += 1
+        return self._started
+    
+    def release(self, ticket: int, outcome: str = "success", retry_after: Optional[float] = None):
+        """
+        归还名额并根据结果调整窗口
+        
+        outcome: success（成功，窗口增长）/ overload（过载，窗口收缩）/ error（其它失败，窗口不变）
+        """
+        self.in_flight -= 1
+        
+        if outcome == "overload":
+            self.overloads += 1
+            # 只对上一次收缩之后发出的请求做出反应
+            if ticket > self._decrease_epoch:
+                self.limit = max(self.min_limit, self.limit * self.multiplicative_decrease)
+                self._decrease_epoch = self._started
+        elif outcome == "success":
+            self.successes += 1
+            self.limit = min(self.max_limit, self.limit + self.additive_increase / self.limit)
+        
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        
+        self._wake_waiters()
+    
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": sum(1 for w in self._waiters if not w.done()),
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+        }
+
+
+class ModelLimiterRegistry:
+    """每个模型一个 AIMDLimiter，进程内共享"""
+    
+    def __init__(self):
+        self._limiters: Dict[str, AIMDLimiter] = {}
+    
+    def get(self, model: str) -> AIMDLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = AIMDLimiter(
+                initial_limit=settings.llm_concurrency_initial,
+                min_limit=settings.llm_concurrency_min,
+                max_limit=settings.llm_concurrency_max,
+                additive_increase=settings.llm_concurrency_increase,
+                multiplicative_decrease=settings.llm_concurrency_decrease,
+            )
+            self._limiters[model] = limiter
+        return limiter
+    
+    def stats(self) -> Dict[str, dict]:
+        return {model: limiter.stats() for model, limiter in self._limiters.items()}
+
+
+model_limiters = ModelLimiterRegistry()
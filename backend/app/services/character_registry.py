@@ -0,0 +1,275 @@
+"""
+角色身份合并 - 把分块/增量分析中重复出现的同一角色合并为一个
+
+同一角色在不同块里可能以不同称呼出现（"李明"、"小李"、"李先生"、"阿明"），
+这里维护几张索引，按固定顺序匹配，保证合并结果与输入顺序一致、可复现：
+
+1. 全名/别名精确匹配（归一化后）
+2. 称呼匹配：去掉 小/老/阿 前缀和 先生/姐/哥 等后缀后的核心，与已有全名的姓或名匹配；
+   反过来，全名的姓或名也会匹配已登记为纯称呼的角色
+3. 模糊匹配：非中文、同首字母、同长度（≥4）且只差一个字符的名字（如拼写差异）
+
+候选不唯一时视为歧义，不合并。所有索引都是哈希表或按 (首字, 长度) 分桶，
+加入 n 个角色的总耗时接近线性。
+"""
+
+import re
+import unicodedata
+from typing import Collection, Dict, Iterable, List, Optional, Set
+
+from app.models.schemas import Character, Scene
+from app.services.stage1_validation import STUB_DESCRIPTION
+
+
+COMPOUND_SURNAMES = {
+    "欧阳", "司马", "上官", "诸葛", "东方", "慕容", "皇甫", "令狐", "夏侯", "独孤",
+    "南宫", "公孙", "长孙", "宇文", "司徒", "端木", "尉迟", "西门", "轩辕", "澹台",
+}
+
+NICKNAME_PREFIXES = ("小", "老", "阿")
+
+HONORIFIC_SUFFIXES = (
+    "先生", "女士", "小姐", "老师", "师傅", "师父", "大人", "公子", "姑娘", "同学",
+    "教授", "医生", "队长", "将军", "总", "哥", "姐", "叔", "婶", "爷", "伯", "妹", "弟",
+)
+
+_PUNCTUATION = re.compile(r"[\s·・.\-_'\"“”‘’()（）]+")
+
+
+def normalize_name(name: str) -> str:
+    """全角转半角、去空白和标点、转小写"""
+    return _PUNCTUATION.sub("", unicodedata.normalize("NFKC", name)).lower()
+
+
+def is_cjk(text: str) -> bool:
+    return bool(text) and all("一" <= ch <= "鿿" for ch in text)
+
+
+def split_chinese_name(name: str):
+    """拆成 (姓, 名)；不像中文全名时返回 None"""
+    if not is_cjk(name) or not 2 <= len(name) <= 4:
+        return None
+    surname = name[:2] if name[:2] in COMPOUND_SURNAMES else name[:1]
+    given = name[len(surname):]
+    return (surname, given) if given else None
+
+
+def nickname_core(name: str) -> Optional[str]:
+    """去掉称呼前缀/后缀后的核心部分；name 不是称呼时返回 None"""
+    if not is_cjk(name):
+        return None
+    
+    core = name
+    if len(core) >= 2 and core.startswith(NICKNAME_PREFIXES):
+        core = core[1:]
+    for suffix in HONORIFIC_SUFFIXES:
+        if len(core) > len(suffix) and core.endswith(suffix):
+            core = core[:-len(suffix)]
+            break
+    
+    return core if core != name and 1 <= len(core) <= 2 else None
+
+
+def edit_distance_one(a: str, b: str) -> bool:
+    """等长字符串是否恰好相差一个字符"""
+    return len(a) == len(b) and sum(x != y for x, y in zip(a, b)) == 1
+
+
+class CharacterRegistry:
+    def __init__(self):
+        self.characters: List[Character] = []
+        self._by_id: Dict[str, int] = {}
+        
+        # 归一化全名/别名 -> 角色 ID
+        self._exact: Dict[str, str] = {}
+        # 全名角色的姓、名 -> 角色 ID 集合
+        self._surnames: Dict[str, Set[str]] = {}
+        self._given_names: Dict[str, Set[str]] = {}
+        # 以称呼登记的角色：称呼核心 -> 角色 ID 集合
+        self._nicknames: Dict[str, Set[str]] = {}
+        # (首字, 长度) -> 角色 ID 集合，用于模糊匹配
+        self._buckets: Dict[tuple, Set[str]] = {}
+    
+    # ========== 查询 ==========
+    
+    def resolve(self, name: str, aliases: Iterable[str] = ()) -> Optional[str]:
+        """按匹配顺序查找已登记的角色 ID，找不到或有歧义时返回 None"""
+        keys = [normalize_name(n) for n in (name, *aliases) if n and n.strip()]
+        
+        for key in keys:
+            if key in self._exact:
+                return self._exact[key]
+        
+        for key in keys:
+            match = self._match_nickname(key)
+            if match is not None:
+                return match
+        
+        for key in keys:
+            match = self._match_fuzzy(key)
+            if match is not None:
+                return match
+        
+        return None
+    
+    def _unique(self, *candidate_sets: Optional[Set[str]]) -> Optional[str]:
+        candidates: Set[str] = set()
+        for ids in candidate_sets:
+            if ids:
+                candidates |= ids
+        return next(iter(candidates)) if len(candidates) == 1 else None
+    
+    def _match_nickname(self, key: str) -> Optional[str]:
+        core = nickname_core(key)
+        if core is not None:
+            # "李明先生" -> 核心本身就是已登记的全名
+            if core in self._exact:
+                return self._exact[core]
+            # "小李" / "李先生" / "阿明" -> 与全名的姓或名、或同核心的称呼匹配
+            return self._unique(
+                self._surnames.get(core),
+                self._given_names.get(core),
+                self._nicknames.get(core),
+            )
+        
+        parts = split_chinese_name(key)
+        if parts is not None:
+            # 全名 "李明" -> 匹配已登记为 "小李"、"阿明" 的角色
+            surname, given = parts
+            return self._unique(self._nicknames.get(surname), self._nicknames.get(given))
+        
+        return None
+    
+    def _match_fuzzy(self, key: str) -> Optional[str]:
+        # 中文名差一个字往往就是不同的人（"路人甲"/"路人乙"），只对拼音/外文名做模糊匹配
+        if len(key) < 4 or is_cjk(key) or any(ch.isdigit() for ch in key):
+            return None
+        candidates = {
+            char_id
+            for char_id in self._buckets.get((key[0], len(key)), ())
+            if any(
+                edit_distance_one(key, normalize_name(n))
+                for n in self._names_of(char_id)
+                if len(normalize_name(n)) == len(key)
+            )
+        }
+        return self._unique(candidates)
+    
+    def _names_of(self, char_id: str) -> List[str]:
+        character = self.characters[self._by_id[char_id]]
+        return [character.name, *character.aliases]
+    
+    # ========== 登记与合并 ==========
+    
+    def add(self, character: Character, exclude: Collection[str] = ()) -> str:
+        """
+        登记一个角色，返回其全局 ID（与已有角色合并时返回已有 ID）
+        
+        exclude 是不能合并进去的全局 ID：同一块里已经对应了别的局部角色，
+        "李明" 和 "小李" 同时出现在一块里时是两个人，匹配到这些 ID 时登记为新角色。
+        """
+        existing = self.resolve(character.name, character.aliases)
+        if existing is None or existing in exclude:
+            return self.add_new(character)
+        
+        self._merge_into(existing, character)
+        return existing
+    
+    def add_new(self, character: Character) -> str:
+        """不做匹配，直接登记为新角色（用于名称不可信的占位角色），返回新的全局 ID"""
+        char_id = f"char_{len(self.characters) + 1:03d}"
+        self._by_id[char_id] = len(self.characters)
+        self.characters.append(character.model_copy(update={"id": char_id, "aliases": []}))
+        self._index(char_id, character.name)
+        for alias in character.aliases:
+            self._add_alias(char_id, alias)
+        return char_id
+    
+    def _merge_into(self, char_id: str, incoming: Character):
+        index = self._by_id[char_id]
+        current = self.characters[index]
+        
+        # 全名优先作为正式名称，称呼降为别名
+        names = [current.name, *current.aliases, incoming.name, *incoming.aliases]
+        canonical = current.name
+        if self._is_nickname(current.name) and not self._is_nickname(incoming.name):
+            canonical = incoming.name
+        
+        aliases: List[str] = []
+        seen = {normalize_name(canonical)}
+        for name in names:
+            key = normalize_name(name)
+            if key and key not in seen:
+                seen.add(key)
+                aliases.append(name)
+        
+        self.characters[index] = current.model_copy(update={
+            "name": canonical,
+            "aliases": aliases,
+            # 外貌描述保留信息更多的一份，供图像生成使用
+            "description": max(current.description, incoming.description, key=len),
+            "personality": current.personality or incoming.personality,
+        })
+        
+        for name in names:
+            if normalize_name(name) not in self._exact:
+                self._index(char_id, name)
+    
+    def _add_alias(self, char_id: str, alias: str):
+        character = self.characters[self._by_id[char_id]]
+        if normalize_name(alias) not in {normalize_name(n) for n in self._names_of(char_id)}:
+            self.characters[self._by_id[char_id]] = character.model_copy(
+                update={"aliases": [*character.aliases, alias]}
+            )
+        self._index(char_id, alias)
+    
+    @staticmethod
+    def _is_nickname(name: str) -> bool:
+        return nickname_core(normalize_name(name)) is not None
+    
+    def _index(self, char_id: str, name: str):
+        key = normalize_name(name)
+        if not key:
+            return
+        self._exact.setdefault(key, char_id)
+        
+        core = nickname_core(key)
+        if core is not None:
+            self._nicknames.setdefault(core, set()).add(char_id)
+        else:
+            parts = split_chinese_name(key)
+            if parts is not None:
+                self._surnames.setdefault(parts[0], set()).add(char_id)
+                self._given_names.setdefault(parts[1], set()).add(char_id)
+        
+        self._buckets.setdefault((key[0], len(key)), set()).add(char_id)
+
+
+def remap_scene(scene: Scene, id_map: Dict[str, str], registry: Optional[CharacterRegistry] = None) -> Scene:
+    """
+    把场景中的角色引用改写为全局 ID
+    
+    id_map 中没有的局部 ID 不能原样保留，否则可能与其他块的全局 ID 撞号：
+    给出 registry 时登记为新的占位角色并写回 id_map，否则抛出 ValueError。
+    """
+    def global_id(char_id: str) -> str:
+        if char_id not in id_map:
+            if registry is None:
+                raise ValueError(f"Unknown character reference {char_id} in {scene.scene_id}")
+            placeholder = Character(id=char_id, name=char_id, description=STUB_DESCRIPTION)
+            id_map[char_id] = registry.add_new(placeholder)
+        return id_map[char_id]
+    
+    characters: List[str] = []
+    for char_id in scene.characters:
+        mapped = global_id(char_id)
+        if mapped not in characters:
+            characters.append(mapped)
+    
+    return scene.model_copy(update={
+        "characters": characters,
+        "dialogues": [
+            dialogue.model_copy(update={"character": global_id(dialogue.character)})
+            for dialogue in scene.dialogues
+        ],
+    })
@@ -0,0 +1,283 @@
+"""
+规则分镜 - 不调用 LLM 的 Stage1 草稿后端
+
+按段落和句子切分场景、用引号提取对话、按引号前后 "某某说：" 之类的句式推断说话人，
+输出符合 Stage1Output 的草稿。只做一次线性扫描，百万字小说也能在一秒内完成，
+用于预览和压测；角色外貌等字段都是占位内容。
+"""
+
+import bisect
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.models.schemas import Character, Dialogue, Metadata, Scene, Stage1Output
+from app.services.text_chunking import is_chapter_heading
+
+
+DRAFT_BACKEND = "draft-segmenter"
+
+SPEECH_VERB = r"(?:说|道|问|喊|答|叫|喝)[道着]?"
+QUOTE_PATTERN = re.compile(r"[“「\"]([^”」\"\n]{1,300})[”」\"]")
+# 引号前以说话动词结尾的句子（"苏晴笑道："）和引号后含说话动词的句子（"悟空落下云头，对唐僧说道。"）
+LEADING_ATTRIBUTION = re.compile(SPEECH_VERB + r"[：:，,]?\s*$")
+TRAILING_ATTRIBUTION = re.compile(SPEECH_VERB + r"(?=[，,。：:！!？?…\s]|$)")
+# 生成旁白时连同引号前的 "某某说：" 一起去掉
+DIALOGUE_PATTERN = re.compile(
+    r"(?:[^，,。！？!?…：:“”「」\"\n]{0,12}" + SPEECH_VERB + r"[：:，,]\s*)?" + QUOTE_PATTERN.pattern
+)
+# 句子：引号内的句末标点不算句子结束，引号和后面的 "某某说道。" 留在同一句里
+SENTENCE_PATTERN = re.compile(r"(?:[“「][^”」\n]*[”」]?|\"[^\"\n]*\"?|[^。！？!?…“「\"])+[。！？!?…]*")
+QUOTE_CHARS = str.maketrans("", "", "“”「」\"")
+SENTENCE_BREAK = re.compile(r"[。！？!?…]")
+CLAUSE_BREAK = re.compile(r"[，,；;：:、]")
+# 小句开头（行首或标点、引号之后）的汉字，用来统计候选人名出现的次数
+CLAUSE_HEAD_PATTERN = re.compile(r"(?:^|(?<=[，,。！？!?…；;：:、“”「」\"\s]))[一-鿿]{2,4}")
+
+# 人名在神态词、说话动词或介词处结束："欧阳锋低声道" -> 欧阳锋，"猪八戒在一旁插嘴道" -> 猪八戒
+NAME_BOUNDARIES = (
+    "冷笑", "低声", "轻声", "大声", "笑", "叹", "怒", "说", "道", "问", "喊", "答", "叫", "喝",
+    "在", "对", "向", "把", "被", "则", "也", "又", "便", "就", "却", "将", "从",
+)
+MAX_NAME_CHARS = 4
+
+# 含代词、以虚词开头、以助词结尾（"憨厚地"、"挑着"）或含说话类动词（"嘟囔"）的候选不是人名
+NOT_NAME_CHARS = set("他她它我你们这那谁")
+NOT_NAME_PREFIXES = set("是就又便才也却于和与对向把被在")
+NOT_NAME_SUFFIXES = set("地着了的得过里")
+NOT_NAME_WORDS = (
+    "嘟囔", "嘀咕", "喃喃", "插嘴", "自语", "低语", "惊呼", "大喊", "回答", "开口", "说话",
+    "叹息", "点头", "摇头", "吼", "嚷", "骂", "念叨", "补充", "解释", "抱怨", "附和",
+)
+
+COMPOSITIONS = ["远景，平视", "中景，平视", "近景，平视", "特写，平视"]
+MAX_DIALOGUES_PER_SCENE = 8
+MAX_NARRATION_CHARS = 200
+MAX_CHARACTERS = 20
+UNKNOWN_SPEAKER = "路人"
+DEFAULT_CHARACTER = "主角"
+
+
+def _is_name(candidate: Optional[str]) -> bool:
+    return (
+        bool(candidate)
+        and len(candidate) >= 2
+        and candidate[0] not in NOT_NAME_PREFIXES
+        and candidate[-1] not in NOT_NAME_SUFFIXES
+        and not any(ch in NOT_NAME_CHARS for ch in candidate)
+        and not any(word in candidate for word in NOT_NAME_WORDS)
+    )
+
+
+def _count_clause_heads(units: List[str]) -> Dict[str, int]:
+    """统计每个小句开头 2~4 个字的各个前缀出现的次数"""
+    heads = Counter(head for unit in units for head in CLAUSE_HEAD_PATTERN.findall(unit))
+    counts: Dict[str, int] = Counter()
+    for head, count in heads.items():
+        for size in range(2, len(head) + 1):
+            counts[head[:size]] += count
+    return counts
+
+
+def _leading_name(clause: str, clause_heads: Dict[str, int]) -> Optional[str]:
+    """
+    小句开头的人名
+    
+    先截到第一个神态词/动词/介词/说话类动词之前；再按出现次数定长度：
+    "唐僧双手合十" 中 "唐僧" 在小句开头出现的次数多于 "唐僧双"，取 "唐僧"。
+    """
+    match = re.match(r"[一-鿿]+", clause)
+    if not match:
+        return None
+    
+    head = match.group(0)
+    bound = next(
+        (i for i in range(MAX_NAME_CHARS + 1) if head.startswith(NAME_BOUNDARIES + NOT_NAME_WORDS, i)),
+        MAX_NAME_CHARS,
+    )
+    bound = min(bound, len(head))
+    if bound < 2:
+        return None
+    
+    name = head[:2]
+    for size in range(3, bound + 1):
+        if clause_heads.get(head[:size], 0) < clause_heads.get(name, 0):
+            break
+        name = head[:size]
+    
+    return name if _is_name(name) else None
+
+
+def _attribution_speaker(sentence: str, clause_heads: Dict[str, int]) -> Optional[str]:
+    """
+    sentence 以说话动词结尾，返回其中的说话人
+    
+    优先取说话动词所在小句的开头；该小句没有主语（"冷笑道"、"对唐僧说道"），
+    或开头的词只出现过这一次（"嘟囔道"）时，取句首小句的主语。
+    """
+    clauses = [clause.strip() for clause in CLAUSE_BREAK.split(sentence.strip())]
+    clauses = [clause for clause in clauses if clause]
+    if not clauses:
+        return None
+    
+    name = _leading_name(clauses[-1], clause_heads)
+    if name and (len(clauses) == 1 or clause_heads.get(name, 0) > 1):
+        return name
+    return _leading_name(clauses[0], clause_heads) if len(clauses) > 1 else None
+
+
+def _extract_dialogues(
+    unit: str,
+    clause_heads: Dict[str, int],
+    speakers: Dict[str, Optional[str]],
+) -> List[Tuple[Optional[str], str]]:
+    """
+    提取段落中的对话；引号前有 "某某说：" 时以它为准，否则看引号后的 "某某说道。"
+    
+    speakers 缓存 说话句 -> 说话人，小说里同样的说话句会反复出现。
+    """
+    quotes = list(QUOTE_PATTERN.finditer(unit))
+    dialogues = []
+    
+    for i, quote in enumerate(quotes):
+        before = unit[quotes[i - 1].end() if i else 0:quote.start()]
+        before = SENTENCE_BREAK.split(before)[-1]
+        after = unit[quote.end():quotes[i + 1].start() if i + 1 < len(quotes) else len(unit)]
+        after = SENTENCE_BREAK.split(after)[0]
+        
+        sentence = None
+        leading = LEADING_ATTRIBUTION.search(before)
+        if leading:
+            sentence = before[:leading.end()]
+        else:
+            trailing = TRAILING_ATTRIBUTION.search(after)
+            if trailing:
+                sentence = after[:trailing.end()]
+        
+        speaker = None
+        if sentence is not None:
+            if sentence not in speakers:
+                speakers[sentence] = _attribution_speaker(sentence, clause_heads)
+            speaker = speakers[sentence]
+        
+        dialogues.append((speaker, quote.group(1).strip()))
+    
+    return dialogues
+
+
+def _split_units(text: str, scenes_count: int) -> List[str]:
+    """切成段落；段落数不够分时再按句子切"""
+    units = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(units) >= scenes_count:
+        return units
+    return [s.strip() for unit in units for s in SENTENCE_PATTERN.findall(unit) if s.strip()] or units
+
+
+def _group_units(units: List[str], scenes_count: int) -> List[Tuple[int, int]]:
+    """按累计长度把单元均分成 scenes_count 组，返回每组的 [start, end)"""
+    count = min(scenes_count, len(units))
+    cumulative = []
+    total = 0
+    for unit in units:
+        total += len(unit)
+        cumulative.append(total)
+    
+    bounds = [0]
+    for k in range(1, count):
+        # 第 k 个切分点落在累计长度 total*k/count 处，且每组至少一个单元
+        index = bisect.bisect_left(cumulative, total * k / count) + 1
+        index = max(bounds[-1] + 1, min(index, len(units) - (count - k)))
+        # 切分点附近有章节标题时对齐到标题
+        if index + 1 < len(units) and is_chapter_heading(units[index + 1]) and index + 1 <= len(units) - (count - k):
+            index += 1
+        bounds.append(index)
+    bounds.append(len(units))
+    
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _title(units: List[str]) -> str:
+    """首行较短、不以句末标点结尾且不是章节标题时当作书名"""
+    first = units[0] if units else ""
+    if first and len(first) <= 30 and first[-1] not in "。！？!?…”」\"" and not is_chapter_heading(first):
+        return first
+    return "未命名故事"
+
+
+def segment_text(text: str, scenes_count: int) -> Stage1Output:
+    """把文本切成 scenes_count 个草稿场景"""
+    units = _split_units(text, scenes_count)
+    if not units:
+        raise ValueError("Story text cannot be empty")
+    
+    groups = _group_units(units, scenes_count)
+    
+    clause_heads = _count_clause_heads(units)
+    speakers: Dict[str, Optional[str]] = {}
+    
+    # 第一遍：每组的对话和说话人，同时统计说话人出现次数
+    scene_dialogues: List[List[Tuple[Optional[str], str]]] = []
+    speaker_counts: Dict[str, int] = {}
+    for start, end in groups:
+        dialogues = []
+        for unit in units[start:end]:
+            for speaker, line in _extract_dialogues(unit, clause_heads, speakers):
+                if speaker:
+                    speaker_counts[speaker] = speaker_counts.get(speaker, 0) + 1
+                dialogues.append((speaker, line))
+        scene_dialogues.append(dialogues)
+    
+    # 出现最多的说话人作为角色（按首次出现的顺序编号），其余对话归到占位角色
+    top = set(sorted(speaker_counts, key=lambda name: -speaker_counts[name])[:MAX_CHARACTERS])
+    ordered_names = [name for name in speaker_counts if name in top]
+    character_ids = {name: f"char_{i:03d}" for i, name in enumerate(ordered_names, 1)}
+    
+    if any(speaker not in character_ids for dialogues in scene_dialogues for speaker, _ in dialogues):
+        character_ids[UNKNOWN_SPEAKER] = f"char_{len(character_ids) + 1:03d}"
+    if not character_ids:
+        # Stage1Output 至少需要一个角色
+        character_ids[DEFAULT_CHARACTER] = "char_001"
+    
+    characters = [
+        Character(id=char_id, name=name, description=f"{name}（草稿占位，外貌待补充）", personality=None)
+        for name, char_id in character_ids.items()
+    ]
+    
+    scenes = []
+    for order, ((start, end), dialogues) in enumerate(zip(groups, scene_dialogues), 1):
+        body = "\n".join(units[start:end])
+        narration = DIALOGUE_PATTERN.sub("", body).replace("\n", "").strip()
+        if not narration and dialogues:
+            # 全是对话的场景：用说话人和第一句对话作旁白，避免空场景
+            speakers = "、".join(dict.fromkeys(speaker or UNKNOWN_SPEAKER for speaker, _ in dialogues))
+            narration = f"{speakers}说：{dialogues[0][1]}"
+        
+        plain_body = body.translate(QUOTE_CHARS).replace("\n", "")
+        first_sentence = SENTENCE_PATTERN.match(narration or plain_body)
+        description = (first_sentence.group(0) if first_sentence else plain_body).translate(QUOTE_CHARS).strip()
+        
+        scene_dialogue_models = [
+            Dialogue(character=character_ids.get(speaker, character_ids.get(UNKNOWN_SPEAKER)), text=line)
+            for speaker, line in dialogues[:MAX_DIALOGUES_PER_SCENE]
+        ]
+        scene_characters = list(dict.fromkeys(d.character for d in scene_dialogue_models))
+        
+        scenes.append(Scene(
+            scene_id=f"scene_{order:03d}",
+            order=order,
+            description=(description or plain_body)[:60],
+            composition=COMPOSITIONS[(order - 1) % len(COMPOSITIONS)],
+            characters=scene_characters,
+            narration=narration[:MAX_NARRATION_CHARS],
+            dialogues=scene_dialogue_models,
+        ))
+    
+    return Stage1Output(
+        metadata=Metadata(
+            total_scenes=len(scenes),
+            story_title=_title(units),
+            total_characters=len(characters),
+        ),
+        characters=characters,
+        scenes=scenes,
+    )
@@ -0,0 +1,165 @@
+"""
+对冲请求 - 按模型的延迟直方图自动决定何时发出备份请求
+
+一次补全超过该模型观测到的 p95 仍未返回时，再发一个相同的请求（可改用配置的备用模型），
+谁先成功用谁，另一个取消。直方图按对数分桶、样本超过窗口后整体减半，
+因此阈值会随服务商的实时延迟自动调整，不需要手工设定超时。
+"""
+
+import asyncio
+import math
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图（秒），内存占用固定"""
+    
+    def __init__(
+        self,
+        min_value: float = 0.01,
+        max_value: float = 600.0,
+        growth: float = 1.25,
+        window: int = 1000,
+    ):
+        self.min_value = min_value
+        self.growth = growth
+        self.window = window
+        
+        bucket_count = int(math.ceil(math.log(max_value / min_value, growth))) + 1
+        self.bounds: List[float] = [min_value * growth ** i for i in range(bucket_count)]
+        self.counts: List[float] = [0.0] * bucket_count
+        self.total = 0.0
+        self.observed = 0
+    
+    def _bucket(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        index = int(math.ceil(math.log(value / self.min_value, self.growth)))
+        return min(index, len(self.bounds) - 1)
+    
+    def observe(self, value: float):
+        self.counts[self._bucket(value)] += 1
+        self.total += 1
+        self.observed += 1
+        
+        # 超过窗口后整体衰减，让旧样本的权重逐渐降低
+        if self.total > self.window:
+            self.counts = [count / 2 for count in self.counts]
+            self.total /= 2
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """返回 q 分位数所在桶的上界；没有样本时返回 None"""
+        if self.total <= 0:
+            return None
+        
+        target = q * self.total
+        cumulative = 0.0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.bounds[-1]
+    
+    def stats(self) -> dict:
+        return {
+            "samples": self.observed,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class ModelLatencyRegistry:
+    """
+    每个模型一个延迟直方图，同时记录对冲次数
+    
+    同一模型在不同阶段的输出长度差别很大（Stage1 整篇分镜 vs Stage2 单个提示词），
+    因此直方图的键为 "模型@阶段"，见 latency_key()。
+    """
+    
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self.hedges: Dict[str, int] = {}
+        self.hedge_wins: Dict[str, int] = {}
+    
+    def get(self, key: str) -> LatencyHistogram:
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self._histograms[key] = histogram
+        return histogram
+    
+    def observe(self, key: str, latency: float):
+        self.get(key).observe(latency)
+    
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """该直方图的对冲触发时间；样本不足时返回 None（不对冲）"""
+        histogram = self._histograms.get(key)
+        if histogram is None or histogram.observed < settings.hedging_min_samples:
+            return None
+        
+        delay = histogram.quantile(settings.hedging_quantile)
+        return max(delay, settings.hedging_min_delay)
+    
+    def stats(self) -> Dict[str, dict]:
+        return {
+            key: {
+                **histogram.stats(),
+                "hedges": self.hedges.get(key, 0),
+                "hedge_wins": self.hedge_wins.get(key, 0),
+            }
+            for key, histogram in self._histograms.items()
+        }
+
+
+def latency_key(model: str, stage: str) -> str:
+    return f"{model}@{stage}"
+
+
+async def hedged_call(
+    key: str,
+    primary: Callable[[], Awaitable],
+    backup: Callable[[], Awaitable],
+    delay: Optional[float],
+    registry: ModelLatencyRegistry,
+):
+    """
+    先执行 primary，超过 delay 秒仍未完成时再并发执行 backup，返回先成功的结果
+    
+    一方失败时继续等另一方；两方都失败时抛出 primary 的异常。
+    """
+    if delay is None:
+        return await primary()
+    
+    primary_task = asyncio.ensure_future(primary())
+    backup_task = None
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done:
+            return primary_task.result()
+        
+        registry.hedges[key] = registry.hedges.get(key, 0) + 1
+        print(f"⏱️  {key} 超过 {delay:.1f}s 未返回，发出对冲请求")
+        backup_task = asyncio.ensure_future(backup())
+        pending = {primary_task, backup_task}
+        
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup_task:
+                        registry.hedge_wins[key] = registry.hedge_wins.get(key, 0) + 1
+                    return task.result()
+        
+        # 两个请求都失败
+        return primary_task.result()
+    finally:
+        # 调用方被取消或已有结果时，取消仍在进行的请求
+        for task in (primary_task, backup_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+model_latencies = ModelLatencyRegistry()
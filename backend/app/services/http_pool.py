@@ -0,0 +1,74 @@
+"""
+共享 HTTP 连接池 - 所有阶段复用同一个 httpx.AsyncClient
+
+每次请求都新建 AsyncClient 会让每个场景重复付出 TCP+TLS 握手的开销，
+这里改为应用生命周期内只维护一个连接池（HTTP/2 + keep-alive），
+在 FastAPI 关闭时统一释放。
+"""
+
+import asyncio
+from typing import Optional
+
+import httpx
+
+from app.config import settings
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+    timeout = httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout)
+    
+    return httpx.AsyncClient(
+        http2=settings.http2_enabled and HTTP2_AVAILABLE,
+        limits=limits,
+        timeout=timeout,
+    )
+
+
+def _current_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取共享的 AsyncClient（惰性创建）
+    
+    连接绑定在创建它的事件循环上，如果调用方换了事件循环
+    （例如脚本里多次 asyncio.run），会重新建立连接池。
+    """
+    global _client, _client_loop
+    
+    loop = _current_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = _build_client()
+        _client_loop = loop
+    
+    return _client
+
+
+async def close_http_client():
+    """关闭共享连接池（在应用关闭时调用）"""
+    global _client, _client_loop
+    
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    
+    _client = None
+    _client_loop = None
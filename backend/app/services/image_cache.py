@@ -0,0 +1,224 @@
+"""
+图像缓存 - 以生成参数寻址、落盘存储的 Stage3 图像缓存
+
+缓存键为 (最终提示词, 负向提示词, 模型, 尺寸, 质量) 的 SHA-256。
+重跑任务或不同任务出现相同场景时，直接把缓存中的图像硬链接（或 reflink）到任务目录，
+不再重复调用图像模型。
+
+索引文件 index.json 记录 key -> (文件大小, 宽, 高)，按最近使用顺序排列；
+查找只查内存中的索引，不扫描目录。总大小超过 max_bytes 时淘汰最久未使用的条目，
+已链接到任务目录的文件不受影响。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+INDEX_FILE = "index.json"
+
+# Linux FICLONE ioctl：在支持的文件系统（btrfs、xfs）上做写时复制的克隆
+FICLONE = 0x40049409
+
+
+def make_image_key(
+    prompt: str,
+    negative_prompt: Optional[str],
+    model: str,
+    size: str,
+    quality: str,
+    encoding: str = "",
+) -> str:
+    """对生成参数做规范化序列化后取 SHA-256；encoding 为输出文件的编码参数（见 image_io.encoding_spec）"""
+    canonical = json.dumps(
+        [prompt, negative_prompt or "", model, size, quality, encoding],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def link_file(source: Path, target: Path):
+    """优先硬链接，跨文件系统时尝试 reflink，最后退回复制；目标已存在时先删除，避免改写共享的 inode"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        target.unlink()
+    
+    try:
+        os.link(source, target)
+        return
+    except OSError:
+        pass
+    
+    if fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    
+    shutil.copyfile(source, target)
+
+
+class ImageCache:
+    """
+    磁盘 LRU 图像缓存
+    
+    - 每个条目一个图像文件：<cache_dir>/<key[:2]>/<key>（格式由键中的编码参数决定）
+    - 索引保存在 <cache_dir>/index.json，新增或淘汰条目时原子写回；
+      命中只调整内存中的顺序，下一次写回时一并保存
+    """
+    
+    def __init__(
+        self,
+        cache_dir: str = "./output/cache/images",
+        max_bytes: int = 2 * 1024 * 1024 * 1024,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._lock = threading.Lock()
+        # key -> (文件大小, 宽, 高)
+        self._index: "OrderedDict[str, Tuple[int, int, int]]" = OrderedDict()
+        self._total_bytes = 0
+        
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+    
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+    
+    def _load_index(self):
+        path = self.cache_dir / INDEX_FILE
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("entries", [])
+        except (OSError, json.JSONDecodeError, AttributeError):
+            entries = []
+        
+        for key, size, width, height in entries:
+            self._index[key] = (size, width, height)
+            self._total_bytes += size
+        
+        if self._total_bytes > self.max_bytes:
+            # MAX_BYTES 调小后启动
+            self._evict()
+            self._save_index()
+    
+    def _save_index(self):
+        path = self.cache_dir / INDEX_FILE
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": [[key, *entry] for key, entry in self._index.items()]}, f)
+        os.replace(tmp_path, path)
+    
+    def _remove(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[0]
+        try:
+            os.remove(self._path_for(key))
+        except FileNotFoundError:
+            pass
+    
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            self._remove(next(iter(self._index)))
+            self.evictions += 1
+    
+    def link_to(self, key: str, target: str) -> Optional[Tuple[int, int]]:
+        """
+        命中时把缓存的图像链接到 target
+        
+        Returns:
+            (宽, 高)；未命中时返回 None
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            try:
+                link_file(self._path_for(key), Path(target))
+            except FileNotFoundError:
+                # 缓存文件被外部删除
+                self._remove(key)
+                self._save_index()
+                self.misses += 1
+                return None
+            
+            self._index.move_to_end(key)
+            self.hits += 1
+            _, width, height = entry
+            return width, height
+    
+    def store(self, key: str, source: str, width: int, height: int):
+        """把任务目录中刚生成的图像链接进缓存"""
+        with self._lock:
+            path = self._path_for(key)
+            link_file(Path(source), path)
+            
+            size = path.stat().st_size
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[0]
+            self._index[key] = (size, width, height)
+            self._total_bytes += size
+            
+            self._evict()
+            self._save_index()
+    
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+            self._save_index()
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_image_cache: Optional[ImageCache] = None
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """返回进程共享的缓存实例；未开启 IMAGE_CACHE_ENABLED 时返回 None"""
+    global _image_cache
+    
+    if not settings.image_cache_enabled:
+        return None
+    
+    if _image_cache is None:
+        _image_cache = ImageCache(
+            cache_dir=settings.image_cache_dir,
+            max_bytes=settings.image_cache_max_bytes,
+        )
+    
+    return _image_cache
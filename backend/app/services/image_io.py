@@ -0,0 +1,175 @@
+"""
+图像落盘 - 模型返回的图像直接流式写入文件，尽量不在内存中保留完整副本
+
+- data URL：按块解码 base64 写入临时文件，不生成完整的解码结果
+- 图片 URL：流式下载写入临时文件
+- 尺寸只读取文件头（PIL 延迟解码），不解码像素
+- 格式与配置一致时直接改名（passthrough）；需要转换格式或重新压缩时在线程中重新编码
+
+输出格式由 STAGE3_IMAGE_FORMAT（png / webp / jpeg）决定；STAGE3_PNG_COMPRESS_LEVEL 为 -1 时
+PNG 原样保存，0-9 时按该压缩级别重新编码；STAGE3_IMAGE_QUALITY 用于 webp / jpeg。
+"""
+
+import asyncio
+import binascii
+import os
+from typing import Tuple
+from uuid import uuid4
+
+from PIL import Image
+
+from app.config import settings
+from app.services.http_pool import get_http_client
+
+
+# 每次解码的 base64 字符数，需为 4 的倍数
+BASE64_CHUNK_CHARS = 64 * 1024
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+FORMATS = {"png": ("PNG", ".png"), "webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg"), "jpg": ("JPEG", ".jpg")}
+
+
+def output_format() -> Tuple[str, str]:
+    """(PIL 格式名, 文件扩展名)"""
+    name = settings.stage3_image_format.lower()
+    if name not in FORMATS:
+        raise ValueError(f"Unsupported STAGE3_IMAGE_FORMAT: {settings.stage3_image_format}")
+    return FORMATS[name]
+
+
+def output_extension() -> str:
+    return output_format()[1]
+
+
+def encoding_spec() -> str:
+    """输出编码参数的摘要，参与图像缓存的键，格式或压缩参数改变后不会命中旧文件"""
+    pil_format, _ = output_format()
+    if pil_format == "PNG":
+        return f"png:{settings.stage3_png_compress_level}"
+    return f"{pil_format.lower()}:{settings.stage3_image_quality}"
+
+
+def _temp_path(path: str) -> str:
+    return f"{path}.{uuid4().hex}.part"
+
+
+def write_base64(data: str, path: str, chunk_chars: int = BASE64_CHUNK_CHARS) -> int:
+    """
+    把 base64 字符串（可带 data URL 头）按块解码写入文件
+    
+    Returns:
+        写入的字节数
+    """
+    start = data.find(",") + 1 if data.startswith("data:") else 0
+    written = 0
+    pending = ""
+    
+    with open(path, "wb") as f:
+        for offset in range(start, len(data), chunk_chars):
+            # 去掉可能夹杂的换行，不足 4 个字符的尾部留到下一块
+            buffer = pending + "".join(data[offset:offset + chunk_chars].split())
+            usable = len(buffer) - len(buffer) % 4
+            pending = buffer[usable:]
+            written += f.write(binascii.a2b_base64(buffer[:usable]))
+        
+        if pending:
+            written += f.write(binascii.a2b_base64(pending + "=" * (-len(pending) % 4)))
+    
+    return written
+
+
+async def download_to_file(url: str, path: str) -> int:
+    """流式下载图片 URL 到文件，返回写入的字节数"""
+    written = 0
+    async with get_http_client().stream("GET", url) as response:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                written += f.write(chunk)
+    return written
+
+
+def probe_image(path: str) -> Tuple[str, int, int]:
+    """只读取文件头，返回 (格式, 宽, 高)"""
+    with Image.open(path) as image:
+        return image.format, image.width, image.height
+
+
+def _needs_reencode(source_format: str) -> bool:
+    pil_format, _ = output_format()
+    if source_format != pil_format:
+        return True
+    return pil_format == "PNG" and settings.stage3_png_compress_level >= 0
+
+
+def _reencode(source: str, target: str):
+    pil_format, _ = output_format()
+    options = {}
+    if pil_format == "PNG":
+        options["compress_level"] = max(0, settings.stage3_png_compress_level)
+    else:
+        options["quality"] = settings.stage3_image_quality
+    
+    with Image.open(source) as image:
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(target, format=pil_format, **options)
+
+
+def finalize_image(temp_path: str, path: str) -> Tuple[int, int]:
+    """
+    把临时文件按输出格式放到 path；格式一致时直接改名，否则重新编码
+    
+    改名和替换都是原子的，不会改写 path 原有的 inode（可能是图像缓存的硬链接）。
+    
+    Returns:
+        (宽, 高)
+    """
+    try:
+        source_format, width, height = probe_image(temp_path)
+        if _needs_reencode(source_format):
+            encoded_path = _temp_path(path)
+            try:
+                _reencode(temp_path, encoded_path)
+                os.replace(encoded_path, path)
+            finally:
+                if os.path.exists(encoded_path):
+                    os.remove(encoded_path)
+        else:
+            os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    return width, height
+
+
+def save_bytes(data: bytes, path: str) -> Tuple[int, int]:
+    """已在内存中的图像数据按输出格式保存"""
+    temp_path = _temp_path(path)
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    return finalize_image(temp_path, path)
+
+
+async def persist_image(source: str, path: str) -> Tuple[int, int]:
+    """
+    把模型返回的图像（data URL 或图片 URL）写到 path
+    
+    解码和重新编码都在线程中执行，不阻塞事件循环。
+    
+    Returns:
+        (宽, 高)
+    """
+    temp_path = _temp_path(path)
+    try:
+        if source.startswith("data:"):
+            await asyncio.to_thread(write_base64, source, temp_path)
+        else:
+            await download_to_file(source, temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    
+    return await asyncio.to_thread(finalize_image, temp_path, path)
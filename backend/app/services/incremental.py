@@ -0,0 +1,190 @@
+"""
+增量重算 - 修改小说后重新提交同一任务时，只重算改动过的部分
+
+- 文本块指纹：块内容 + 分析模型的 sha256，和该块分到的场景数、分析结果一起保存在
+  stage1/chunks.json。重新提交时未改动的块保持上次的场景数，直接复用上次的结果，不再请求模型
+- 场景指纹：场景内容 + 出场角色（名称与外貌描述）的 sha256。合并后场景可能整体重新编号，
+  因此按指纹而不是 scene_id 匹配上一轮的场景；匹配上的场景复用其提示词、图像等产物
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.models.schemas import Character, Scene, Stage1Output, Stage2Output, Stage3Output
+
+
+CHUNKS_FILE = "chunks.json"
+
+
+def content_hash(value: Any) -> str:
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def chunk_fingerprint(chunk_text: str, backend: Optional[str] = None) -> str:
+    """
+    backend 默认为分析模型；不同后端的结果不能互相复用
+    
+    场景数不计入指纹：别处的改动会让各块分到的场景数整体挪动，场景数另存在 ChunkRecord 中，
+    复用时再比较。
+    """
+    return content_hash([chunk_text, backend or settings.text_analysis_model])
+
+
+def scene_fingerprint(scene: Scene, characters: Dict[str, Character]) -> str:
+    """只包含影响下游产物的字段；角色 ID 换成名称和外貌描述，避免重新编号导致误判"""
+    def describe(char_id: str):
+        character = characters.get(char_id)
+        return [character.name, character.description] if character else char_id
+    
+    return content_hash({
+        "description": scene.description,
+        "composition": scene.composition,
+        "narration": scene.narration,
+        "image_prompt": scene.image_prompt,
+        "characters": [describe(char_id) for char_id in scene.characters],
+        "dialogues": [
+            [describe(dialogue.character), dialogue.text, dialogue.emotion]
+            for dialogue in scene.dialogues
+        ],
+    })
+
+
+def scene_fingerprints(output: Stage1Output) -> Dict[str, str]:
+    """scene_id -> 场景指纹，按场景顺序"""
+    characters = {character.id: character for character in output.characters}
+    return {scene.scene_id: scene_fingerprint(scene, characters) for scene in output.scenes}
+
+
+def match_scenes(previous: Dict[str, str], current: Dict[str, str]) -> Dict[str, str]:
+    """
+    按指纹把本轮场景对应到上一轮场景
+    
+    Returns:
+        本轮 scene_id -> 上一轮 scene_id；同一指纹出现多次时按顺序一一对应
+    """
+    by_fingerprint: Dict[str, List[str]] = {}
+    for scene_id, fingerprint in previous.items():
+        by_fingerprint.setdefault(fingerprint, []).append(scene_id)
+    
+    matches: Dict[str, str] = {}
+    for scene_id, fingerprint in current.items():
+        candidates = by_fingerprint.get(fingerprint)
+        if candidates:
+            matches[scene_id] = candidates.pop(0)
+    return matches
+
+
+@dataclass
+class ChunkRecord:
+    fingerprint: str
+    scenes_count: int
+    output: Stage1Output
+    
+    def to_dict(self) -> dict:
+        return {
+            "fingerprint": self.fingerprint,
+            "scenes_count": self.scenes_count,
+            "output": self.output.model_dump(),
+        }
+
+
+def save_chunk_records(path: Path, records: List[ChunkRecord]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"chunks": [record.to_dict() for record in records]}, f, ensure_ascii=False, indent=2)
+
+
+def load_chunk_records(path: Path) -> Dict[str, ChunkRecord]:
+    """指纹 -> 该块的记录；文件不存在时返回空字典"""
+    if not path.is_file():
+        return {}
+    
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    
+    return {
+        chunk["fingerprint"]: ChunkRecord(
+            fingerprint=chunk["fingerprint"],
+            scenes_count=chunk["scenes_count"],
+            output=Stage1Output(**chunk["output"]),
+        )
+        for chunk in data.get("chunks", [])
+    }
+
+
+@dataclass
+class PreviousRun:
+    """同一任务上一轮运行留下的、可复用的结果"""
+    chunks: Dict[str, ChunkRecord]
+    scenes: Dict[str, str] = field(default_factory=dict)
+    prompts: Dict[str, Stage2Output] = field(default_factory=dict)
+    images: Dict[str, Stage3Output] = field(default_factory=dict)
+
+
+def _load_json(path: Path) -> Optional[dict]:
+    if not path.is_file():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_previous_run(task_dir: Path) -> Optional[PreviousRun]:
+    """读取任务目录中上一轮的产物；没有分块记录（从未运行过）时返回 None"""
+    chunks_file = task_dir / "stage1" / CHUNKS_FILE
+    if not chunks_file.is_file():
+        return None
+    
+    previous = PreviousRun(chunks=load_chunk_records(chunks_file))
+    
+    stage1 = _load_json(task_dir / "stage1" / "output.json")
+    if stage1 is not None:
+        previous.scenes = scene_fingerprints(Stage1Output(**stage1))
+    
+    stage2 = _load_json(task_dir / "stage2" / "output.json")
+    if stage2 is not None:
+        previous.prompts = {p["scene_id"]: Stage2Output(**p) for p in stage2.get("prompts", [])}
+    
+    stage3 = _load_json(task_dir / "stage3" / "output.json")
+    if stage3 is not None:
+        previous.images = {img["scene_id"]: Stage3Output(**img) for img in stage3.get("images", [])}
+    
+    return previous
+
+
+def stash_directory(directory: Path) -> Optional[Path]:
+    """
+    把上一轮的产物目录改名为 <目录>.prev 并重建空目录
+    
+    复用的文件从 .prev 链接回来，避免场景重新编号后新旧文件名互相覆盖。
+    目录为空时返回 None。
+    """
+    if not directory.is_dir() or not any(directory.iterdir()):
+        directory.mkdir(parents=True, exist_ok=True)
+        return None
+    
+    stash = directory.with_name(directory.name + ".prev")
+    if stash.exists():
+        shutil.rmtree(stash)
+    directory.rename(stash)
+    directory.mkdir(parents=True)
+    return stash
+
+
+def reuse_file(old_path: str, stash: Path, target_dir: Path, old_scene_id: str, new_scene_id: str) -> Optional[str]:
+    """把上一轮的产物文件按新的 scene_id 放回目标目录，优先硬链接；源文件不存在时返回 None"""
+    source = stash / Path(old_path).name
+    if not source.is_file():
+        return None
+    
+    target = target_dir / source.name.replace(old_scene_id, new_scene_id, 1)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    return str(target)
@@ -0,0 +1,229 @@
+"""
+容错的结构化输出提取
+
+模型输出常常在 JSON 前后夹带说明文字、```json 代码块，或因 max_tokens 截断而缺少结尾。
+这里先定位最外层 JSON 对象/数组，完整则直接解析；不完整时补全未闭合的字符串和括号、
+去掉结尾多余的逗号和残缺的键后再解析。解析优先使用 orjson，未安装时退回标准库 json。
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+class JSONExtractError(ValueError):
+    """文本中找不到可解析的 JSON"""
+
+
+@dataclass
+class ExtractedJSON:
+    value: Any
+    # 原文中的 JSON 是否完整闭合（False 表示经过了截断修复）
+    complete: bool
+    # 从原文中截取出的 JSON 片段（修复前）
+    raw: str
+
+
+def loads(text: str) -> Any:
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError as e:
+            # orjson 的异常继承自 json.JSONDecodeError，统一向上抛标准类型
+            raise json.JSONDecodeError(str(e), text, 0) from e
+    return json.loads(text)
+
+
+def _scan(text: str, start: int):
+    """
+    从 start 处的 { 或 [ 开始扫描
+    
+    返回 (结束位置或 None, 未闭合的括号栈, 是否停在字符串内部)
+    """
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    
+    for pos in range(start, len(text)):
+        ch = text[pos]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return pos, stack, False
+    
+    return None, stack, in_string
+
+
+def _strip_dangling(fragment: str) -> str:
+    """去掉截断处残缺的尾部：逗号、冒号、没有值的键、半个字面量"""
+    while True:
+        stripped = fragment.rstrip()
+        if stripped.endswith((",", ":")):
+            fragment = stripped[:-1]
+            continue
+        
+        # 截断在 true / false / null 或数字中间
+        tail = len(stripped)
+        while tail > 0 and (stripped[tail - 1].isalnum() or stripped[tail - 1] in "+-."):
+            tail -= 1
+        if tail < len(stripped):
+            token = stripped[tail:]
+            if token not in ("true", "false", "null") and not _is_number(token):
+                fragment = stripped[:tail]
+                continue
+        
+        # 对象里只剩一个孤立的键："key" 后面没有冒号
+        if stripped.endswith('"'):
+            key_start = _string_start(stripped)
+            if key_start is not None:
+                before = stripped[:key_start].rstrip()
+                if before.endswith(("{", ",")) and _inside_object(before):
+                    fragment = before
+                    continue
+        
+        # 数组里刚开了头的下一个元素：丢弃整个空壳而不是补成 {}
+        if stripped.endswith(("{", "[")) and stripped[:-1].rstrip().endswith(","):
+            fragment = stripped[:-1].rstrip()[:-1]
+            continue
+        
+        return stripped
+
+
+def _is_number(token: str) -> bool:
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def _string_start(text: str) -> Optional[int]:
+    """text 以一个完整字符串结尾时，返回该字符串起始引号的位置"""
+    pos = len(text) - 2
+    while pos >= 0:
+        if text[pos] == '"':
+            backslashes = 0
+            while pos - backslashes - 1 >= 0 and text[pos - backslashes - 1] == "\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return pos
+        pos -= 1
+    return None
+
+
+def _inside_object(text: str) -> bool:
+    """text 末尾所处的最内层容器是否为对象"""
+    _, stack, _ = _scan(text, 0)
+    return bool(stack) and stack[-1] == "{"
+
+
+def _repair(fragment: str) -> str:
+    """补全被截断的 JSON 片段"""
+    _, stack, in_string = _scan(fragment, 0)
+    if in_string:
+        # 截断在转义符后面时，先去掉孤立的反斜杠
+        if fragment.endswith("\\") and not fragment.endswith("\\\\"):
+            fragment = fragment[:-1]
+        fragment += '"'
+    
+    fragment = _strip_dangling(fragment)
+    _, stack, _ = _scan(fragment, 0)
+    
+    closers = {"{": "}", "[": "]"}
+    return fragment + "".join(closers[ch] for ch in reversed(stack))
+
+
+def _remove_trailing_commas(text: str) -> str:
+    """去掉 } 或 ] 前多余的逗号（字符串内部的不动）"""
+    out = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            # 回退掉前面的空白和逗号
+            idx = len(out) - 1
+            while idx >= 0 and out[idx].isspace():
+                idx -= 1
+            if idx >= 0 and out[idx] == ",":
+                del out[idx]
+        out.append(ch)
+    return "".join(out)
+
+
+def _find_start(text: str, begin: int = 0) -> Optional[int]:
+    """begin 之后第一个 { 或 [ 的位置"""
+    starts = [pos for pos in (text.find("{", begin), text.find("[", begin)) if pos != -1]
+    return min(starts) if starts else None
+
+
+def extract_json(text: str) -> ExtractedJSON:
+    """
+    从模型输出中提取并解析最外层 JSON，必要时修复截断
+    
+    正文里可能先出现不是 JSON 的括号（如 "结果 [v2]: {...}"），
+    某个候选起点闭合后解析失败时，跳过这一段继续尝试后面的起点。
+    """
+    start = _find_start(text)
+    if start is None:
+        raise JSONExtractError("No JSON object or array found in response")
+    
+    error = None
+    while start is not None:
+        end, _, _ = _scan(text, start)
+        
+        if end is None:
+            raw = text[start:]
+            try:
+                repaired = _remove_trailing_commas(_repair(raw))
+                return ExtractedJSON(loads(repaired), complete=False, raw=raw)
+            except json.JSONDecodeError as e:
+                raise JSONExtractError(f"Failed to repair truncated JSON response: {e}") from e
+        
+        raw = text[start:end + 1]
+        try:
+            return ExtractedJSON(loads(raw), complete=True, raw=raw)
+        except json.JSONDecodeError:
+            pass
+        try:
+            return ExtractedJSON(loads(_remove_trailing_commas(raw)), complete=True, raw=raw)
+        except json.JSONDecodeError as e:
+            error = e
+        
+        start = _find_start(text, end + 1)
+    
+    raise JSONExtractError(f"Failed to parse JSON response: {error}") from error
+
+
+def is_complete_json(text: str) -> bool:
+    """text 中是否包含一个完整闭合且能解析的 JSON 对象/数组"""
+    try:
+        return extract_json(text).complete
+    except JSONExtractError:
+        return False
@@ -0,0 +1,126 @@
+"""
+增量 JSON 解析 - 边接收流式输出边产出数组元素
+
+模型按 {"metadata": ..., "characters": [...], "scenes": [...]} 的格式输出时，
+每当根对象下被关注的数组（如 characters / scenes）中的一个元素完整闭合，
+就立即把它解析出来，而不必等整段 JSON 结束。
+"""
+
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+from app.services.json_extract import JSONExtractError, extract_json
+
+
+class IncrementalJSONParser:
+    def __init__(self, stream_keys: Iterable[str] = ("characters", "scenes")):
+        self.stream_keys = set(stream_keys)
+        
+        self._text = ""
+        self._pos = 0
+        
+        self._root_start: Optional[int] = None
+        self._root_end: Optional[int] = None
+        
+        # 容器栈：每项为 [类型 '{' 或 '[', 当前键, 元素起始位置]
+        self._stack: List[list] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+    
+    @property
+    def done(self) -> bool:
+        return self._root_end is not None
+    
+    @property
+    def text(self) -> str:
+        """目前为止收到的全部文本"""
+        return self._text
+    
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """送入一段文本，返回本次新完成的 (数组键, 元素) 列表"""
+        self._text += chunk
+        events = []
+        
+        text = self._text
+        while self._pos < len(text) and not self.done:
+            ch = text[self._pos]
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = self._decode_string(text[self._string_start:self._pos + 1])
+            elif self._root_start is None:
+                # 跳过 ```json 等前缀，直到根对象开始
+                if ch == "{":
+                    self._root_start = self._pos
+                    self._stack.append(["{", None, None])
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = self._pos
+            elif ch == ":":
+                self._stack[-1][1] = self._last_string
+            elif ch in "{[":
+                if self._is_streamed_array(self._stack):
+                    self._stack[-1][2] = self._pos
+                self._stack.append([ch, None, None])
+            elif ch in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    self._root_end = self._pos
+                elif self._is_streamed_array(self._stack) and self._stack[-1][2] is not None:
+                    start = self._stack[-1][2]
+                    self._stack[-1][2] = None
+                    element = self._decode_element(text[start:self._pos + 1])
+                    if element is not None:
+                        events.append((self._stack[-2][1], element))
+            
+            self._pos += 1
+        
+        return events
+    
+    @staticmethod
+    def _decode_string(raw: str) -> str:
+        """键名字符串；含非法转义时直接取引号内的原文"""
+        try:
+            return json.loads(raw, strict=False)
+        except json.JSONDecodeError:
+            return raw[1:-1]
+    
+    @staticmethod
+    def _decode_element(raw: str) -> Optional[Any]:
+        """
+        解析一个已闭合的数组元素；格式有误（如多余的逗号）时用容错提取修复
+        
+        仍无法解析时跳过，不产出该元素，留给流结束后对全文的容错提取。
+        """
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            pass
+        try:
+            extracted = extract_json(raw)
+        except JSONExtractError:
+            return None
+        return extracted.value if extracted.complete else None
+    
+    def _is_streamed_array(self, stack: List[list]) -> bool:
+        """栈顶是否为根对象下被关注的数组"""
+        return (
+            len(stack) == 2
+            and stack[-1][0] == "["
+            and stack[0][1] in self.stream_keys
+        )
+    
+    def result(self) -> Any:
+        """解析完整文档（流结束后调用）"""
+        if self._root_start is None:
+            raise ValueError("No JSON object found in streamed content")
+        
+        end = self._root_end + 1 if self._root_end is not None else len(self._text)
+        return json.loads(self._text[self._root_start:end])
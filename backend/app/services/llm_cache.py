@@ -0,0 +1,185 @@
+"""
+LLM 响应缓存 - 以请求内容寻址、落盘存储的 structured_completion 结果缓存
+
+缓存键为 (model, messages, temperature, max_tokens) 的 SHA-256，
+值为解析后的 JSON。重跑任务或重新提交相同文本时可以直接命中，
+不再重复调用模型。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+
+def make_cache_key(model: str, messages: list, temperature: float, max_tokens: int) -> str:
+    """对请求参数做规范化序列化后取 SHA-256"""
+    canonical = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    磁盘 LRU 缓存
+    
+    - 每个条目一个 JSON 文件：<cache_dir>/<key[:2]>/<key>.json
+    - 内存中维护 key -> 文件大小 的有序索引，总大小超过 max_bytes 时淘汰最久未使用的条目
+    - 条目写入超过 ttl_seconds 后视为过期
+    """
+    
+    def __init__(
+        self,
+        cache_dir: str = "./output/cache/llm",
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+    
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+    
+    def _load_index(self):
+        """启动时扫描一次缓存目录，按访问时间重建 LRU 顺序"""
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        
+        self._evict()
+    
+    def _remove(self, key: str):
+        size = self._index.pop(key, 0)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path_for(key))
+        except FileNotFoundError:
+            pass
+    
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            key = next(iter(self._index))
+            self._remove(key)
+            self.evictions += 1
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            
+            path = self._path_for(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._remove(key)
+                self.misses += 1
+                return None
+            
+            if time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            # 更新 LRU 顺序，并刷新文件 mtime 以便重启后保留访问顺序
+            self._index.move_to_end(key)
+            os.utime(path)
+            
+            self.hits += 1
+            return entry["value"]
+    
+    def set(self, key: str, value: Any):
+        data = json.dumps(
+            {"created_at": time.time(), "value": value},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        
+        with self._lock:
+            path = self._path_for(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            
+            self._total_bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            
+            self._evict()
+    
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+_llm_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """返回进程共享的缓存实例；未开启 LLM_CACHE_ENABLED 时返回 None"""
+    global _llm_cache
+    
+    if not settings.llm_cache_enabled:
+        return None
+    
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache(
+            cache_dir=settings.llm_cache_dir,
+            max_bytes=settings.llm_cache_max_bytes,
+            ttl_seconds=settings.llm_cache_ttl_seconds,
+        )
+    
+    return _llm_cache
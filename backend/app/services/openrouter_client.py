@@ -1,46 +1,390 @@
-import httpx
+import asyncio
 import json
-from typing import Optional
+import time
+import httpx
+from typing import Any, AsyncIterator, Iterable, Optional, Tuple
 from app.config import settings
+from app.services.http_pool import get_http_client
+from app.services.adaptive_limiter import OVERLOAD_STATUS_CODES, model_limiters, parse_retry_after
+from app.services.resilience import resilience_policies
+from app.services.json_stream import IncrementalJSONParser
+from app.services.single_flight import single_flights
+from app.services.llm_cache import LLMResponseCache, get_llm_cache, make_cache_key
+from app.services.json_extract import JSONExtractError, extract_json, is_complete_json
+from app.services.usage_tracker import UsageAccumulator, UsageRecord, usage_tracker
+from app.services.hedging import hedged_call, latency_key, model_latencies
+
+
+# 截断续写时追加的用户消息
+CONTINUATION_PROMPT = (
+    "你的上一条回复因长度限制被截断。请从中断处紧接着继续输出剩余内容，"
+    "不要重复已输出的部分，不要添加任何解释或代码块标记。"
+)
 
 
 class OpenRouterClient:
-    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        cache: Optional[LLMResponseCache] = None,
+        name: str = "default",
+    ):
         self.api_key = api_key or settings.openrouter_api_key
         self.base_url = base_url or settings.openrouter_base_url
+        self.cache = cache or get_llm_cache()
+        self.name = name
+        self.usage = UsageAccumulator()
         
         if not self.api_key:
             raise ValueError("OpenRouter API key is required. Set OPENROUTER_API_KEY in .env file")
     
+    def _build_headers(self, extra_headers: Optional[dict] = None) -> dict:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        if extra_headers:
+            headers.update(extra_headers)
+        return headers
+    
+    def record_usage(self, model: str, stage: str, usage: Optional[dict], latency: float):
+        """记录一次调用的 token 用量、费用和耗时（客户端、全局和当前任务三处累加）"""
+        record = UsageRecord.from_usage(model, stage, usage, latency)
+        if record.cached_tokens:
+            print(f"💾 {stage} 提示词缓存命中 {record.cached_tokens}/{record.prompt_tokens} tokens ({record.cache_hit_rate:.0%})")
+        self.usage.add(record)
+        usage_tracker.record(self.name, record)
+    
+    async def post_chat(
+        self,
+        payload: dict,
+        extra_headers: Optional[dict] = None,
+        endpoint: str = "openrouter.chat",
+        stream: bool = False,
+    ) -> httpx.Response:
+        """
+        发送 /chat/completions 请求（文本和图像生成共用）
+        
+        请求经过该端点的重试/熔断策略，每次尝试都会占用该模型的 AIMD 并发名额，
+        并把响应状态反馈给限流器。stream=True 时返回未读取的流式响应，调用方负责关闭。
+        """
+        url = f"{self.base_url}/chat/completions"
+        headers = self._build_headers(extra_headers)
+        policy = resilience_policies.get(endpoint)
+        
+        return await policy.call(lambda: self._send_once(url, headers, payload, stream=stream))
+    
+    async def _send_once(
+        self,
+        url: str,
+        headers: dict,
+        payload: dict,
+        stream: bool = False,
+    ) -> httpx.Response:
+        client = get_http_client()
+        request = client.build_request("POST", url, headers=headers, json=payload)
+        
+        if not settings.llm_concurrency_enabled:
+            return await client.send(request, stream=stream)
+        
+        # 流式请求只在收到响应头之前占用并发名额
+        limiter = model_limiters.get(payload["model"])
+        ticket = await limiter.acquire()
+        outcome = "error"
+        retry_after = None
+        try:
+            response = await client.send(request, stream=stream)
+            
+            if response.status_code in OVERLOAD_STATUS_CODES:
+                outcome = "overload"
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            elif response.is_success:
+                outcome = "success"
+            
+            return response
+        except httpx.TimeoutException:
+            outcome = "overload"
+            raise
+        finally:
+            limiter.release(ticket, outcome=outcome, retry_after=retry_after)
+    
     async def chat_completion(
         self,
         messages: list,
         model: str,
         temperature: float = 0.7,
         max_tokens: int = 4096,
+        stage: str = "unknown",
     ) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
+        result = await self.chat_completion_raw(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stage=stage,
+        )
+        
+        return result["choices"][0]["message"]["content"]
+    
+    async def chat_completion_raw(
+        self,
+        messages: list,
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        stage: str = "unknown",
+    ) -> dict:
+        """返回完整的响应 JSON（含 finish_reason、usage 等）"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "usage": {"include": True},
         }
         
+        # 完全相同的并发请求只发一次
+        flight_key = make_cache_key(model, messages, temperature, max_tokens)
+        return await single_flights.get("openrouter.chat").do(
+            flight_key,
+            lambda: self._hedged_completion(payload, stage),
+        )
+    
+    async def _hedged_completion(self, payload: dict, stage: str) -> dict:
+        """超过该模型在该阶段的 p95 延迟仍未返回时，发出备份请求（可切换到备用模型）"""
+        if not settings.hedging_enabled:
+            return await self._chat_completion_once(payload, stage)
+        
+        key = latency_key(payload["model"], stage)
+        fallback = settings.hedging_fallback_models.get(payload["model"])
+        backup_payload = {**payload, "model": fallback} if fallback else payload
+        
+        return await hedged_call(
+            key,
+            primary=lambda: self._chat_completion_once(payload, stage),
+            backup=lambda: self._chat_completion_once(backup_payload, stage),
+            delay=model_latencies.hedge_delay(key),
+            registry=model_latencies,
+        )
+    
+    async def _chat_completion_once(self, payload: dict, stage: str) -> dict:
+        start = time.monotonic()
+        response = await self.post_chat(payload)
+        response.raise_for_status()
+        result = response.json()
+        
+        latency = time.monotonic() - start
+        model_latencies.observe(latency_key(payload["model"], stage), latency)
+        self.record_usage(payload["model"], stage, result.get("usage"), latency)
+        return result
+    
+    async def stream_chat_completion(
+        self,
+        messages: list,
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        stage: str = "unknown",
+        outcome: Optional[dict] = None,
+    ) -> AsyncIterator[str]:
+        """
+        以 SSE 流式方式请求，逐段产出模型输出的文本增量
+        
+        传入 outcome 时，流结束后其中的 "finish_reason" 为模型返回的结束原因。
+        """
         payload = {
             "model": model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
+            "stream": True,
+            "usage": {"include": True},
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=payload,
-            )
-            response.raise_for_status()
-            result = response.json()
+        start = time.monotonic()
+        usage = None
+        response = await self.post_chat(payload, stream=True)
+        try:
+            if not response.is_success:
+                await response.aread()
+                response.raise_for_status()
             
-            return result["choices"][0]["message"]["content"]
+            async for line in response.aiter_lines():
+                # 跳过空行和 ": OPENROUTER PROCESSING" 之类的注释行
+                if not line.startswith("data:"):
+                    continue
+                
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise ValueError(f"Stream error: {chunk['error']}")
+                
+                # usage 在最后一个数据块中返回
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                
+                choices = chunk.get("choices") or [{}]
+                if outcome is not None and choices[0].get("finish_reason"):
+                    outcome["finish_reason"] = choices[0]["finish_reason"]
+                
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+        finally:
+            await response.aclose()
+            self.record_usage(model, stage, usage, time.monotonic() - start)
+    
+    async def stream_structured_completion(
+        self,
+        messages: list,
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        stream_keys: Iterable[str] = ("characters", "scenes"),
+        bypass_cache: bool = False,
+        stage: str = "unknown",
+    ) -> AsyncIterator[Tuple[Optional[str], Any]]:
+        """
+        流式结构化输出
+        
+        根对象中 stream_keys 数组的每个元素一旦完整就产出 (key, element)，
+        最后产出 (None, 完整结果)。命中缓存时按相同顺序回放缓存结果。
+        
+        输出因 max_tokens 截断时与非流式路径一样请求续写；续写部分整段收到后再送入解析器。
+        只有完整解析的结果才写入缓存。
+        """
+        cache_key = None
+        if self.cache is not None and not bypass_cache:
+            cache_key = make_cache_key(model, messages, temperature, max_tokens)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                for event in self._replay_stream(cached, stream_keys):
+                    yield event
+                return
+        
+        # 相同的流式请求正在进行时，等待它的完整结果后按顺序回放
+        done = None
+        if settings.single_flight_enabled:
+            flight = single_flights.get("openrouter.chat.stream")
+            flight_key = make_cache_key(model, messages, temperature, max_tokens)
+            shared = flight.join(flight_key)
+            if shared is not None:
+                result = await asyncio.shield(shared)
+                for event in self._replay_stream(result, stream_keys):
+                    yield event
+                return
+            
+            done = asyncio.get_running_loop().create_future()
+            flight.register(flight_key, done)
+        
+        try:
+            parser = IncrementalJSONParser(stream_keys)
+            emitted = {}
+            outcome = {}
+            async for delta in self.stream_chat_completion(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stage=stage,
+                outcome=outcome,
+            ):
+                for key, element in parser.feed(delta):
+                    emitted[key] = emitted.get(key, 0) + 1
+                    yield key, element
+            
+            for _ in range(settings.llm_max_continuations):
+                if outcome.get("finish_reason") != "length" or parser.done:
+                    break
+                
+                print(f"✂️  Streamed response from {model} truncated at max_tokens, requesting continuation")
+                outcome = {}
+                piece = ""
+                async for delta in self.stream_chat_completion(
+                    messages=messages + [
+                        {"role": "assistant", "content": parser.text},
+                        {"role": "user", "content": CONTINUATION_PROMPT},
+                    ],
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stage=stage,
+                    outcome=outcome,
+                ):
+                    piece += delta
+                
+                parser, events = self._feed_continuation(parser, piece, stream_keys, emitted)
+                for key, element in events:
+                    emitted[key] = emitted.get(key, 0) + 1
+                    yield key, element
+            
+            complete = True
+            try:
+                result = parser.result()
+            except json.JSONDecodeError:
+                # 流被截断或夹带了多余内容时，退回容错提取
+                try:
+                    extracted = extract_json(parser.text)
+                except JSONExtractError as e:
+                    raise ValueError(f"Failed to parse streamed JSON response: {e}")
+                result = extracted.value
+                complete = extracted.complete
+        except Exception as e:
+            if done is not None and not done.done():
+                done.set_exception(e)
+            raise
+        except BaseException:
+            # 领头方被取消或提前停止迭代：让等待方收到明确的错误而不是被连带取消
+            if done is not None and not done.done():
+                done.set_exception(ValueError("Shared streaming request was aborted"))
+            raise
+        
+        if done is not None:
+            done.set_result(result)
+        
+        # 修复过的截断结果可能缺少尾部内容，不写入缓存
+        if not complete:
+            print(f"⚠️  Repaired truncated streamed JSON response from {model} ({len(parser.text)} chars)")
+        elif cache_key is not None:
+            self.cache.set(cache_key, result)
+        
+        yield None, result
+    
+    def _feed_continuation(
+        self,
+        parser: IncrementalJSONParser,
+        piece: str,
+        stream_keys: Iterable[str],
+        emitted: dict,
+    ) -> Tuple[IncrementalJSONParser, list]:
+        """
+        把续写内容接到解析器后面，返回 (解析器, 新完成的元素)
+        
+        模型从头重新输出完整 JSON 时换用新的解析器，已经产出过的元素不再重复产出。
+        """
+        joined = self._join_continuation(parser.text, piece)
+        if joined.startswith(parser.text):
+            return parser, parser.feed(joined[len(parser.text):])
+        
+        parser = IncrementalJSONParser(stream_keys)
+        seen = {}
+        events = []
+        for key, element in parser.feed(joined):
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > emitted.get(key, 0):
+                events.append((key, element))
+        return parser, events
+    
+    @staticmethod
+    def _replay_stream(result: dict, stream_keys: Iterable[str]):
+        for key in stream_keys:
+            for element in result.get(key, []):
+                yield key, element
+        yield None, result
     
     async def structured_completion(
         self,
@@ -48,24 +392,91 @@ class OpenRouterClient:
         model: str,
         temperature: float = 0.7,
         max_tokens: int = 4096,
+        bypass_cache: bool = False,
+        stage: str = "unknown",
     ) -> dict:
-        content = await self.chat_completion(
+        cache_key = None
+        if self.cache is not None and not bypass_cache:
+            cache_key = make_cache_key(model, messages, temperature, max_tokens)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        result = await self.chat_completion_raw(
             messages=messages,
             model=model,
             temperature=temperature,
             max_tokens=max_tokens,
+            stage=stage,
         )
-        
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
+        content = await self._continue_truncated(messages, model, temperature, max_tokens, result, stage)
         
         try:
-            return json.loads(content)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Failed to parse JSON response: {e}\nContent: {content}")
+            extracted = extract_json(content)
+        except JSONExtractError as e:
+            raise ValueError(f"{e}\nContent: {content}")
+        
+        # 修复过的截断结果可能缺少尾部内容，不写入缓存
+        if not extracted.complete:
+            print(f"⚠️  Repaired truncated JSON response from {model} ({len(extracted.raw)} chars)")
+        elif cache_key is not None:
+            self.cache.set(cache_key, extracted.value)
+        
+        return extracted.value
+    
+    async def _continue_truncated(
+        self,
+        messages: list,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        result: dict,
+        stage: str,
+    ) -> str:
+        """
+        输出因 max_tokens 截断时，请求模型从断点接着输出剩余部分
+        
+        只补发"已输出内容 + 继续"的短对话，而不是用更大的 max_tokens 重跑整个提示词。
+        """
+        choice = result["choices"][0]
+        content = choice["message"]["content"] or ""
+        finish_reason = choice.get("finish_reason")
+        
+        for _ in range(settings.llm_max_continuations):
+            if finish_reason != "length" or is_complete_json(content):
+                break
+            
+            print(f"✂️  Response from {model} truncated at max_tokens, requesting continuation")
+            continuation = await self.chat_completion_raw(
+                messages=messages + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": CONTINUATION_PROMPT},
+                ],
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stage=stage,
+            )
+            choice = continuation["choices"][0]
+            finish_reason = choice.get("finish_reason")
+            content = self._join_continuation(content, choice["message"]["content"] or "")
+        
+        return content
+    
+    @staticmethod
+    def _join_continuation(content: str, piece: str) -> str:
+        piece = piece.strip()
+        if piece.startswith("```json"):
+            piece = piece[7:]
+        if piece.startswith("```"):
+            piece = piece[3:]
+        if piece.endswith("```"):
+            piece = piece[:-3]
+        
+        # 模型没有接着写而是从头重新输出了完整 JSON 时，直接采用新的输出
+        head = content.strip()
+        head = head[head.find("{"):] if "{" in head else head
+        if head and piece.lstrip().startswith(head[:32]) and is_complete_json(piece):
+            return piece
+        
+        return content + piece
@@ -0,0 +1,57 @@
+"""
+前缀稳定的提示词布局 - 让模型服务商的提示词缓存（prompt caching）能够命中
+
+服务商按前缀缓存提示词：只有从第一个字符起完全相同的部分才能复用。
+因此提示词按变化频率从低到高排列：
+- static：固定的角色设定、输出格式和要求，所有调用相同
+- shared：同一个故事内共用的内容（角色表、原文、大纲），同一任务的多次调用相同
+- dynamic：每次调用不同的内容（场景信息、场景数、要展开的场景）
+
+OpenAI、DeepSeek、Gemini 等模型对相同前缀自动缓存；Anthropic 模型需要显式的
+cache_control 断点，LLM_PROMPT_CACHE_CONTROL 开启时在 static 和 shared 的末尾各加一个。
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from app.config import settings
+
+
+SECTION_SEPARATOR = "\n\n"
+
+
+@dataclass
+class PromptLayout:
+    static: str
+    shared: str = ""
+    dynamic: str = ""
+    
+    def sections(self) -> List[Tuple[str, str]]:
+        named = (("static", self.static), ("shared", self.shared), ("dynamic", self.dynamic))
+        return [(name, section) for name, section in named if section]
+    
+    @property
+    def text(self) -> str:
+        return SECTION_SEPARATOR.join(section for _, section in self.sections())
+    
+    def messages(self) -> List[Dict[str, Any]]:
+        """单条 user 消息；开启 cache_control 时拆成多段，在 static 和 shared 段末尾加断点"""
+        if not settings.llm_prompt_cache_control:
+            return [{"role": "user", "content": self.text}]
+        
+        sections = self.sections()
+        parts = []
+        for index, (name, section) in enumerate(sections):
+            part = {"type": "text", "text": section if index == len(sections) - 1 else section + SECTION_SEPARATOR}
+            if name != "dynamic":
+                part["cache_control"] = {"type": "ephemeral"}
+            parts.append(part)
+        return [{"role": "user", "content": parts}]
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """消息内容的纯文本；content 为多段时按顺序拼接"""
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
@@ -0,0 +1,250 @@
+"""
+外部调用的容错策略 - 重试预算 + 全抖动指数退避 + 按端点熔断
+
+覆盖 OpenRouter 文本、OpenRouter 图像和火山引擎 TTS 三类外部调用：
+- 只重试「幂等」失败：请求没有被处理（连接失败、连接池超时、连接被对端断开）
+  或服务端明确表示可以重试（408/425/429/500/502/503/504）
+- 退避时间取 [0, min(max_delay, base_delay * 2^attempt)] 内的随机值（full jitter），
+  若服务端给了 Retry-After 则至少等待该时长
+- 重试预算：每个原始请求存入 budget_ratio 个令牌，每次重试消耗 1 个，
+  防止故障期间重试把流量放大数倍
+- 熔断器：连续 failure_threshold 次失败后打开，reset_timeout 秒后放行一个探测请求
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from app.config import settings
+from app.services.adaptive_limiter import parse_retry_after
+
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# 这些异常意味着请求没有被服务端处理，可以安全重发
+RETRYABLE_EXCEPTIONS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.RemoteProtocolError,
+)
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+    
+    def __init__(self, endpoint: str, retry_in: float):
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+        super().__init__(f"Circuit open for {endpoint}, retry in {retry_in:.1f}s")
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+    
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+    
+    def allow(self) -> bool:
+        if self.state == self.OPEN and self.retry_in() == 0:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        
+        if self.state == self.CLOSED:
+            return True
+        
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        
+        return False
+    
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+    
+    def release_probe(self):
+        """探测请求被取消时归还探测名额"""
+        self._probe_in_flight = False
+    
+    def record_failure(self):
+        self.consecutive_failures += 1
+        
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+    
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+    
+    def try_withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ResiliencePolicy:
+    """单个外部端点的重试 + 熔断策略"""
+    
+    def __init__(
+        self,
+        endpoint: str,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        breaker: Optional[CircuitBreaker] = None,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.endpoint = endpoint
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.budget_exhausted = 0
+        self.rejected = 0
+    
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+    
+    def _can_retry(self, attempt: int) -> bool:
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if not self.budget.try_withdraw():
+            self.budget_exhausted += 1
+            return False
+        return True
+    
+    async def call(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """
+        执行请求，必要时重试
+        
+        返回最后一次收到的响应（可能仍是错误状态，由调用方决定如何处理）；
+        不可重试的异常或重试次数用尽后的异常会直接抛出。
+        """
+        self.calls += 1
+        self.budget.deposit()
+        
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise CircuitOpenError(self.endpoint, self.breaker.retry_in())
+            
+            try:
+                response = await send()
+            except RETRYABLE_EXCEPTIONS:
+                self.failures += 1
+                self.breaker.record_failure()
+                if not self._can_retry(attempt):
+                    raise
+                retry_after = None
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception:
+                # 读超时等：请求可能已被处理，不重试，但计入端点故障
+                self.failures += 1
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                
+                self.failures += 1
+                # 429 是限流而不是端点故障，交给 AIMD 处理，不计入熔断
+                if response.status_code == 429:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                
+                if not self._can_retry(attempt):
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                # 流式响应需要先关闭，释放连接
+                await response.aclose()
+            
+            self.retries += 1
+            await asyncio.sleep(self.backoff(attempt, retry_after))
+            attempt += 1
+    
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "times_opened": self.breaker.times_opened,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "budget_tokens": round(self.budget.tokens, 2),
+            "budget_exhausted": self.budget_exhausted,
+        }
+
+
+class ResilienceRegistry:
+    """每个外部端点一个 ResiliencePolicy，进程内共享"""
+    
+    def __init__(self):
+        self._policies: Dict[str, ResiliencePolicy] = {}
+    
+    def get(self, endpoint: str) -> ResiliencePolicy:
+        policy = self._policies.get(endpoint)
+        if policy is None:
+            policy = ResiliencePolicy(
+                endpoint=endpoint,
+                max_attempts=settings.retry_max_attempts,
+                base_delay=settings.retry_base_delay,
+                max_delay=settings.retry_max_delay,
+                breaker=CircuitBreaker(
+                    failure_threshold=settings.circuit_failure_threshold,
+                    reset_timeout=settings.circuit_reset_timeout,
+                ),
+                budget=RetryBudget(
+                    ratio=settings.retry_budget_ratio,
+                    min_tokens=settings.retry_budget_min_tokens,
+                ),
+            )
+            self._policies[endpoint] = policy
+        return policy
+    
+    def stats(self) -> Dict[str, dict]:
+        return {endpoint: policy.stats() for endpoint, policy in self._policies.items()}
+
+
+resilience_policies = ResilienceRegistry()
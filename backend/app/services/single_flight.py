@@ -0,0 +1,86 @@
+"""
+Single-flight 请求合并 - 相同请求同时只向上游发出一次
+
+多个客户端提交同一篇小说、或前端重复提交时，会同时发起完全相同的
+Stage1/Stage2/Stage3/Stage4 请求。这里按请求指纹合并：第一个调用方真正发出请求，
+其余并发调用方等待同一个结果。
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.config import settings
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.deduplicated = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+    
+    def join(self, key: str) -> Optional[asyncio.Future]:
+        """返回同一事件循环中正在进行的相同请求，没有则返回 None"""
+        future = self._in_flight.get(key)
+        if future is None or future.done():
+            return None
+        if future.get_loop() is not asyncio.get_running_loop():
+            return None
+        
+        self.deduplicated += 1
+        return future
+    
+    def register(self, key: str, future: asyncio.Future):
+        """登记一个由调用方自己完成的 future（用于流式请求的领头方）"""
+        self.leaders += 1
+        self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+    
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # 标记异常已被读取，避免所有等待方都取消时出现 "exception was never retrieved"
+        if not future.cancelled():
+            future.exception()
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 fn 或加入正在进行的相同调用
+        
+        上游请求在独立 Task 中运行并通过 shield 等待，
+        因此某个等待方被取消不会影响其它等待方。
+        """
+        if not settings.single_flight_enabled:
+            return await fn()
+        
+        future = self.join(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self.register(key, future)
+        
+        return await asyncio.shield(future)
+    
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._in_flight),
+        }
+
+
+class SingleFlightRegistry:
+    def __init__(self):
+        self._groups: Dict[str, SingleFlight] = {}
+    
+    def get(self, name: str) -> SingleFlight:
+        group = self._groups.get(name)
+        if group is None:
+            group = SingleFlight(name)
+            self._groups[name] = group
+        return group
+    
+    def stats(self) -> Dict[str, dict]:
+        return {name: group.stats() for name, group in self._groups.items()}
+
+
+single_flights = SingleFlightRegistry()
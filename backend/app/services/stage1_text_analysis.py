@@ -1,24 +1,97 @@
-from typing import Optional
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
 from app.config import settings
 from app.models.schemas import Stage1Output, Character, Scene, Metadata, Dialogue
 from app.services.openrouter_client import OpenRouterClient
+from app.services.text_chunking import allocate_scenes, merge_to_count, merge_unallocated, split_text
+from app.services.character_registry import CharacterRegistry, remap_scene
+from app.services.incremental import ChunkRecord, chunk_fingerprint
+from app.services.draft_segmenter import DRAFT_BACKEND, segment_text
+from app.services.prompt_layout import PromptLayout
+from app.services.wire_format import (
+    STAGE1_STREAM_KEYS,
+    expand_character,
+    expand_scene,
+    expand_stage1,
+    stage1_schema,
+)
+from app.services.stage1_validation import (
+    EMPTY_SCENE,
+    Stage1ValidationError,
+    ValidationIssue,
+    check_output,
+    is_complete,
+    parse_output,
+    repair_output,
+    replace_scenes,
+)
+
+
+STAGE1_MODES = ("llm", "draft")
 
 
 class Stage1TextAnalysisService:
-    def __init__(self, client: Optional[OpenRouterClient] = None):
-        self.client = client or OpenRouterClient()
+    def __init__(
+        self,
+        client: Optional[OpenRouterClient] = None,
+        mode: Optional[str] = None,
+        fused_prompts: Optional[bool] = None,
+        compact: Optional[bool] = None,
+    ):
+        """
+        Args:
+            mode: llm 或 draft（规则分镜，不调用模型），默认读取 STAGE1_MODE
+            fused_prompts: 是否同时输出每个场景的图像提示词，默认读取 STAGE1_FUSED_PROMPTS
+            compact: 是否让模型输出紧凑格式（短键名、无空白），默认读取 LLM_COMPACT_OUTPUT
+        """
+        self.mode = mode or settings.stage1_mode
+        self.fused_prompts = settings.stage1_fused_prompts if fused_prompts is None else fused_prompts
+        self.compact = settings.llm_compact_output if compact is None else compact
+        if self.mode not in STAGE1_MODES:
+            raise ValueError(f"Unknown Stage1 mode: {self.mode}")
+        
+        # draft 模式不需要模型，也就不要求配置 API Key
+        self.client = client or (OpenRouterClient() if self.mode == "llm" else None)
     
-    def _build_analysis_prompt(self, story_text: str, scenes_count: int) -> str:
-        prompt = f"""你是一个专业的故事分析和分镜设计专家。请分析以下故事文本，并将其拆分为 {scenes_count} 个分镜场景。
-
-故事文本：
-{story_text}
+    def _fused_scene_fields(self) -> str:
+        """融合模式下场景 JSON 示例里额外的图像提示词字段"""
+        if not self.fused_prompts:
+            return ""
+        
+        return """
+      "image_prompt": "详细的英文图像生成提示词（包含场景、角色外貌、构图、风格、质量标签）",
+      "negative_prompt": "负向提示词（要避免的元素）",
+      "style_tags": ["anime", "high_quality", "4k"],"""
+    
+    def _fused_requirements(self) -> str:
+        if not self.fused_prompts:
+            return ""
+        
+        return """图像提示词要求（image_prompt / negative_prompt / style_tags）：
+- image_prompt 用英文，详细具体，包含场景环境、光线、氛围、出场角色的外貌特征和构图角度
+- 添加质量提升标签（如：masterpiece, best quality, highly detailed, 4k, ultra sharp）和风格标签（如：anime style, illustration, cinematic lighting）
+- negative_prompt 要避免低质量、变形、多余元素
 
-请按照以下JSON格式输出结构化数据：
+"""
+    
+    def _max_tokens(self, scenes_count: int) -> int:
+        """融合模式下每个场景多一段英文提示词，按 STAGE2_TOKENS_PER_SCENE 提高输出上限"""
+        if not self.fused_prompts:
+            return 4096
+        return 4096 + settings.stage2_tokens_per_scene * scenes_count
+    
+    def _analysis_schema(self) -> str:
+        """分析提示词中的输出格式说明；紧凑模式下改用短键名、无空白的格式"""
+        if self.compact:
+            return stage1_schema(self.fused_prompts)
+        
+        return f"""请按照以下JSON格式输出结构化数据：
 
 {{
   "metadata": {{
-    "total_scenes": {scenes_count},
+    "total_scenes": 场景总数,
     "story_title": "故事标题（根据内容推断）",
     "total_characters": 角色总数
   }},
@@ -27,7 +100,8 @@ class Stage1TextAnalysisService:
       "id": "char_001",
       "name": "角色名称",
       "description": "角色外貌特征描述（用于图像生成）",
-      "personality": "性格特点"
+      "personality": "性格特点",
+      "aliases": ["文中对该角色的其他称呼（昵称、小名、尊称），没有则为空数组"]
     }}
   ],
   "scenes": [
@@ -37,7 +111,7 @@ class Stage1TextAnalysisService:
       "description": "场景的视觉描述（环境、氛围、光线等）",
       "composition": "镜头构图（如：远景/中景/特写，俯视/平视/仰视）",
       "characters": ["char_001"],
-      "narration": "旁白文字（叙述性文本）",
+      "narration": "旁白文字（叙述性文本）",{self._fused_scene_fields()}
       "dialogues": [
         {{
           "character": "char_001",
@@ -47,23 +121,137 @@ class Stage1TextAnalysisService:
       ]
     }}
   ]
-}}
+}}"""
+    
+    def _build_analysis_prompt(self, story_text: str, scenes_count: int, preamble: str = "") -> PromptLayout:
+        """固定的说明在前，故事原文和场景数在后，不同故事的请求共用同一段前缀"""
+        static = f"""你是一个专业的故事分析和分镜设计专家。请分析最后给出的故事文本，并按指定的场景数将其拆分为分镜场景。
 
-要求：
-1. 将故事均匀拆分为 {scenes_count} 个场景
+{self._analysis_schema()}
+
+{self._fused_requirements()}要求：
+1. 将故事均匀拆分为指定数量的场景
 2. 详细描述每个角色的外貌特征，用于后续图像生成
 3. 每个场景的描述要具体，包含视觉元素
 4. 场景构图要符合电影分镜语言
 5. 区分旁白和对话
 6. 只返回JSON，不要包含其他解释文字"""
         
-        return prompt
+        dynamic = f"""{preamble}故事文本：
+{story_text}
+
+请将上面的故事拆分为 {scenes_count} 个分镜场景。"""
+        
+        return PromptLayout(static=static, dynamic=dynamic)
     
-    async def analyze_text(
+    def _build_chunk_prompt(self, chunk_text: str, scenes_count: int, index: int, total: int) -> PromptLayout:
+        preamble = f"""以下是一部长篇小说按顺序切分后的第 {index}/{total} 部分，其余部分由其他分析任务并行处理。
+只分析这一部分出现的情节和角色；角色名称请使用原文中的全名，便于与其他部分合并。
+
+"""
+        return self._build_analysis_prompt(chunk_text, scenes_count, preamble=preamble)
+    
+    def _build_outline_prompt(self, story_text: str, scenes_count: int) -> PromptLayout:
+        static = """你是一个专业的故事分析和分镜设计专家。请通读最后给出的故事文本，先按指定的场景数给出分镜场景的大纲，场景细节稍后单独展开。
+
+请按照以下JSON格式输出结构化数据：
+
+{
+  "metadata": {
+    "total_scenes": 场景总数,
+    "story_title": "故事标题（根据内容推断）",
+    "total_characters": 角色总数
+  },
+  "characters": [
+    {
+      "id": "char_001",
+      "name": "角色名称",
+      "description": "角色外貌特征描述（用于图像生成）",
+      "personality": "性格特点",
+      "aliases": ["文中对该角色的其他称呼（昵称、小名、尊称），没有则为空数组"]
+    }
+  ],
+  "outline": [
+    {
+      "scene_id": "scene_001",
+      "order": 1,
+      "summary": "一句话概括该场景的情节"
+    }
+  ]
+}
+
+要求：
+1. 将故事均匀拆分为指定数量的场景，outline 的项数与场景数相同
+2. 详细描述每个角色的外貌特征，后续展开场景和生成图像都以此为准
+3. 每个场景的 summary 只写一句话
+4. 只返回JSON，不要包含其他解释文字"""
+        
+        dynamic = f"""故事文本：
+{story_text}
+
+请将上面的故事拆分为 {scenes_count} 个分镜场景，outline 恰好 {scenes_count} 项。"""
+        
+        return PromptLayout(static=static, dynamic=dynamic)
+    
+    def _build_expand_prompt(
         self,
         story_text: str,
-        scenes_count: Optional[int] = None,
-    ) -> Stage1Output:
+        characters: List[Character],
+        outline: List[Dict[str, Any]],
+        batch: List[Dict[str, Any]],
+    ) -> PromptLayout:
+        """原文、角色表和大纲在各批之间相同，放在要展开的场景之前"""
+        character_sheet = json.dumps([char.model_dump() for char in characters], ensure_ascii=False, indent=2)
+        outline_lines = "\n".join(f"{item['scene_id']}: {item['summary']}" for item in outline)
+        scene_ids = "、".join(item["scene_id"] for item in batch)
+        
+        static = f"""你是一个专业的分镜设计专家。下面会给出故事原文、角色表和全部场景的大纲，请只展开最后指定的场景。
+
+请按照以下JSON格式输出结构化数据：
+
+{{
+  "scenes": [
+    {{
+      "scene_id": "scene_001",
+      "order": 1,
+      "description": "场景的视觉描述（环境、氛围、光线等）",
+      "composition": "镜头构图（如：远景/中景/特写，俯视/平视/仰视）",
+      "characters": ["char_001"],
+      "narration": "旁白文字（叙述性文本）",{self._fused_scene_fields()}
+      "dialogues": [
+        {{
+          "character": "char_001",
+          "text": "对话内容",
+          "emotion": "情绪（如：愉悦、悲伤、愤怒等）"
+        }}
+      ]
+    }}
+  ]
+}}
+
+{self._fused_requirements()}要求：
+1. 只输出指定的场景，scene_id 和 order 与大纲保持一致
+2. characters 和 dialogues 中只能使用角色表里的角色ID
+3. 每个场景的描述要具体，包含视觉元素；构图要符合电影分镜语言
+4. 区分旁白和对话
+5. 只返回JSON，不要包含其他解释文字"""
+        
+        shared = f"""故事文本：
+{story_text}
+
+角色表：
+{character_sheet}
+
+场景大纲：
+{outline_lines}"""
+        
+        dynamic = f"""需要展开的场景：{scene_ids}
+
+请只展开以上 {len(batch)} 个场景。"""
+        
+        return PromptLayout(static=static, shared=shared, dynamic=dynamic)
+    
+    def _validate_input(self, story_text: str, scenes_count: Optional[int]) -> int:
         if not story_text or not story_text.strip():
             raise ValueError("Story text cannot be empty")
         
@@ -72,42 +260,421 @@ class Stage1TextAnalysisService:
         if scenes_count < 1 or scenes_count > 100:
             raise ValueError("Scenes count must be between 1 and 100")
         
-        prompt = self._build_analysis_prompt(story_text, scenes_count)
+        return scenes_count
+    
+    def _build_messages(self, story_text: str, scenes_count: Optional[int]) -> list:
+        scenes_count = self._validate_input(story_text, scenes_count)
         
-        messages = [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ]
+        return self._build_analysis_prompt(story_text, scenes_count).messages()
+    
+    async def analyze_text(
+        self,
+        story_text: str,
+        scenes_count: Optional[int] = None,
+        bypass_cache: bool = False,
+    ) -> Stage1Output:
+        if self.mode == "draft":
+            return segment_text(story_text, self._validate_input(story_text, scenes_count))
+        
+        if self.should_chunk(story_text):
+            return await self.analyze_text_chunked(story_text, scenes_count, bypass_cache=bypass_cache)
+        
+        scenes_count = self._validate_input(story_text, scenes_count)
+        if self.should_outline(scenes_count):
+            return await self.analyze_text_outlined(story_text, scenes_count, bypass_cache=bypass_cache)
+        
+        messages = self._build_messages(story_text, scenes_count)
         
         result = await self.client.structured_completion(
             messages=messages,
             model=settings.text_analysis_model,
             temperature=0.7,
-            max_tokens=4096,
+            max_tokens=self._max_tokens(scenes_count),
+            bypass_cache=bypass_cache,
+            stage="stage1",
         )
         
-        return Stage1Output(**result)
+        return await self._finalize(result, story_text, scenes_count, bypass_cache=bypass_cache)
     
-    def validate_output(self, output: Stage1Output) -> bool:
-        if not output.characters:
-            return False
+    async def analyze_text_stream(
+        self,
+        story_text: str,
+        scenes_count: Optional[int] = None,
+        bypass_cache: bool = False,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式分析：每个角色、每个场景生成完整后立即产出
         
-        if not output.scenes:
-            return False
+        依次产出 ("character", Character) 和 ("scene", Scene)，
+        最后产出 ("result", Stage1Output)。下游可以在模型还在写后续场景时就开始处理前面的场景。
+        不符合 schema 的条目不提前产出；最终结果和非流式分析一样经过校验和修复，
+        可能与提前产出的场景不同（重新编号、重新生成），下游以最终结果为准。
+        """
+        messages = self._build_messages(story_text, scenes_count)
+        # 紧凑格式的场景不带编号，按产出顺序编号
+        streamed = 0
         
-        if len(output.scenes) != output.metadata.total_scenes:
-            return False
+        async for key, value in self.client.stream_structured_completion(
+            messages=messages,
+            model=settings.text_analysis_model,
+            temperature=0.7,
+            max_tokens=self._max_tokens(self._validate_input(story_text, scenes_count)),
+            stream_keys=STAGE1_STREAM_KEYS if self.compact else ("characters", "scenes"),
+            bypass_cache=bypass_cache,
+            stage="stage1",
+        ):
+            if key in ("c", "characters"):
+                character = self._parse_streamed(Character, expand_character(value) if self.compact else value)
+                if character is not None:
+                    yield "character", character
+            elif key in ("s", "scenes"):
+                streamed += 1
+                scene = self._parse_streamed(Scene, expand_scene(value, streamed) if self.compact else value)
+                # 不完整的场景不提前交给下游，等最终结果修复或重新生成
+                if scene is not None and is_complete(scene):
+                    yield "scene", scene
+            else:
+                yield "result", await self._finalize(value, story_text, scenes_count, bypass_cache=bypass_cache)
+    
+    @staticmethod
+    def _parse_streamed(model, value: Any):
+        if not isinstance(value, dict):
+            return None
+        try:
+            return model(**value)
+        except ValidationError:
+            return None
+    
+    def should_chunk(self, story_text: str) -> bool:
+        """文本超过阈值时改用分块分析"""
+        return len(story_text) > settings.stage1_chunk_threshold_chars
+    
+    def should_outline(self, scenes_count: int) -> bool:
+        """场景数较多时改用先出大纲再分批展开"""
+        return scenes_count >= settings.stage1_outline_min_scenes
+    
+    def should_stream(self, story_text: str, scenes_count: int) -> bool:
+        """只有单次请求完成的分析才能流式产出场景"""
+        return (
+            self.mode == "llm"
+            and not self.should_chunk(story_text)
+            and not self.should_outline(scenes_count)
+        )
+    
+    def chunk_backend(self) -> Optional[str]:
+        """块指纹中的分析后端（见 incremental.chunk_fingerprint），流式和分块路径记录的指纹须一致"""
+        if self.mode == "draft":
+            return DRAFT_BACKEND
+        # 融合模式的结果多了图像提示词，不能与普通模式互相复用
+        return f"{settings.text_analysis_model}+prompts" if self.fused_prompts else None
+    
+    def plan_chunks(
+        self,
+        story_text: str,
+        scenes_count: int,
+        previous_chunks: Optional[Dict[str, ChunkRecord]] = None,
+    ) -> List[Tuple[str, int]]:
+        """
+        切块并分配场景数，返回 [(块文本, 场景数)]
+        
+        未超过分块阈值时整篇作为一块。给出上一轮的块记录时，未改动的块沿用上次的场景数，
+        避免一处修改让各块的场景数整体挪动、全部重算。
+        """
+        if not self.should_chunk(story_text):
+            return [(story_text, scenes_count)]
+        
+        max_chars = settings.stage1_chunk_max_chars
+        chunks = split_text(story_text, max_chars)
+        # 块数多于场景数时先合并相邻的短块，合并后不超过单块上限
+        chunks = merge_to_count(chunks, scenes_count, max_chars)
+        if len(chunks) > scenes_count:
+            # 仍然多于场景数：场景按位置均匀分布，分不到场景的块并入相邻块一起分析，
+            # 这时块会超过单块上限，但全文都会被分析到
+            chunks, _ = merge_unallocated(chunks, allocate_scenes([len(chunk) for chunk in chunks], scenes_count))
+        backend = self.chunk_backend()
+        pinned: Dict[int, int] = {}
+        for i, chunk in enumerate(chunks):
+            record = (previous_chunks or {}).get(chunk_fingerprint(chunk, backend))
+            if record is not None:
+                pinned[i] = record.scenes_count
+        allocation = allocate_scenes([len(chunk) for chunk in chunks], scenes_count, pinned)
+        
+        print(f"📚 长文本分块分析: {len(story_text)} 字, {len(chunks)} 块, 场景分配 {allocation}")
+        
+        return list(zip(chunks, allocation))
+    
+    async def analyze_text_chunked(
+        self,
+        story_text: str,
+        scenes_count: Optional[int] = None,
+        bypass_cache: bool = False,
+    ) -> Stage1Output:
+        """
+        长文本的 map-reduce 分析
         
-        character_ids = {char.id for char in output.characters}
-        for scene in output.scenes:
-            for char_id in scene.characters:
-                if char_id not in character_ids:
-                    return False
+        按章节/段落边界切块，按各块长度比例分配场景数，并发分析各块，
+        最后合并角色并按原文顺序重新编号场景。
+        """
+        output, _ = await self.analyze_text_incremental(story_text, scenes_count, bypass_cache=bypass_cache)
+        return output
+    
+    async def analyze_text_incremental(
+        self,
+        story_text: str,
+        scenes_count: Optional[int] = None,
+        previous_chunks: Optional[Dict[str, ChunkRecord]] = None,
+        bypass_cache: bool = False,
+    ) -> Tuple[Stage1Output, List[ChunkRecord]]:
+        """
+        分块分析，指纹与上一轮相同的块直接复用上一轮的结果
+        
+        Args:
+            previous_chunks: 上一轮的 块指纹 -> 块记录，见 incremental.load_chunk_records
+        
+        Returns:
+            (合并后的输出, 本轮各块的记录，供下次重新提交时复用)
+        """
+        scenes_count = self._validate_input(story_text, scenes_count)
+        previous_chunks = previous_chunks or {}
+        
+        backend = self.chunk_backend()
+        
+        if self.mode == "draft":
+            # 规则分镜只需几毫秒，整篇重算即可
+            output = segment_text(story_text, scenes_count)
+            return output, [ChunkRecord(chunk_fingerprint(story_text, backend), scenes_count, output)]
+        
+        plan = self.plan_chunks(story_text, scenes_count, previous_chunks)
+        fingerprints = [chunk_fingerprint(chunk, backend) for chunk, _ in plan]
+        
+        def reusable(fingerprint: str, chunk_scenes: int) -> Optional[Stage1Output]:
+            record = previous_chunks.get(fingerprint)
+            return record.output if record is not None and record.scenes_count == chunk_scenes else None
+        
+        if previous_chunks:
+            reused = sum(
+                reusable(fingerprint, chunk_scenes) is not None
+                for fingerprint, (_, chunk_scenes) in zip(fingerprints, plan)
+            )
+            print(f"♻️  增量分析: {len(plan)} 块中 {reused} 块未改动，复用上次结果")
+        
+        semaphore = asyncio.Semaphore(settings.stage1_max_concurrency)
+        
+        async def analyze_chunk(index: int, chunk: str, chunk_scenes: int, fingerprint: str) -> Stage1Output:
+            previous = reusable(fingerprint, chunk_scenes)
+            if previous is not None:
+                return previous
             
-            for dialogue in scene.dialogues:
-                if dialogue.character not in character_ids:
-                    return False
+            # 分到的场景数较多的块同样先出大纲再分批展开
+            if self.should_outline(chunk_scenes):
+                return await self.analyze_text_outlined(chunk, chunk_scenes, bypass_cache=bypass_cache)
+            if len(plan) == 1:
+                prompt = self._build_analysis_prompt(chunk, chunk_scenes)
+            else:
+                prompt = self._build_chunk_prompt(chunk, chunk_scenes, index + 1, len(plan))
+            async with semaphore:
+                result = await self.client.structured_completion(
+                    messages=prompt.messages(),
+                    model=settings.text_analysis_model,
+                    temperature=0.7,
+                    max_tokens=self._max_tokens(chunk_scenes),
+                    bypass_cache=bypass_cache,
+                    stage="stage1",
+                )
+            return await self._finalize(result, chunk, chunk_scenes, bypass_cache=bypass_cache)
+        
+        partials = await asyncio.gather(*[
+            analyze_chunk(i, chunk, chunk_scenes, fingerprint)
+            for i, ((chunk, chunk_scenes), fingerprint) in enumerate(zip(plan, fingerprints))
+        ])
+        
+        records = [
+            ChunkRecord(fingerprint=fingerprint, scenes_count=chunk_scenes, output=partial)
+            for (_, chunk_scenes), fingerprint, partial in zip(plan, fingerprints, partials)
+        ]
+        return self._merge_partials(partials), records
+    
+    async def analyze_text_outlined(
+        self,
+        story_text: str,
+        scenes_count: Optional[int] = None,
+        bypass_cache: bool = False,
+    ) -> Stage1Output:
+        """
+        两阶段分析：先用一次请求生成角色表和每个场景的一句话大纲，再分批并发展开场景
+        
+        每批都带上完整的角色表和大纲，保证角色 ID 和情节衔接一致。
+        总耗时取决于单批的延迟，而不是全部场景的输出长度。
+        """
+        scenes_count = self._validate_input(story_text, scenes_count)
         
-        return True
+        result = await self.client.structured_completion(
+            messages=self._build_outline_prompt(story_text, scenes_count).messages(),
+            model=settings.text_analysis_model,
+            temperature=0.7,
+            max_tokens=4096,
+            bypass_cache=bypass_cache,
+            stage="stage1",
+        )
+        
+        parsed, _ = parse_output({"characters": result.get("characters")})
+        characters = parsed.characters
+        outline = [
+            {"scene_id": f"scene_{i:03d}", "order": i, "summary": item.get("summary", "") if isinstance(item, dict) else ""}
+            for i, item in enumerate(result.get("outline") or [], 1)
+        ]
+        if not outline:
+            raise ValueError("Outline contains no scenes")
+        
+        batch_size = max(1, settings.stage1_outline_batch_size)
+        batches = [outline[i:i + batch_size] for i in range(0, len(outline), batch_size)]
+        print(f"🗂️  大纲完成: {len(characters)} 个角色, {len(outline)} 个场景, 分 {len(batches)} 批展开")
+        
+        semaphore = asyncio.Semaphore(settings.stage1_max_concurrency)
+        
+        async def expand(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            prompt = self._build_expand_prompt(story_text, characters, outline, batch)
+            async with semaphore:
+                expanded = await self.client.structured_completion(
+                    messages=prompt.messages(),
+                    model=settings.text_analysis_model,
+                    temperature=0.7,
+                    max_tokens=self._max_tokens(len(batch)),
+                    bypass_cache=bypass_cache,
+                    stage="stage1",
+                )
+            
+            returned = [scene for scene in (expanded.get("scenes") or []) if isinstance(scene, dict)] \
+                if isinstance(expanded, dict) else []
+            by_id = {scene.get("scene_id"): scene for scene in returned}
+            scenes = []
+            for position, item in enumerate(batch):
+                # 优先按 scene_id 对应，模型改了编号时按位置对应；
+                # 没有返回的场景留空，由 _repair 单独重新请求
+                scene = by_id.get(item["scene_id"])
+                if scene is None and position < len(returned):
+                    scene = returned[position]
+                scenes.append({**(scene or {}), "scene_id": item["scene_id"], "order": item["order"]})
+            return scenes
+        
+        expanded_batches = await asyncio.gather(*[expand(batch) for batch in batches])
+        metadata = result.get("metadata") if isinstance(result.get("metadata"), dict) else {}
+        
+        output, invalid = parse_output({
+            "metadata": {"story_title": metadata.get("story_title", "")},
+            "characters": [char.model_dump() for char in characters],
+            "scenes": [scene for batch in expanded_batches for scene in batch],
+        })
+        return await self._repair(output, invalid, story_text, scenes_count, bypass_cache=bypass_cache)
+    
+    def _merge_partials(self, partials: List[Stage1Output]) -> Stage1Output:
+        """合并各块的结果：同一角色的不同称呼合并为一个，场景按块顺序重新编号"""
+        registry = CharacterRegistry()
+        scenes: List[Scene] = []
+        
+        for partial in partials:
+            # 本块的局部角色 ID -> 全局角色 ID；
+            # 校验修复补上的占位角色以局部 ID 为名，不同块的同名占位不是同一个角色，不参与合并；
+            # 同一块里的不同角色不能合并到同一个全局 ID
+            local_ids: Dict[str, str] = {}
+            for char in partial.characters:
+                claimed = set(local_ids.values())
+                local_ids[char.id] = registry.add_new(char) if char.name == char.id else registry.add(char, exclude=claimed)
+            
+            for scene in sorted(partial.scenes, key=lambda s: s.order):
+                order = len(scenes) + 1
+                scene = remap_scene(scene, local_ids, registry)
+                scenes.append(scene.model_copy(update={"scene_id": f"scene_{order:03d}", "order": order}))
+        
+        return Stage1Output(
+            metadata=Metadata(
+                total_scenes=len(scenes),
+                story_title=partials[0].metadata.story_title if partials else "",
+                total_characters=len(registry.characters),
+            ),
+            characters=registry.characters,
+            scenes=scenes,
+        )
+    
+    async def _finalize(
+        self,
+        result: Any,
+        story_text: str,
+        scenes_count: int,
+        bypass_cache: bool = False,
+    ) -> Stage1Output:
+        """
+        把模型结果转换为 Stage1Output：先按条目解析并在本地修复，
+        仍然为空的场景用展开提示词单独重新请求，其余场景保持不变
+        
+        Raises:
+            Stage1ValidationError: 重新请求后仍有无法修复的问题
+        """
+        if self.compact:
+            result = expand_stage1(result)
+        output, invalid = parse_output(result)
+        return await self._repair(output, invalid, story_text, scenes_count, bypass_cache=bypass_cache)
+    
+    async def _repair(
+        self,
+        output: Stage1Output,
+        invalid: List[ValidationIssue],
+        story_text: str,
+        scenes_count: int,
+        bypass_cache: bool = False,
+    ) -> Stage1Output:
+        """本地修复已解析的输出，空场景单独重新请求；invalid 为解析时不符合 schema 的场景"""
+        output, repaired = repair_output(output)
+        if invalid or repaired:
+            print(f"🩹 Stage1 输出局部修复: {', '.join(issue.message for issue in invalid + repaired)}")
+        if len(output.scenes) != scenes_count:
+            print(f"⚠️  Stage1 返回 {len(output.scenes)} 个场景，请求的是 {scenes_count} 个")
+        
+        broken = [issue.scene_id for issue in check_output(output) if issue.code == EMPTY_SCENE]
+        if broken:
+            output = await self._regenerate_scenes(output, story_text, broken, bypass_cache=bypass_cache)
+            output, _ = repair_output(output)
+        
+        issues = check_output(output)
+        if issues:
+            raise Stage1ValidationError(issues)
+        
+        return output
+    
+    async def _regenerate_scenes(
+        self,
+        output: Stage1Output,
+        story_text: str,
+        scene_ids: List[str],
+        bypass_cache: bool = False,
+    ) -> Stage1Output:
+        """只重新请求指定的场景，其余场景作为大纲上下文"""
+        print(f"🔁 重新生成 {len(scene_ids)} 个不完整的场景: {', '.join(scene_ids)}")
+        outline = [
+            {"scene_id": scene.scene_id, "order": scene.order, "summary": scene.narration or scene.description}
+            for scene in output.scenes
+        ]
+        batch = [item for item in outline if item["scene_id"] in scene_ids]
+        
+        result = await self.client.structured_completion(
+            messages=self._build_expand_prompt(story_text, output.characters, outline, batch).messages(),
+            model=settings.text_analysis_model,
+            temperature=0.7,
+            max_tokens=self._max_tokens(len(batch)),
+            bypass_cache=bypass_cache,
+            stage="stage1",
+        )
+        
+        regenerated, _ = parse_output({"scenes": result.get("scenes", []) if isinstance(result, dict) else []})
+        replacements = {
+            scene.scene_id: scene
+            for scene in regenerated.scenes
+            if scene.scene_id in scene_ids and is_complete(scene)
+        }
+        return replace_scenes(output, replacements)
+    
+    def validation_issues(self, output: Stage1Output) -> List[ValidationIssue]:
+        return check_output(output)
+    
+    def validate_output(self, output: Stage1Output) -> bool:
+        return not check_output(output)
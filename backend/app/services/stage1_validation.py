@@ -0,0 +1,236 @@
+"""
+Stage1 输出校验与局部修复
+
+模型偶尔会漏掉角色、引用不存在的角色 ID、编号错乱或写出缺字段的场景。
+以前任何一处问题都会让整个分析结果作废；这里把问题逐条列出，能在本地修的直接修
+（补角色占位、重新编号、修正元数据计数），修不了的场景交给调用方单独重新请求。
+"""
+
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.models.schemas import Character, Dialogue, Metadata, Scene, Stage1Output
+
+
+NO_CHARACTERS = "no_characters"
+NO_SCENES = "no_scenes"
+SCENE_COUNT_MISMATCH = "scene_count_mismatch"
+UNKNOWN_CHARACTER = "unknown_character"
+SCENE_NUMBERING = "scene_numbering"
+INVALID_SCENE = "invalid_scene"
+EMPTY_SCENE = "empty_scene"
+
+# 只能通过重新请求模型修复的问题
+UNREPAIRABLE = {NO_SCENES, EMPTY_SCENE}
+
+STUB_DESCRIPTION = "（外貌待补充）"
+DEFAULT_CHARACTER = "主角"
+
+
+@dataclass
+class ValidationIssue:
+    code: str
+    message: str
+    scene_id: Optional[str] = None
+    character_id: Optional[str] = None
+    
+    def to_dict(self) -> dict:
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+class Stage1ValidationError(ValueError):
+    """修复后仍有无法修复的问题；issues 为剩余问题列表"""
+    
+    def __init__(self, issues: List[ValidationIssue]):
+        self.issues = issues
+        detail = "; ".join(issue.message for issue in issues)
+        super().__init__(f"Stage1 output validation failed: {detail}")
+
+
+def is_complete(scene: Scene) -> bool:
+    """描述、构图、旁白都不为空"""
+    return bool(scene.description.strip() and scene.composition.strip() and scene.narration.strip())
+
+
+def check_output(output: Stage1Output) -> List[ValidationIssue]:
+    """逐条列出输出中的问题；没有问题时返回空列表"""
+    issues: List[ValidationIssue] = []
+    
+    if not output.characters:
+        issues.append(ValidationIssue(NO_CHARACTERS, "Output contains no characters"))
+    
+    if not output.scenes:
+        issues.append(ValidationIssue(NO_SCENES, "Output contains no scenes"))
+    
+    if len(output.scenes) != output.metadata.total_scenes:
+        issues.append(ValidationIssue(
+            SCENE_COUNT_MISMATCH,
+            f"metadata.total_scenes is {output.metadata.total_scenes} but {len(output.scenes)} scenes were returned",
+        ))
+    
+    character_ids = {char.id for char in output.characters}
+    for position, scene in enumerate(output.scenes, 1):
+        expected_id = f"scene_{position:03d}"
+        if scene.scene_id != expected_id or scene.order != position:
+            issues.append(ValidationIssue(
+                SCENE_NUMBERING,
+                f"Scene at position {position} is numbered {scene.scene_id} (order {scene.order})",
+                scene_id=scene.scene_id,
+            ))
+        
+        if not is_complete(scene):
+            issues.append(ValidationIssue(
+                EMPTY_SCENE,
+                f"Scene {scene.scene_id} has an empty description, composition or narration",
+                scene_id=scene.scene_id,
+            ))
+        
+        referenced = list(scene.characters) + [dialogue.character for dialogue in scene.dialogues]
+        for char_id in dict.fromkeys(referenced):
+            if char_id not in character_ids:
+                issues.append(ValidationIssue(
+                    UNKNOWN_CHARACTER,
+                    f"Scene {scene.scene_id} references unknown character {char_id}",
+                    scene_id=scene.scene_id,
+                    character_id=char_id,
+                ))
+    
+    return issues
+
+
+def _parse_character(raw: Any, position: int) -> Optional[Character]:
+    if not isinstance(raw, dict):
+        return None
+    try:
+        return Character(**raw)
+    except ValidationError:
+        pass
+    
+    char_id = str(raw.get("id") or f"char_{position:03d}")
+    return Character(
+        id=char_id,
+        name=str(raw.get("name") or char_id),
+        description=str(raw.get("description") or STUB_DESCRIPTION),
+        personality=raw.get("personality") if isinstance(raw.get("personality"), str) else None,
+    )
+
+
+def _parse_scene(raw: Any, position: int) -> Tuple[Scene, bool]:
+    """返回 (场景, 是否符合 schema)；不符合时缺失的文字字段留空，留给重新请求"""
+    if isinstance(raw, dict):
+        try:
+            return Scene(**raw), True
+        except ValidationError:
+            pass
+    else:
+        raw = {}
+    
+    dialogues = []
+    for item in raw.get("dialogues") or []:
+        try:
+            dialogues.append(Dialogue(**item))
+        except (TypeError, ValidationError):
+            continue
+    
+    order = raw.get("order")
+    characters = raw.get("characters")
+    scene = Scene(
+        scene_id=str(raw.get("scene_id") or f"scene_{position:03d}"),
+        order=order if isinstance(order, int) else position,
+        description=str(raw.get("description") or ""),
+        composition=str(raw.get("composition") or ""),
+        characters=[str(c) for c in characters] if isinstance(characters, list) else [],
+        narration=str(raw.get("narration") or ""),
+        dialogues=dialogues,
+    )
+    return scene, False
+
+
+def parse_output(result: Any) -> Tuple[Stage1Output, List[ValidationIssue]]:
+    """
+    按条目解析模型返回的 JSON，单个角色或场景不符合 schema 时不影响其余部分
+    
+    Returns:
+        (解析结果, 不符合 schema 的场景)
+    """
+    result = result if isinstance(result, dict) else {}
+    
+    characters: List[Character] = []
+    for position, raw in enumerate(result.get("characters") or [], 1):
+        character = _parse_character(raw, position)
+        if character is not None:
+            characters.append(character)
+    
+    scenes: List[Scene] = []
+    issues: List[ValidationIssue] = []
+    for position, raw in enumerate(result.get("scenes") or [], 1):
+        scene, valid = _parse_scene(raw, position)
+        scenes.append(scene)
+        if not valid:
+            issues.append(ValidationIssue(
+                INVALID_SCENE, f"Scene at position {position} does not match the schema", scene_id=scene.scene_id,
+            ))
+    
+    metadata = result.get("metadata") if isinstance(result.get("metadata"), dict) else {}
+    total_scenes = metadata.get("total_scenes")
+    output = Stage1Output(
+        metadata=Metadata(
+            total_scenes=total_scenes if isinstance(total_scenes, int) else len(scenes),
+            story_title=str(metadata.get("story_title") or ""),
+            total_characters=len(characters),
+        ),
+        characters=characters,
+        scenes=scenes,
+    )
+    return output, issues
+
+
+def repair_output(output: Stage1Output) -> Tuple[Stage1Output, List[ValidationIssue]]:
+    """
+    本地修复：场景按 order 重新编号、为未知角色 ID 补占位角色、修正元数据计数
+    
+    Returns:
+        (修复后的输出, 已修复的问题)；空场景和没有场景的问题原样保留
+    """
+    issues = [issue for issue in check_output(output) if issue.code not in UNREPAIRABLE]
+    if not issues:
+        return output, []
+    
+    scenes = [
+        scene.model_copy(update={"scene_id": f"scene_{position:03d}", "order": position})
+        for position, scene in enumerate(sorted(output.scenes, key=lambda s: s.order), 1)
+    ]
+    
+    characters = list(output.characters)
+    known = {char.id for char in characters}
+    for scene in scenes:
+        for char_id in list(scene.characters) + [dialogue.character for dialogue in scene.dialogues]:
+            if char_id not in known:
+                characters.append(Character(id=char_id, name=char_id, description=STUB_DESCRIPTION))
+                known.add(char_id)
+    
+    if not characters:
+        # Stage1Output 至少需要一个角色
+        characters.append(Character(id="char_001", name=DEFAULT_CHARACTER, description=STUB_DESCRIPTION))
+    
+    repaired = Stage1Output(
+        metadata=output.metadata.model_copy(update={
+            "total_scenes": len(scenes),
+            "total_characters": len(characters),
+        }),
+        characters=characters,
+        scenes=scenes,
+    )
+    return repaired, issues
+
+
+def replace_scenes(output: Stage1Output, replacements: Dict[str, Scene]) -> Stage1Output:
+    """用重新生成的场景替换同 scene_id 的场景，编号保持不变"""
+    scenes = [
+        replacements[scene.scene_id].model_copy(update={"scene_id": scene.scene_id, "order": scene.order})
+        if scene.scene_id in replacements else scene
+        for scene in output.scenes
+    ]
+    return output.model_copy(update={"scenes": scenes})
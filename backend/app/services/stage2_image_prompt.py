@@ -1,12 +1,28 @@
-from typing import Optional, List
+import asyncio
+from typing import Optional, List, Dict
+from pydantic import ValidationError
 from app.config import settings
 from app.models.schemas import Stage1Output, Scene, Character, Stage2Output
 from app.services.openrouter_client import OpenRouterClient
+from app.services.prompt_layout import PromptLayout
+from app.services.wire_format import expand_prompt, expand_prompt_batch, stage2_batch_schema, stage2_schema
+
+
+class Stage2PromptError(Exception):
+    """部分场景的提示词生成失败；results 中失败场景的位置为 None"""
+    
+    def __init__(self, failures: Dict[str, BaseException], results: List[Optional[Stage2Output]]):
+        self.failures = failures
+        self.results = results
+        detail = "; ".join(f"{scene_id}: {error}" for scene_id, error in failures.items())
+        super().__init__(f"Prompt generation failed for {len(failures)} scene(s): {detail}")
 
 
 class Stage2ImagePromptService:
-    def __init__(self, client: Optional[OpenRouterClient] = None):
+    def __init__(self, client: Optional[OpenRouterClient] = None, compact: Optional[bool] = None):
+        """compact: 是否让模型输出紧凑格式（短键名、无空白），默认读取 LLM_COMPACT_OUTPUT"""
         self.client = client or OpenRouterClient()
+        self.compact = settings.llm_compact_output if compact is None else compact
     
     def _build_character_reference(self, characters: List[Character], character_ids: List[str]) -> str:
         character_descs = []
@@ -16,74 +32,354 @@ class Stage2ImagePromptService:
         
         return ", ".join(character_descs) if character_descs else "无角色"
     
-    def _build_prompt_generation_request(
-        self,
-        scene: Scene,
-        characters: List[Character],
-    ) -> str:
-        character_ref = self._build_character_reference(characters, scene.characters)
+    def _build_character_sheet(self, characters: List[Character]) -> str:
+        """整个故事的角色表；同一故事的所有场景共用，放在提示词前部以便命中提示词缓存"""
+        return "\n".join(f"- {char.id} {char.name}: {char.description}" for char in characters) or "无角色"
+    
+    def _output_schema(self) -> str:
+        """单场景提示词的输出格式说明；紧凑模式下 scene_id 和出场角色由本地补上"""
+        if self.compact:
+            return stage2_schema()
         
-        prompt = f"""你是一个专业的AI图像生成提示词工程师。请根据以下场景信息，生成适合Stable Diffusion或DALL-E的高质量图像生成提示词。
+        return """请生成以下JSON格式的输出：
 
-场景信息：
-- 场景描述：{scene.description}
-- 构图：{scene.composition}
-- 出场角色：{character_ref}
-- 旁白：{scene.narration}
-
-请生成以下JSON格式的输出：
-
-{{
-  "scene_id": "{scene.scene_id}",
+{
+  "scene_id": "场景ID（与场景信息一致）",
   "image_prompt": "详细的英文图像生成提示词（包含场景、角色、构图、风格、质量标签）",
   "negative_prompt": "负向提示词（要避免的元素）",
   "style_tags": ["anime", "high_quality", "4k"],
-  "characters_in_scene": {scene.characters}
-}}
+  "characters_in_scene": ["出场角色ID"]
+}"""
+    
+    def _build_prompt_generation_request(
+        self,
+        scene: Scene,
+        characters: List[Character],
+    ) -> PromptLayout:
+        """固定说明 -> 故事角色表 -> 场景信息；同一故事的各场景请求只有最后一段不同"""
+        static = f"""你是一个专业的AI图像生成提示词工程师。请根据最后给出的场景信息，生成适合Stable Diffusion或DALL-E的高质量图像生成提示词。
+
+{self._output_schema()}
 
 要求：
 1. 提示词要用英文，详细具体
 2. 包含场景环境、光线、氛围、角色特征、构图角度
-3. 添加质量提升标签（如：masterpiece, best quality, highly detailed, 4k, ultra sharp）
-4. 添加风格标签（如：anime style, illustration, cinematic lighting）
-5. 负向提示词要避免低质量、变形、多余元素
-6. 只返回JSON，不要包含其他解释"""
+3. 出场角色的外貌以角色设定为准
+4. 添加质量提升标签（如：masterpiece, best quality, highly detailed, 4k, ultra sharp）
+5. 添加风格标签（如：anime style, illustration, cinematic lighting）
+6. 负向提示词要避免低质量、变形、多余元素
+7. 只返回JSON，不要包含其他解释"""
+        
+        shared = f"""角色设定：
+{self._build_character_sheet(characters)}"""
         
-        return prompt
+        dynamic = f"""场景信息：
+- 场景ID：{scene.scene_id}
+- 场景描述：{scene.description}
+- 构图：{scene.composition}
+- 出场角色ID：{", ".join(scene.characters) or "无"}
+- 旁白：{scene.narration}"""
+        
+        return PromptLayout(static=static, shared=shared, dynamic=dynamic)
+    
+    def fused_output(self, scene: Scene) -> Optional[Stage2Output]:
+        """Stage1 融合模式已给出提示词时直接转换，不再调用模型"""
+        if not scene.image_prompt or not scene.image_prompt.strip():
+            return None
+        
+        return Stage2Output(
+            scene_id=scene.scene_id,
+            image_prompt=scene.image_prompt,
+            negative_prompt=scene.negative_prompt,
+            style_tags=list(scene.style_tags),
+            characters_in_scene=list(scene.characters),
+        )
     
     async def generate_image_prompt(
         self,
         scene: Scene,
         characters: List[Character],
+        bypass_cache: bool = False,
     ) -> Stage2Output:
-        prompt = self._build_prompt_generation_request(scene, characters)
+        fused = self.fused_output(scene)
+        if fused is not None:
+            return fused
         
-        messages = [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ]
+        prompt = self._build_prompt_generation_request(scene, characters)
         
         result = await self.client.structured_completion(
-            messages=messages,
+            messages=prompt.messages(),
             model=settings.image_prompt_model,
             temperature=0.7,
             max_tokens=1024,
+            bypass_cache=bypass_cache,
+            stage="stage2",
+        )
+        
+        if self.compact:
+            result = expand_prompt(result, scene.scene_id, scene.characters)
+        # 结果属于输入的场景，不采信模型回显的 scene_id
+        return Stage2Output(**{**result, "scene_id": scene.scene_id})
+    
+    def _batch_output_schema(self) -> str:
+        if self.compact:
+            return stage2_batch_schema()
+        
+        return """请生成以下JSON格式的输出，prompts 数组中每个场景一项，顺序与场景列表一致：
+
+{
+  "prompts": [
+    {
+      "scene_id": "场景ID",
+      "image_prompt": "详细的英文图像生成提示词（包含场景、角色、构图、风格、质量标签）",
+      "negative_prompt": "负向提示词（要避免的元素）",
+      "style_tags": ["anime", "high_quality", "4k"],
+      "characters_in_scene": ["角色ID"]
+    }
+  ]
+}"""
+    
+    def _build_batch_prompt_request(
+        self,
+        scenes: List[Scene],
+        characters: List[Character],
+    ) -> PromptLayout:
+        """与单场景请求相同的布局：角色表对所有批次相同，场景列表放在最后"""
+        static = f"""你是一个专业的AI图像生成提示词工程师。请为最后列出的每个场景分别生成适合Stable Diffusion或DALL-E的高质量图像生成提示词。
+
+{self._batch_output_schema()}
+
+要求：
+1. 提示词要用英文，详细具体
+2. 出场角色的外貌描述要写进提示词，以角色设定为准，保持一致
+3. 包含场景环境、光线、氛围、角色特征、构图角度
+4. 添加质量提升标签（如：masterpiece, best quality, highly detailed, 4k, ultra sharp）
+5. 添加风格标签（如：anime style, illustration, cinematic lighting）
+6. 负向提示词要避免低质量、变形、多余元素
+7. 只返回JSON，不要包含其他解释"""
+        
+        shared = f"""角色设定（所有场景共用，角色外貌必须保持一致）：
+{self._build_character_sheet(characters)}"""
+        
+        scene_blocks = "\n\n".join(
+            f"""[{scene.scene_id}]
+- 场景描述：{scene.description}
+- 构图：{scene.composition}
+- 出场角色：{", ".join(scene.characters) or "无"}
+- 旁白：{scene.narration}"""
+            for scene in scenes
         )
+        dynamic = f"""场景列表（共 {len(scenes)} 个）：
+{scene_blocks}"""
         
-        return Stage2Output(**result)
+        return PromptLayout(static=static, shared=shared, dynamic=dynamic)
+    
+    def _estimate_output_tokens(self, scene: Scene) -> int:
+        """估算单个场景的输出 token 数：固定开销 + 与场景描述长度相关的部分"""
+        scene_text = len(scene.description) + len(scene.composition)
+        return settings.stage2_tokens_per_scene + scene_text // 4
+    
+    def _plan_batches(self, scenes: List[Scene]) -> List[List[Scene]]:
+        """按输出 token 预算把场景贪心打包成批次，每批不超过 stage2_batch_max_scenes 个"""
+        budget = settings.stage2_batch_max_tokens
+        batches: List[List[Scene]] = []
+        current: List[Scene] = []
+        current_tokens = 0
+        
+        for scene in scenes:
+            tokens = self._estimate_output_tokens(scene)
+            if current and (
+                current_tokens + tokens > budget
+                or len(current) >= settings.stage2_batch_max_scenes
+            ):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(scene)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        
+        return batches
+    
+    def _parse_batch_result(self, result, scenes: List[Scene]) -> dict:
+        """把批量结果按 scene_id 对应回场景，格式不对的条目直接丢弃"""
+        items = result.get("prompts", []) if isinstance(result, dict) else result
+        if not isinstance(items, list):
+            return {}
+        
+        expected = {scene.scene_id for scene in scenes}
+        parsed = {}
+        for item in items:
+            try:
+                output = Stage2Output(**item)
+            except (TypeError, ValidationError):
+                continue
+            if output.scene_id in expected and output.image_prompt.strip():
+                parsed[output.scene_id] = output
+        
+        return parsed
+    
+    async def _generate_batch(
+        self,
+        scenes: List[Scene],
+        characters: List[Character],
+        bypass_cache: bool = False,
+    ) -> List[Stage2Output]:
+        """
+        一次请求生成一批场景的提示词
+        
+        批量结果中缺失或格式错误的场景会被拆成两半重新请求；
+        只剩单个场景时退回到逐场景生成。
+        """
+        if len(scenes) == 1:
+            return [await self.generate_image_prompt(scenes[0], characters, bypass_cache=bypass_cache)]
+        
+        prompt = self._build_batch_prompt_request(scenes, characters)
+        max_tokens = min(
+            settings.stage2_batch_max_tokens,
+            sum(self._estimate_output_tokens(scene) for scene in scenes) + 256,
+        )
+        
+        try:
+            result = await self.client.structured_completion(
+                messages=prompt.messages(),
+                model=settings.image_prompt_model,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                bypass_cache=bypass_cache,
+                stage="stage2",
+            )
+            if self.compact:
+                result = expand_prompt_batch(result)
+            parsed = self._parse_batch_result(result, scenes)
+        except ValueError:
+            # 整批输出无法解析（通常是被 max_tokens 截断）
+            parsed = {}
+        
+        failed = [scene for scene in scenes if scene.scene_id not in parsed]
+        if failed:
+            print(f"⚠️  批量提示词缺失 {len(failed)}/{len(scenes)} 个场景，拆分重试")
+            middle = (len(failed) + 1) // 2
+            for part in (failed[:middle], failed[middle:]):
+                if part:
+                    for output in await self._generate_batch(part, characters, bypass_cache):
+                        parsed[output.scene_id] = output
+        
+        return [parsed[scene.scene_id] for scene in scenes]
+    
+    async def generate_all_prompts_batched(
+        self,
+        stage1_output: Stage1Output,
+        bypass_cache: bool = False,
+    ) -> List[Stage2Output]:
+        """
+        批量模式：每次请求处理多个场景，共用一份角色设定
+        
+        每批的场景数由输出 token 预算决定（STAGE2_BATCH_MAX_TOKENS / STAGE2_BATCH_MAX_SCENES），
+        各批次之间按 STAGE2_MAX_CONCURRENCY 并发执行。Stage1 已给出提示词的场景不参与批次。
+        """
+        fused = {}
+        for scene in stage1_output.scenes:
+            output = self.fused_output(scene)
+            if output is not None:
+                fused[scene.scene_id] = output
+        pending = [scene for scene in stage1_output.scenes if scene.scene_id not in fused]
+        
+        semaphore = asyncio.Semaphore(settings.stage2_max_concurrency)
+        
+        async def run_batch(batch: List[Scene]) -> List[Stage2Output]:
+            async with semaphore:
+                return await self._generate_batch(
+                    scenes=batch,
+                    characters=stage1_output.characters,
+                    bypass_cache=bypass_cache,
+                )
+        
+        batch_results = await asyncio.gather(
+            *[run_batch(batch) for batch in self._plan_batches(pending)]
+        )
+        
+        generated = {prompt.scene_id: prompt for batch in batch_results for prompt in batch}
+        return [fused.get(scene.scene_id) or generated[scene.scene_id] for scene in stage1_output.scenes]
+    
+    async def generate_image_prompt_bounded(
+        self,
+        scene: Scene,
+        characters: List[Character],
+        semaphore: asyncio.Semaphore,
+        bypass_cache: bool = False,
+    ) -> Stage2Output:
+        # 已有提示词的场景不占并发名额
+        fused = self.fused_output(scene)
+        if fused is not None:
+            return fused
+        
+        async with semaphore:
+            return await self.generate_image_prompt(scene, characters, bypass_cache=bypass_cache)
+    
+    def collect_results(self, scenes: List[Scene], results: list) -> List[Stage2Output]:
+        """
+        按场景顺序整理并发结果
+        
+        所有场景都跑完后再统一报告失败，单个场景失败不会取消其它场景。
+        """
+        failures = {}
+        for scene, result in zip(scenes, results):
+            if isinstance(result, BaseException):
+                print(f"❌ {scene.scene_id} 提示词生成失败: {result}")
+                failures[scene.scene_id] = result
+        
+        if failures:
+            ordered = [None if isinstance(r, BaseException) else r for r in results]
+            raise Stage2PromptError(failures, ordered)
+        
+        return list(results)
     
     async def generate_all_prompts(
         self,
         stage1_output: Stage1Output,
+        bypass_cache: bool = False,
+        concurrent: bool = False,
+        max_concurrency: Optional[int] = None,
     ) -> List[Stage2Output]:
+        """
+        生成所有场景的图像提示词
+        
+        Args:
+            stage1_output: Stage1 输出
+            bypass_cache: 是否跳过 LLM 响应缓存
+            concurrent: 是否并发执行（场景之间相互独立）
+            max_concurrency: 并发上限（默认 STAGE2_MAX_CONCURRENCY）
+        
+        Returns:
+            与场景顺序一致的 Stage2Output 列表；并发模式下有场景失败时抛出 Stage2PromptError
+        """
+        if concurrent:
+            semaphore = asyncio.Semaphore(max_concurrency or settings.stage2_max_concurrency)
+            
+            results = await asyncio.gather(
+                *[
+                    self.generate_image_prompt_bounded(
+                        scene=scene,
+                        characters=stage1_output.characters,
+                        semaphore=semaphore,
+                        bypass_cache=bypass_cache,
+                    )
+                    for scene in stage1_output.scenes
+                ],
+                return_exceptions=True,
+            )
+            
+            return self.collect_results(stage1_output.scenes, results)
+        
         prompts = []
         
         for scene in stage1_output.scenes:
             prompt_output = await self.generate_image_prompt(
                 scene=scene,
                 characters=stage1_output.characters,
+                bypass_cache=bypass_cache,
             )
             prompts.append(prompt_output)
         
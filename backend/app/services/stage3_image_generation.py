@@ -1,18 +1,63 @@
 import os
 import asyncio
-import httpx
-from io import BytesIO
-from typing import Optional, List
-from PIL import Image
+import base64
+import hashlib
+import json
+import time
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Callable, Optional, List, Tuple, Union
 from app.config import settings
 from app.models.schemas import Stage2Output, Stage3Output
 from app.services.openrouter_client import OpenRouterClient
+from app.services.http_pool import get_http_client
+from app.services.image_cache import ImageCache, get_image_cache, make_image_key
+from app.services.image_io import encoding_spec, output_extension, persist_image, save_bytes
+from app.services.resilience import CircuitOpenError
+from app.services.single_flight import single_flights
+
+
+@dataclass
+class ImageFailure:
+    scene_id: str
+    error: str
+    attempts: int
+    
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class Stage3ImageError(Exception):
+    """部分场景的图像在重试后仍生成失败；results 中失败场景的位置为 None，其余为已生成的图像"""
+    
+    def __init__(self, failures: List[ImageFailure], results: List[Optional[Stage3Output]]):
+        self.failures = failures
+        self.results = results
+        detail = "; ".join(f"{failure.scene_id}: {failure.error}" for failure in failures)
+        super().__init__(f"Image generation failed for {len(failures)} scene(s): {detail}")
+    
+    @property
+    def completed(self) -> List[Stage3Output]:
+        return [result for result in self.results if result is not None]
+    
+    @property
+    def failed_scene_ids(self) -> List[str]:
+        return [failure.scene_id for failure in self.failures]
+
+
+# on_progress(已完成数, 总数, 结果)
+ProgressCallback = Callable[[int, int, Union[Stage3Output, ImageFailure]], None]
 
 
 class Stage3ImageGenerationService:
-    def __init__(self, client: Optional[OpenRouterClient] = None, output_dir: str = "./output/images"):
+    def __init__(
+        self,
+        client: Optional[OpenRouterClient] = None,
+        output_dir: str = "./output/images",
+        cache: Optional[ImageCache] = None,
+    ):
         self.client = client or OpenRouterClient()
         self.output_dir = output_dir
+        self.cache = cache or get_image_cache()
         os.makedirs(self.output_dir, exist_ok=True)
     
     async def generate_image_from_prompt(
@@ -23,12 +68,65 @@ class Stage3ImageGenerationService:
         model: str = "openai/dall-e-3",
     ) -> bytes:
         """
-        通过 OpenRouter 聊天完成接口生成图像
+        通过 OpenRouter 聊天完成接口生成图像，返回完整的图像数据
         适用于 GPT-5 Image Mini 等多模态模型
+        
+        流水线中使用 generate_image_to_file 直接写文件，不在内存中保留解码后的数据
+        """
+        source = await self.request_image_source(prompt, size, quality, model)
+        
+        if source.startswith("data:"):
+            return base64.b64decode(source.split(",", 1)[1])
+        
+        response = await get_http_client().get(source)
+        response.raise_for_status()
+        return response.content
+    
+    async def generate_image_to_file(
+        self,
+        prompt: str,
+        path: str,
+        size: str = "1024x1024",
+        quality: str = "standard",
+        model: str = "openai/dall-e-3",
+    ) -> Tuple[int, int]:
+        """
+        生成图像并流式写入 path（按 STAGE3_IMAGE_FORMAT 编码）
+        
+        Returns:
+            (宽, 高)
+        """
+        source = await self.request_image_source(prompt, size, quality, model)
+        return await persist_image(source, path)
+    
+    async def request_image_source(
+        self,
+        prompt: str,
+        size: str,
+        quality: str,
+        model: str,
+    ) -> str:
+        """
+        返回模型给出的图像地址（base64 data URL 或图片 URL），不做解码
+        
+        参数完全相同的并发请求会被合并为一次上游调用，各调用方共享同一个字符串
         """
+        fingerprint = json.dumps([prompt, size, quality, model], ensure_ascii=False)
+        flight_key = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+        
+        return await single_flights.get("openrouter.image").do(
+            flight_key,
+            lambda: self._request_image(prompt, size, quality, model),
+        )
+    
+    async def _request_image(
+        self,
+        prompt: str,
+        size: str,
+        quality: str,
+        model: str,
+    ) -> str:
         headers = {
-            "Authorization": f"Bearer {self.client.api_key}",
-            "Content-Type": "application/json",
             "HTTP-Referer": "https://github.com/hyt1004/big-niu",
             "X-Title": "Big Niu Text-to-Video",
         }
@@ -46,49 +144,34 @@ class Stage3ImageGenerationService:
             "max_tokens": 4000,
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.client.base_url}/chat/completions",
-                headers=headers,
-                json=payload,
-            )
-            
-            if response.status_code != 200:
-                error_detail = response.text
-                raise ValueError(f"API Error {response.status_code}: {error_detail}")
-            
-            result = response.json()
-            
-            # 从响应中提取图像
-            # GPT-5 Image 模型会在 message.images 中返回图像
-            message = result["choices"][0]["message"]
-            
-            # 检查是否有图像数据
-            if "images" in message and len(message["images"]) > 0:
-                image_data = message["images"][0]
-                image_url = image_data["image_url"]["url"]
-                
-                # 如果是 base64 编码的图像
-                if image_url.startswith("data:image"):
-                    import base64
-                    # 提取 base64 数据部分
-                    base64_data = image_url.split(",")[1]
-                    return base64.b64decode(base64_data)
-                else:
-                    # 如果是 URL，下载图像
-                    image_response = await client.get(image_url)
-                    image_response.raise_for_status()
-                    return image_response.content
-            
-            # 如果没有找到图像，抛出错误
-            raise ValueError(f"No image found in response. Message keys: {message.keys()}")
+        start = time.monotonic()
+        response = await self.client.post_chat(
+            payload,
+            extra_headers=headers,
+            endpoint="openrouter.image",
+        )
+        
+        if response.status_code != 200:
+            error_detail = response.text
+            raise ValueError(f"API Error {response.status_code}: {error_detail}")
+        
+        result = response.json()
+        self.client.record_usage(model, "stage3", result.get("usage"), time.monotonic() - start)
+        
+        # 从响应中提取图像
+        # GPT-5 Image 模型会在 message.images 中返回图像（base64 data URL 或图片 URL）
+        message = result["choices"][0]["message"]
+        
+        if "images" in message and len(message["images"]) > 0:
+            return message["images"][0]["image_url"]["url"]
+        
+        # 如果没有找到图像，抛出错误
+        raise ValueError(f"No image found in response. Message keys: {message.keys()}")
     
     def save_image(self, image_data: bytes, filename: str) -> str:
+        """按 STAGE3_IMAGE_FORMAT 保存已在内存中的图像数据；PNG 数据且无需重新压缩时原样写入"""
         filepath = os.path.join(self.output_dir, filename)
-        
-        image = Image.open(BytesIO(image_data))
-        image.save(filepath, format='PNG')
-        
+        save_bytes(image_data, filepath)
         return filepath
     
     async def generate_scene_image(
@@ -104,19 +187,31 @@ class Stage3ImageGenerationService:
             prompt = f"{prompt}. Avoid: {stage2_output.negative_prompt}"
         
         model_to_use = model or settings.image_generation_model
+        image_path = os.path.join(self.output_dir, f"{stage2_output.scene_id}{output_extension()}")
         
-        image_data = await self.generate_image_from_prompt(
-            prompt=prompt,
-            size=size,
-            quality=quality,
-            model=model_to_use,
-        )
-        
-        filename = f"{stage2_output.scene_id}.png"
-        image_path = self.save_image(image_data, filename)
+        cache_key = None
+        cached = None
+        if self.cache is not None:
+            cache_key = make_image_key(
+                stage2_output.image_prompt, stage2_output.negative_prompt, model_to_use, size, quality,
+                encoding=encoding_spec(),
+            )
+            cached = self.cache.link_to(cache_key, image_path)
         
-        image = Image.open(image_path)
-        width, height = image.size
+        if cached is not None:
+            print(f"💾 {stage2_output.scene_id} 命中图像缓存")
+            width, height = cached
+        else:
+            width, height = await self.generate_image_to_file(
+                prompt=prompt,
+                path=image_path,
+                size=size,
+                quality=quality,
+                model=model_to_use,
+            )
+            
+            if cache_key is not None:
+                self.cache.store(cache_key, image_path, width, height)
         
         return Stage3Output(
             scene_id=stage2_output.scene_id,
@@ -132,6 +227,101 @@ class Stage3ImageGenerationService:
             }
         )
     
+    async def generate_scene_image_with_retry(
+        self,
+        stage2_output: Stage2Output,
+        max_attempts: Optional[int] = None,
+        **kwargs,
+    ):
+        """
+        单个场景失败后按退避间隔重新生成
+        
+        Returns:
+            Stage3Output；重试用尽时返回 ImageFailure，不抛出异常，避免影响其它场景
+        """
+        max_attempts = max(1, max_attempts or settings.stage3_scene_attempts)
+        
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return await self.generate_scene_image(stage2_output=stage2_output, **kwargs)
+            except CircuitOpenError as e:
+                # 熔断期间重试没有意义，直接记为失败
+                print(f"❌ {stage2_output.scene_id} 生成失败: {e}")
+                return ImageFailure(stage2_output.scene_id, str(e), attempt)
+            except Exception as e:
+                if attempt == max_attempts:
+                    print(f"❌ {stage2_output.scene_id} 生成失败（已尝试 {attempt} 次）: {e}")
+                    return ImageFailure(stage2_output.scene_id, str(e), attempt)
+                
+                delay = settings.stage3_retry_delay * 2 ** (attempt - 1)
+                print(f"🔁 {stage2_output.scene_id} 第 {attempt} 次生成失败，{delay:.1f} 秒后重试: {e}")
+                await asyncio.sleep(delay)
+    
+    def collect_results(self, results: list) -> List[Stage3Output]:
+        """按场景顺序整理结果；有场景失败时抛出 Stage3ImageError，已生成的图像随异常一起返回"""
+        failures = [result for result in results if isinstance(result, ImageFailure)]
+        
+        if failures:
+            ordered = [None if isinstance(result, ImageFailure) else result for result in results]
+            raise Stage3ImageError(failures, ordered)
+        
+        return list(results)
+    
+    async def _iter_results(
+        self,
+        stage2_outputs: List[Stage2Output],
+        params: dict,
+        max_concurrency: Optional[int] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> AsyncIterator[Tuple[int, Union[Stage3Output, ImageFailure]]]:
+        """按完成顺序产出 (输入位置, 结果)；调用方提前停止迭代时取消尚未完成的场景"""
+        semaphore = asyncio.Semaphore(max_concurrency or settings.stage3_max_concurrency)
+        
+        async def run(index: int, stage2_output: Stage2Output):
+            async with semaphore:
+                return index, await self.generate_scene_image_with_retry(stage2_output, **params)
+        
+        tasks = [asyncio.create_task(run(index, output)) for index, output in enumerate(stage2_outputs)]
+        try:
+            for done, next_finished in enumerate(asyncio.as_completed(tasks), 1):
+                index, result = await next_finished
+                if on_progress is not None:
+                    on_progress(done, len(tasks), result)
+                yield index, result
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def iter_images(
+        self,
+        stage2_outputs: List[Stage2Output],
+        size: str = "1024x1024",
+        quality: str = "standard",
+        model: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> AsyncIterator[Stage3Output]:
+        """
+        并发生成图像，每完成一张就立即产出，不等待整批结束
+        
+        Args:
+            on_progress: 每个场景结束（成功或重试用尽）时调用 on_progress(已完成数, 总数, 结果)，
+                结果为 Stage3Output 或 ImageFailure
+        
+        Yields:
+            按完成顺序排列的 Stage3Output；全部结束后若有场景失败，抛出 Stage3ImageError
+        """
+        params = {"size": size, "quality": quality, "model": model, "max_attempts": max_attempts}
+        results: list = [None] * len(stage2_outputs)
+        
+        async for index, result in self._iter_results(stage2_outputs, params, max_concurrency, on_progress):
+            results[index] = result
+            if not isinstance(result, ImageFailure):
+                yield result
+        
+        self.collect_results(results)
+    
     async def generate_all_images(
         self,
         stage2_outputs: List[Stage2Output],
@@ -139,66 +329,52 @@ class Stage3ImageGenerationService:
         quality: str = "standard",
         model: Optional[str] = None,
         concurrent: bool = True,
+        max_concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        on_progress: Optional[ProgressCallback] = None,
     ) -> List[Stage3Output]:
         """
         生成所有场景的图像
         
+        单个场景失败会先按 STAGE3_SCENE_ATTEMPTS 重试，重试用尽也不会取消其它场景。
+        需要边生成边使用结果时改用 iter_images。
+        
         Args:
             stage2_outputs: Stage2 输出列表
             size: 图像尺寸
             quality: 图像质量
             model: 模型名称
             concurrent: 是否并发执行（默认True，提升3倍速度）
+            max_concurrency: 并发上限（默认 STAGE3_MAX_CONCURRENCY）
+            max_attempts: 每个场景最多尝试的次数（默认 STAGE3_SCENE_ATTEMPTS）
+            on_progress: 每个场景结束时调用 on_progress(已完成数, 总数, 结果)
         
         Returns:
-            Stage3Output 列表
+            与输入顺序一致的 Stage3Output 列表；有场景最终失败时抛出 Stage3ImageError，
+            其中带有已生成的图像和失败列表，调用方只需重新生成失败的场景
         """
+        params = {"size": size, "quality": quality, "model": model, "max_attempts": max_attempts}
+        
         if concurrent:
-            # 并发执行：同时发起所有请求，大幅提升速度
-            print(f"🚀 并发模式：同时生成 {len(stage2_outputs)} 张图像")
-            
-            tasks = [
-                self.generate_scene_image(
-                    stage2_output=output,
-                    size=size,
-                    quality=quality,
-                    model=model,
-                )
-                for output in stage2_outputs
-            ]
-            
-            # asyncio.gather 并发执行所有任务
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # 检查错误
-            final_results = []
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    scene_id = stage2_outputs[i].scene_id
-                    print(f"❌ {scene_id} 生成失败: {result}")
-                    raise result
-                else:
-                    final_results.append(result)
+            limit = max_concurrency or settings.stage3_max_concurrency
+            print(f"🚀 并发模式：生成 {len(stage2_outputs)} 张图像（并发上限 {limit}）")
             
-            return final_results
+            results: list = [None] * len(stage2_outputs)
+            async for index, result in self._iter_results(stage2_outputs, params, limit, on_progress):
+                results[index] = result
+            return self.collect_results(results)
         else:
             # 串行执行：逐个生成（用于调试或API限流）
             print(f"🐌 串行模式：依次生成 {len(stage2_outputs)} 张图像")
             
             results = []
             for i, stage2_output in enumerate(stage2_outputs, 1):
-                try:
-                    print(f"📸 正在生成 {i}/{len(stage2_outputs)}: {stage2_output.scene_id}")
-                    result = await self.generate_scene_image(
-                        stage2_output=stage2_output,
-                        size=size,
-                        quality=quality,
-                        model=model,
-                    )
-                    results.append(result)
+                print(f"📸 正在生成 {i}/{len(stage2_outputs)}: {stage2_output.scene_id}")
+                result = await self.generate_scene_image_with_retry(stage2_output, **params)
+                if not isinstance(result, ImageFailure):
                     print(f"✅ {stage2_output.scene_id} 完成")
-                except Exception as e:
-                    print(f"❌ {stage2_output.scene_id} 失败: {e}")
-                    raise
+                if on_progress is not None:
+                    on_progress(i, len(stage2_outputs), result)
+                results.append(result)
             
-            return results
+            return self.collect_results(results)
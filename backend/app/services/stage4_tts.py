@@ -1,14 +1,17 @@
 import os
 import asyncio
-import requests
 import aiofiles
 import base64
+import hashlib
 import json
 import uuid
 from pathlib import Path
 from typing import Optional, List, Dict
 from app.config import settings
 from app.models.schemas import Stage1Output, Character, Scene, Dialogue
+from app.services.http_pool import get_http_client
+from app.services.resilience import resilience_policies
+from app.services.single_flight import single_flights
 
 try:
     from mutagen.mp3 import MP3
@@ -222,6 +225,69 @@ class Stage4TTSService:
         
         return str(abs_output)
     
+    async def _request_audio_volcengine(
+        self,
+        text: str,
+        voice: str,
+        emotion_params: Optional[dict],
+    ) -> bytes:
+        request_json = {
+            "app": {
+                "appid": self.appid,
+                "token": self.access_token,
+                "cluster": self.cluster
+            },
+            "user": {
+                "uid": "tts_user"
+            },
+            "audio": {
+                "voice_type": voice,
+                "encoding": "mp3",
+                "speed_ratio": emotion_params.get("speed", 1.0) if emotion_params else 1.0,
+                "volume_ratio": emotion_params.get("volume", 1.0) if emotion_params else 1.0,
+                "pitch_ratio": emotion_params.get("pitch", 1.0) if emotion_params else 1.0,
+            },
+            "request": {
+                "reqid": str(uuid.uuid4()),
+                "text": text,
+                "text_type": "plain",
+                "operation": "query",
+                "with_frontend": 1,
+                "frontend_type": "unitTson"
+            }
+        }
+        
+        headers = {
+            "Authorization": f"Bearer;{self.access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        api_url = "https://openspeech.bytedance.com/api/v1/tts"
+        
+        client = get_http_client()
+        body = json.dumps(request_json)
+        policy = resilience_policies.get("volcengine.tts")
+        response = await policy.call(
+            lambda: client.post(api_url, content=body, headers=headers)
+        )
+        
+        result = response.json()
+        
+        if "data" not in result or not result["data"]:
+            error_msg = result.get("message", "Unknown error")
+            raise ValueError(f"Invalid API response: {error_msg}")
+        
+        audio_b64 = result["data"]
+        if not isinstance(audio_b64, str) or len(audio_b64) > 10_000_000:
+            raise ValueError("Invalid or oversized audio data")
+        
+        try:
+            audio_data = base64.b64decode(audio_b64)
+        except Exception:
+            raise ValueError("Invalid base64 encoded audio data")
+        
+        return audio_data
+
     async def _generate_audio_volcengine(
         self,
         text: str,
@@ -238,56 +304,13 @@ class Stage4TTSService:
             
             output_path = self._sanitize_output_path(output_path)
             
-            request_json = {
-                "app": {
-                    "appid": self.appid,
-                    "token": self.access_token,
-                    "cluster": self.cluster
-                },
-                "user": {
-                    "uid": "tts_user"
-                },
-                "audio": {
-                    "voice_type": voice,
-                    "encoding": "mp3",
-                    "speed_ratio": emotion_params.get("speed", 1.0) if emotion_params else 1.0,
-                    "volume_ratio": emotion_params.get("volume", 1.0) if emotion_params else 1.0,
-                    "pitch_ratio": emotion_params.get("pitch", 1.0) if emotion_params else 1.0,
-                },
-                "request": {
-                    "reqid": str(uuid.uuid4()),
-                    "text": text,
-                    "text_type": "plain",
-                    "operation": "query",
-                    "with_frontend": 1,
-                    "frontend_type": "unitTson"
-                }
-            }
-            
-            headers = {
-                "Authorization": f"Bearer;{self.access_token}",
-                "Content-Type": "application/json"
-            }
-            
-            api_url = "https://openspeech.bytedance.com/api/v1/tts"
-            
-            response = requests.post(api_url, data=json.dumps(request_json), headers=headers)
-
-            
-            result = response.json()
-            
-            if "data" not in result or not result["data"]:
-                error_msg = result.get("message", "Unknown error")
-                raise ValueError(f"Invalid API response: {error_msg}")
-            
-            audio_b64 = result["data"]
-            if not isinstance(audio_b64, str) or len(audio_b64) > 10_000_000:
-                raise ValueError("Invalid or oversized audio data")
-            
-            try:
-                audio_data = base64.b64decode(audio_b64)
-            except Exception:
-                raise ValueError("Invalid base64 encoded audio data")
+            # 相同文本、音色和情绪参数的并发请求只调用一次 TTS
+            fingerprint = json.dumps([text, voice, emotion_params, self.cluster], sort_keys=True, ensure_ascii=False)
+            flight_key = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+            audio_data = await single_flights.get("volcengine.tts").do(
+                flight_key,
+                lambda: self._request_audio_volcengine(text, voice, emotion_params),
+            )
             
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
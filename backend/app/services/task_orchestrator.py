@@ -4,17 +4,36 @@
 
 import os
 import json
+import shutil
 import asyncio
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from uuid import uuid4
 
+from app.config import settings
+from app.models.schemas import Stage1Output, Stage2Output, Stage3Output, Character, Scene
 from app.services.stage1_text_analysis import Stage1TextAnalysisService
 from app.services.stage2_image_prompt import Stage2ImagePromptService
-from app.services.stage3_image_generation import Stage3ImageGenerationService
+from app.services.stage3_image_generation import Stage3ImageError, Stage3ImageGenerationService
 from app.services.stage4_tts import Stage4TTSService
 from app.services.stage5_video_composition import Stage5VideoCompositionService
+from app.services.usage_tracker import usage_tracker
+from app.services.incremental import (
+    CHUNKS_FILE,
+    ChunkRecord,
+    PreviousRun,
+    chunk_fingerprint,
+    load_previous_run,
+    match_scenes,
+    reuse_file,
+    save_chunk_records,
+    scene_fingerprints,
+    stash_directory,
+)
+
+
+DEFAULT_OUTPUT_BASE_DIR = "./output/tasks"
 
 
 class TaskOrchestrator:
@@ -25,13 +44,15 @@ class TaskOrchestrator:
     原始文本 → Stage1 → Stage2 → Stage3 → Stage4 → Stage5 → 最终视频
     """
     
-    def __init__(self, output_base_dir: str = "./output/tasks"):
+    def __init__(self, output_base_dir: str = DEFAULT_OUTPUT_BASE_DIR, stage1_streaming: Optional[bool] = None):
         """
         初始化任务编排器
         
         Args:
             output_base_dir: 任务输出的基础目录
+            stage1_streaming: 是否流式执行 Stage1 并提前启动 Stage2（默认读取配置）
         """
+        self.stage1_streaming = settings.stage1_streaming if stage1_streaming is None else stage1_streaming
         self.output_base_dir = Path(output_base_dir)
         self.output_base_dir.mkdir(parents=True, exist_ok=True)
         
@@ -111,8 +132,187 @@ class TaskOrchestrator:
             "updated_at": datetime.now().isoformat(),
             **kwargs
         }
+        self._attach_usage(task_id, metadata)
         self._save_metadata(task_id, metadata)
     
+    def _attach_usage(self, task_id: str, metadata: Dict[str, Any]):
+        """把当前任务的 token/费用统计写入元数据"""
+        usage = usage_tracker.task_summary(task_id)
+        if usage is not None:
+            metadata["usage"] = usage
+    
+    async def _run_stage1_streaming(
+        self,
+        text: str,
+        scenes_count: int,
+    ) -> Tuple[Stage1Output, List[asyncio.Task]]:
+        """
+        流式执行 Stage1，每收到一个完整场景就立即启动该场景的 Stage2
+        
+        Returns:
+            (Stage1 输出, 按场景顺序排列的 Stage2 任务列表)
+        """
+        characters: List[Character] = []
+        started: Dict[str, Tuple[Scene, asyncio.Task]] = {}
+        all_tasks: List[asyncio.Task] = []
+        stage1_output = None
+        semaphore = asyncio.Semaphore(settings.stage2_max_concurrency)
+        
+        def start(scene: Scene, scene_characters: List[Character]) -> asyncio.Task:
+            task = asyncio.create_task(
+                self.stage2_service.generate_image_prompt_bounded(
+                    scene=scene,
+                    characters=scene_characters,
+                    semaphore=semaphore,
+                )
+            )
+            all_tasks.append(task)
+            return task
+        
+        try:
+            async for kind, value in self.stage1_service.analyze_text_stream(text, scenes_count):
+                if kind == "character":
+                    characters.append(value)
+                elif kind == "scene":
+                    print(f"   ↳ 场景 {value.scene_id} 已解析，开始生成提示词")
+                    previous = started.get(value.scene_id)
+                    if previous is not None:
+                        previous[1].cancel()
+                    started[value.scene_id] = (value, start(value, list(characters)))
+                else:
+                    stage1_output = value
+            
+            # 最终结果经过校验和修复，可能重新编号或重新生成了部分场景；
+            # 内容与提前产出时一致的场景沿用已启动的任务，其余场景重新生成提示词
+            stage2_tasks: List[asyncio.Task] = []
+            for scene in stage1_output.scenes:
+                entry = started.pop(scene.scene_id, None)
+                if entry is not None and entry[0] == scene:
+                    stage2_tasks.append(entry[1])
+                else:
+                    if entry is not None:
+                        entry[1].cancel()
+                    stage2_tasks.append(start(scene, list(stage1_output.characters)))
+            for _, task in started.values():
+                task.cancel()
+        except BaseException:
+            for task in all_tasks:
+                task.cancel()
+            raise
+        
+        return stage1_output, stage2_tasks
+    
+    @staticmethod
+    def _prompts_in_scene_order(
+        scenes: List[Scene],
+        generated: List[Stage2Output],
+        reused: Dict[str, Stage2Output],
+    ) -> List[Stage2Output]:
+        """
+        把新生成的提示词和复用的提示词按场景顺序排好
+        
+        generated 与未复用的场景按顺序一一对应，按位置而不是模型回显的 scene_id 对应；
+        回显的 scene_id 有误时改回输入场景的编号。
+        """
+        pending = iter(generated)
+        ordered = []
+        for scene in scenes:
+            prompt = reused[scene.scene_id] if scene.scene_id in reused else next(pending)
+            if prompt.scene_id != scene.scene_id:
+                prompt = prompt.model_copy(update={"scene_id": scene.scene_id})
+            ordered.append(prompt)
+        return ordered
+    
+    @staticmethod
+    def _in_scene_order(scenes: List[Scene], generated: list, reused: dict) -> list:
+        """把新生成的结果和复用的结果按场景顺序排好"""
+        by_scene = {item.scene_id: item for item in generated}
+        by_scene.update(reused)
+        return [by_scene[scene.scene_id] for scene in scenes]
+    
+    def _reuse_prompts(
+        self,
+        stage1_output: Stage1Output,
+        previous: Optional[PreviousRun],
+        scene_matches: Dict[str, str],
+    ) -> Dict[str, Stage2Output]:
+        """未改动场景沿用上一轮的提示词（scene_id 和角色 ID 按本轮编号改写）"""
+        if previous is None:
+            return {}
+        
+        reused = {}
+        for scene in stage1_output.scenes:
+            prompt = previous.prompts.get(scene_matches.get(scene.scene_id))
+            if prompt is not None:
+                reused[scene.scene_id] = prompt.model_copy(update={
+                    "scene_id": scene.scene_id,
+                    "characters_in_scene": list(scene.characters),
+                })
+        return reused
+    
+    def _reuse_images(
+        self,
+        images_dir: Path,
+        stash: Optional[Path],
+        previous: Optional[PreviousRun],
+        scene_matches: Dict[str, str],
+    ) -> Dict[str, Stage3Output]:
+        """未改动场景的图像从上一轮目录链接回来"""
+        if previous is None or stash is None:
+            return {}
+        
+        reused = {}
+        for scene_id, old_scene_id in scene_matches.items():
+            image = previous.images.get(old_scene_id)
+            if image is None:
+                continue
+            path = reuse_file(image.image_path, stash, images_dir, old_scene_id, scene_id)
+            if path is not None:
+                reused[scene_id] = image.model_copy(update={"scene_id": scene_id, "image_path": path})
+        return reused
+    
+    @staticmethod
+    def _finished_in_scene_order(scenes: List[Scene], generated: list, reused: dict) -> list:
+        """已完成的图像按场景顺序排好，尚未完成的场景跳过"""
+        by_scene = {item.scene_id: item for item in generated}
+        by_scene.update(reused)
+        return [by_scene[scene.scene_id] for scene in scenes if scene.scene_id in by_scene]
+    
+    @staticmethod
+    def _write_stage3_output(output_file: Path, images: List[Stage3Output], **extra):
+        # 先写临时文件再替换，图像列表接口读取时不会读到半个文件
+        tmp_file = output_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "total_images": len(images),
+                **extra,
+                "images": [img.model_dump() for img in images],
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, output_file)
+    
+    def _save_partial_images(
+        self,
+        task_id: str,
+        scenes: List[Scene],
+        error: Stage3ImageError,
+        reused: Dict[str, Stage3Output],
+        output_file: Path,
+    ):
+        """Stage3 部分失败时写出已完成的图像和失败列表，供下一轮增量运行复用"""
+        images = self._finished_in_scene_order(scenes, error.completed, reused)
+        failures = [failure.to_dict() for failure in error.failures]
+        self._write_stage3_output(output_file, images, failures=failures)
+        
+        self._update_stage_status(
+            task_id, "stage3", "failed",
+            output_file=str(output_file),
+            images_count=len(images),
+            reused_count=len(reused),
+            failed_scenes=error.failed_scene_ids,
+            failures=failures,
+        )
+        print(f"⚠️  Stage 3 部分失败: {len(images)} 张图像已保存, {len(failures)} 个场景待重新生成")
+    
     async def run_task(
         self,
         text: str,
@@ -127,7 +327,8 @@ class TaskOrchestrator:
             text: 原始故事文本
             scenes_count: 要生成的场景数量
             task_name: 任务名称
-            task_id: 已有的任务ID（可选，如果不提供则创建新任务）
+            task_id: 已有的任务ID（可选，如果不提供则创建新任务）。
+                对已运行过的任务重新提交时，只重算改动过的文本块和受影响的场景
             
         Returns:
             任务结果字典，包含所有阶段的输出路径和元数据
@@ -137,6 +338,10 @@ class TaskOrchestrator:
             task_id = self.create_task(task_name)
         
         task_dir = self._get_task_dir(task_id)
+        previous = load_previous_run(task_dir)
+        
+        # 本任务（包括其创建的子任务）中的 OpenRouter 调用都计入该任务
+        usage_token = usage_tracker.bind_task(task_id)
         
         print(f"\n{'='*60}")
         print(f"🚀 开始执行任务: {task_id}")
@@ -152,7 +357,22 @@ class TaskOrchestrator:
             with open(input_file, "w", encoding="utf-8") as f:
                 f.write(text)
             
-            stage1_output = await self.stage1_service.analyze_text(text, scenes_count)
+            stage2_tasks = None
+            # 长文本分块、大场景数两阶段分析、重新提交的增量分析，都不使用单请求流式
+            if previous is None and self.stage1_streaming and self.stage1_service.should_stream(text, scenes_count):
+                stage1_output, stage2_tasks = await self._run_stage1_streaming(text, scenes_count)
+                fingerprint = chunk_fingerprint(text, self.stage1_service.chunk_backend())
+                chunk_records = [ChunkRecord(fingerprint, scenes_count, stage1_output)]
+            else:
+                stage1_output, chunk_records = await self.stage1_service.analyze_text_incremental(
+                    text, scenes_count,
+                    previous_chunks=previous.chunks if previous else None,
+                )
+            
+            # 按指纹对应上一轮的场景，对应上的场景复用下游产物
+            scene_matches = match_scenes(previous.scenes, scene_fingerprints(stage1_output)) if previous else {}
+            invalidated_scenes = [s.scene_id for s in stage1_output.scenes if s.scene_id not in scene_matches]
+            save_chunk_records(task_dir / "stage1" / CHUNKS_FILE, chunk_records)
             
             # 保存 Stage1 输出
             stage1_output_file = task_dir / "stage1" / "output.json"
@@ -163,7 +383,8 @@ class TaskOrchestrator:
                 task_id, "stage1", "completed",
                 output_file=str(stage1_output_file),
                 scenes_count=stage1_output.metadata.total_scenes,
-                characters_count=stage1_output.metadata.total_characters
+                characters_count=stage1_output.metadata.total_characters,
+                invalidated_scenes=invalidated_scenes,
             )
             
             print(f"✅ Stage 1 完成: {stage1_output.metadata.total_scenes} 个场景, "
@@ -173,7 +394,30 @@ class TaskOrchestrator:
             print("\n🎨 Stage 2: 图像提示词生成")
             self._update_stage_status(task_id, "stage2", "running")
             
-            stage2_outputs = await self.stage2_service.generate_all_prompts(stage1_output)
+            reused_prompts = self._reuse_prompts(stage1_output, previous, scene_matches)
+            pending_output = stage1_output.model_copy(update={
+                "scenes": [s for s in stage1_output.scenes if s.scene_id not in reused_prompts],
+            })
+            
+            if not pending_output.scenes:
+                stage2_outputs = []
+            elif stage2_tasks is not None:
+                # 流式模式下 Stage2 已在 Stage1 过程中启动，这里只需等待完成
+                try:
+                    results = await asyncio.gather(*stage2_tasks, return_exceptions=True)
+                except BaseException:
+                    for task in stage2_tasks:
+                        task.cancel()
+                    raise
+                stage2_outputs = self.stage2_service.collect_results(stage1_output.scenes, results)
+            elif settings.stage2_batch_enabled:
+                stage2_outputs = await self.stage2_service.generate_all_prompts_batched(pending_output)
+            else:
+                stage2_outputs = await self.stage2_service.generate_all_prompts(
+                    pending_output,
+                    concurrent=True,
+                )
+            stage2_outputs = self._prompts_in_scene_order(stage1_output.scenes, stage2_outputs, reused_prompts)
             
             # 保存 Stage2 输出
             stage2_output_file = task_dir / "stage2" / "output.json"
@@ -185,7 +429,8 @@ class TaskOrchestrator:
             self._update_stage_status(
                 task_id, "stage2", "completed",
                 output_file=str(stage2_output_file),
-                prompts_count=len(stage2_outputs)
+                prompts_count=len(stage2_outputs),
+                reused_count=len(reused_prompts),
             )
             
             print(f"✅ Stage 2 完成: {len(stage2_outputs)} 个图像提示词")
@@ -199,34 +444,69 @@ class TaskOrchestrator:
             
             # 初始化 Stage3 服务（指定输出目录）
             images_dir = task_dir / "stage3" / "images"
+            # 重新提交时先把上一轮的图像移到一边，未改动场景的图像再按新编号链接回来
+            stash = stash_directory(images_dir) if previous else None
             stage3_service = Stage3ImageGenerationService(output_dir=str(images_dir))
             
             # 并发生成所有图像
             # 从环境变量读取图像生成模型（如果未设置则使用默认值）
-            import os
             image_model = os.getenv("IMAGE_GENERATION_MODEL", "openai/gpt-5-image-mini")
             
-            stage3_outputs = await stage3_service.generate_all_images(
-                stage2_outputs=stage2_outputs,
-                concurrent=True,  # 并发模式
-                model=image_model  # 使用配置的模型
-            )
+            stage3_output_file = task_dir / "stage3" / "output.json"
+            try:
+                reused_images = self._reuse_images(images_dir, stash, previous, scene_matches)
+                pending_prompts = [p for p in stage2_outputs if p.scene_id not in reused_images]
+                total_images = len(stage1_output.scenes)
+                
+                # 先写出复用的图像，覆盖上一轮的输出
+                self._write_stage3_output(
+                    stage3_output_file,
+                    self._finished_in_scene_order(stage1_output.scenes, [], reused_images),
+                    in_progress=True,
+                )
+                
+                def on_progress(done: int, total: int, result):
+                    self._update_stage_status(
+                        task_id, "stage3", "running",
+                        output_file=str(stage3_output_file),
+                        completed_images=len(reused_images) + done,
+                        total_images=total_images,
+                        reused_count=len(reused_images),
+                    )
+                
+                # 每完成一张就按场景顺序写出已完成的图像，图像列表接口可以立即展示
+                stage3_outputs = []
+                async for image in stage3_service.iter_images(
+                    pending_prompts,
+                    model=image_model,  # 使用配置的模型
+                    on_progress=on_progress,
+                ):
+                    stage3_outputs.append(image)
+                    print(f"   ↳ {image.scene_id} 图像已生成 ({len(reused_images) + len(stage3_outputs)}/{total_images})")
+                    self._write_stage3_output(
+                        stage3_output_file,
+                        self._finished_in_scene_order(stage1_output.scenes, stage3_outputs, reused_images),
+                        in_progress=True,
+                    )
+            except Stage3ImageError as e:
+                # 保存已生成的图像，重新提交该任务时只重新生成失败的场景
+                self._save_partial_images(task_id, stage1_output.scenes, e, reused_images, stage3_output_file)
+                raise
+            finally:
+                if stash is not None:
+                    shutil.rmtree(stash, ignore_errors=True)
+            stage3_outputs = self._in_scene_order(stage1_output.scenes, stage3_outputs, reused_images)
             
             elapsed = time.time() - start_time
             
             # 保存 Stage3 输出
-            stage3_output_file = task_dir / "stage3" / "output.json"
-            with open(stage3_output_file, "w", encoding="utf-8") as f:
-                json.dump({
-                    "total_images": len(stage3_outputs),
-                    "elapsed_seconds": elapsed,
-                    "images": [img.model_dump() for img in stage3_outputs]
-                }, f, ensure_ascii=False, indent=2)
+            self._write_stage3_output(stage3_output_file, stage3_outputs, elapsed_seconds=elapsed)
             
             self._update_stage_status(
                 task_id, "stage3", "completed",
                 output_file=str(stage3_output_file),
                 images_count=len(stage3_outputs),
+                reused_count=len(reused_images),
                 elapsed_seconds=elapsed
             )
             
@@ -334,6 +614,7 @@ class TaskOrchestrator:
                 "subtitle_path": stage5_output.subtitle_path,
                 "duration": stage5_output.duration
             }
+            self._attach_usage(task_id, metadata)
             self._save_metadata(task_id, metadata)
             
             print(f"\n{'='*60}")
@@ -385,9 +666,12 @@ class TaskOrchestrator:
             metadata["status"] = "failed"
             metadata["error"] = str(e)
             metadata["failed_at"] = datetime.now().isoformat()
+            self._attach_usage(task_id, metadata)
             self._save_metadata(task_id, metadata)
             
             raise
+        finally:
+            usage_tracker.unbind_task(usage_token)
     
     def get_task_status(self, task_id: str) -> Dict[str, Any]:
         """
@@ -0,0 +1,189 @@
+"""
+长文本分块 - 按章节和段落边界切分小说，并按长度分配场景数
+
+优先在章节标题处断开，其次在由段落内容决定的断点处断开；单个段落超长时再按句子切分。
+断点只取决于段落本身，修改一段只影响附近的块，重新提交时其余块可以复用。
+"""
+
+import bisect
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# 章节标题：第X章/回/节/卷、Chapter N、序章/楔子/尾声等
+CHAPTER_PATTERN = re.compile(
+    r"^\s*(第[零一二三四五六七八九十百千万两\d]+[章回节卷部集]|chapter\s+\d+|序章|楔子|引子|尾声|番外)",
+    re.IGNORECASE,
+)
+
+SENTENCE_END = re.compile(r"(?<=[。！？!?…；;])")
+
+
+def is_chapter_heading(paragraph: str) -> bool:
+    return len(paragraph) <= 50 and bool(CHAPTER_PATTERN.match(paragraph))
+
+
+def _split_long_paragraph(paragraph: str, max_chars: int) -> List[str]:
+    """超长段落按句子切分，单句仍超长时硬切"""
+    pieces: List[str] = []
+    current = ""
+    for sentence in SENTENCE_END.split(paragraph):
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if len(current) + len(sentence) > max_chars and current:
+            pieces.append(current)
+            current = ""
+        current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_anchor(piece: str, span: int) -> bool:
+    """按段落内容的哈希决定是否在其后断开，平均每 span 字出现一个断点，与段落在全文中的位置无关"""
+    return zlib.crc32(piece.encode("utf-8")) * span < len(piece) << 32
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    把文本切成不超过 max_chars 的块
+    
+    当前块已超过一半长度且下一段是章节标题时提前断开，使块尽量与章节对齐；
+    没有章节标题时，块超过 1/4 长度后在内容决定的断点处断开（见 _is_anchor），
+    只有到达 max_chars 才按长度硬断。
+    """
+    paragraphs = [p.strip() for p in text.splitlines() if p.strip()]
+    
+    chunks: List[str] = []
+    current: List[str] = []
+    current_len = 0
+    
+    def flush():
+        nonlocal current, current_len
+        if current:
+            chunks.append("\n".join(current))
+        current, current_len = [], 0
+    
+    for paragraph in paragraphs:
+        if is_chapter_heading(paragraph) and current_len >= max_chars // 2:
+            flush()
+        
+        pieces = [paragraph] if len(paragraph) <= max_chars else _split_long_paragraph(paragraph, max_chars)
+        for piece in pieces:
+            # +1 为换行符
+            if current and current_len + len(piece) + 1 > max_chars:
+                flush()
+            current.append(piece)
+            current_len += len(piece) + 1
+            if current_len >= max_chars // 4 and not is_chapter_heading(piece) and _is_anchor(piece, max_chars // 3):
+                flush()
+    
+    flush()
+    return chunks
+
+
+def merge_to_count(chunks: List[str], max_count: int, max_chars: Optional[int] = None) -> List[str]:
+    """
+    块数多于 max_count 时，反复合并相邻两块中总长度最短的一对
+    
+    给出 max_chars 时合并后的块不超过该长度，此时返回的块数可能仍多于 max_count。
+    """
+    chunks = list(chunks)
+    while len(chunks) > max(max_count, 1):
+        index = min(range(len(chunks) - 1), key=lambda i: len(chunks[i]) + len(chunks[i + 1]))
+        if max_chars is not None and len(chunks[index]) + len(chunks[index + 1]) + 1 > max_chars:
+            break
+        chunks[index:index + 2] = ["\n".join(chunks[index:index + 2])]
+    return chunks
+
+
+def allocate_scenes(lengths: List[int], total_scenes: int, pinned: Optional[Dict[int, int]] = None) -> List[int]:
+    """
+    按长度比例分配场景数（最大余数法），每块至少 1 个
+    
+    pinned 为 块下标 -> 固定的场景数（重新提交时未改动的块沿用上次的场景数），
+    其余场景按长度分给其他块；固定后其他块无法每块分到至少 1 个时忽略 pinned。
+    
+    块数多于场景数时无法每块都分到场景：把场景均匀地放在全文的各个位置上，
+    每个场景计入它所在的块，其余块分到 0 个。
+    """
+    if not lengths:
+        return []
+    
+    count = len(lengths)
+    
+    if pinned:
+        free = [i for i in range(count) if i not in pinned]
+        rest = total_scenes - sum(pinned.values())
+        if (rest >= len(free) > 0) or (not free and rest == 0):
+            allocation = [pinned.get(i, 0) for i in range(count)]
+            for i, scenes in zip(free, allocate_scenes([lengths[i] for i in free], rest)):
+                allocation[i] = scenes
+            return allocation
+    
+    if count > total_scenes:
+        return _allocate_by_position(lengths, total_scenes)
+    
+    extra = total_scenes - count
+    total_length = sum(lengths) or count
+    
+    quotas = [extra * length / total_length for length in lengths]
+    allocation = [1 + int(quota) for quota in quotas]
+    
+    remaining = total_scenes - sum(allocation)
+    by_remainder = sorted(range(count), key=lambda i: quotas[i] - int(quotas[i]), reverse=True)
+    for i in by_remainder[:remaining]:
+        allocation[i] += 1
+    
+    return allocation
+
+
+def merge_unallocated(chunks: List[str], allocation: List[int]) -> Tuple[List[str], List[int]]:
+    """
+    把分到 0 个场景的块并入相邻的有场景的块，保证全文每一段都被分析
+    
+    两个有场景的块之间的一串 0 场景块前一半并入前一块、后一半并入后一块；
+    开头和结尾的 0 场景块并入最近的有场景的块。
+    """
+    allocated = [i for i, scenes in enumerate(allocation) if scenes > 0]
+    if not allocated:
+        return chunks, allocation
+    
+    # 每块归入的有场景块：落在两个有场景块之间时按距离就近归入
+    owners = []
+    for i in range(len(chunks)):
+        k = bisect.bisect_right(allocated, i) - 1
+        if k < 0:
+            owners.append(allocated[0])
+        elif k + 1 < len(allocated) and allocated[k + 1] - i < i - allocated[k]:
+            owners.append(allocated[k + 1])
+        else:
+            owners.append(allocated[k])
+    
+    merged: Dict[int, List[str]] = {}
+    for chunk, owner in zip(chunks, owners):
+        merged.setdefault(owner, []).append(chunk)
+    return ["\n".join(merged[i]) for i in allocated], [allocation[i] for i in allocated]
+
+
+def _allocate_by_position(lengths: List[int], total_scenes: int) -> List[int]:
+    """第 k 个场景落在全文 (k + 0.5) / total_scenes 处，计入该位置所在的块"""
+    allocation = [0] * len(lengths)
+    total_length = sum(lengths) or len(lengths)
+    
+    index = 0
+    end = lengths[0]
+    for k in range(total_scenes):
+        position = (k + 0.5) * total_length / total_scenes
+        while position >= end and index < len(lengths) - 1:
+            index += 1
+            end += lengths[index]
+        allocation[index] += 1
+    
+    return allocation
@@ -0,0 +1,157 @@
+"""
+Token 与费用统计 - 记录每次 OpenRouter 调用的 usage、耗时、模型和阶段
+
+每条记录同时累加到三处：
+- 发起调用的 OpenRouterClient 实例（client.usage）
+- 全局按客户端名称汇总（usage_tracker.clients）
+- 当前任务（TaskOrchestrator 通过 bind_task 绑定，写入 task_metadata.json）
+
+当前任务通过 contextvars 传递，asyncio.create_task 创建的子任务会自动继承。
+"""
+
+import contextvars
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+_current_task: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_task_id", default=None)
+
+
+@dataclass
+class UsageRecord:
+    model: str
+    stage: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    # OpenRouter 在请求带 usage.include 时返回的实际费用（美元）
+    cost: float = 0.0
+    latency: float = 0.0
+    # 命中服务商提示词缓存的输入 token 数（usage.prompt_tokens_details.cached_tokens）
+    cached_tokens: int = 0
+    
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+    
+    @classmethod
+    def from_usage(cls, model: str, stage: str, usage: Optional[dict], latency: float) -> "UsageRecord":
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        details = usage.get("prompt_tokens_details") or {}
+        return cls(
+            model=model,
+            stage=stage,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=usage.get("total_tokens") or prompt_tokens + completion_tokens,
+            cost=float(usage.get("cost") or 0.0),
+            latency=latency,
+            cached_tokens=details.get("cached_tokens") or 0,
+        )
+
+
+class UsageTotals:
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.cost = 0.0
+        self.latency = 0.0
+        self.cached_tokens = 0
+        self.cache_hit_calls = 0
+    
+    def add(self, record: UsageRecord):
+        self.calls += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.total_tokens += record.total_tokens
+        self.cost += record.cost
+        self.latency += record.latency
+        self.cached_tokens += record.cached_tokens
+        if record.cached_tokens:
+            self.cache_hit_calls += 1
+    
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": round(self.cost, 6),
+            "latency_seconds": round(self.latency, 3),
+            # 提示词缓存：命中的输入 token 占比，以及命中缓存的调用占比
+            "cached_tokens": self.cached_tokens,
+            "prompt_cache_hit_rate": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            "prompt_cache_hit_calls": round(self.cache_hit_calls / self.calls, 4) if self.calls else 0.0,
+        }
+
+
+class UsageAccumulator:
+    """总计 + 按阶段 + 按模型三个维度的累加"""
+    
+    def __init__(self):
+        self.total = UsageTotals()
+        self.by_stage: Dict[str, UsageTotals] = {}
+        self.by_model: Dict[str, UsageTotals] = {}
+        self._lock = threading.Lock()
+    
+    def add(self, record: UsageRecord):
+        with self._lock:
+            self.total.add(record)
+            self.by_stage.setdefault(record.stage, UsageTotals()).add(record)
+            self.by_model.setdefault(record.model, UsageTotals()).add(record)
+    
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                **self.total.to_dict(),
+                "by_stage": {stage: totals.to_dict() for stage, totals in self.by_stage.items()},
+                "by_model": {model: totals.to_dict() for model, totals in self.by_model.items()},
+            }
+
+
+class UsageTracker:
+    def __init__(self):
+        self.clients: Dict[str, UsageAccumulator] = {}
+        self.tasks: Dict[str, UsageAccumulator] = {}
+        self._lock = threading.Lock()
+    
+    def _get(self, table: Dict[str, UsageAccumulator], key: str) -> UsageAccumulator:
+        with self._lock:
+            accumulator = table.get(key)
+            if accumulator is None:
+                accumulator = UsageAccumulator()
+                table[key] = accumulator
+            return accumulator
+    
+    def record(self, client_name: str, record: UsageRecord):
+        self._get(self.clients, client_name).add(record)
+        
+        task_id = _current_task.get()
+        if task_id is not None:
+            self._get(self.tasks, task_id).add(record)
+    
+    def bind_task(self, task_id: str) -> contextvars.Token:
+        """把当前上下文（及之后创建的子任务）中的调用归到 task_id 下"""
+        self._get(self.tasks, task_id)
+        return _current_task.set(task_id)
+    
+    def unbind_task(self, token: contextvars.Token):
+        _current_task.reset(token)
+    
+    def task_summary(self, task_id: str) -> Optional[dict]:
+        accumulator = self.tasks.get(task_id)
+        return accumulator.summary() if accumulator else None
+    
+    def stats(self) -> dict:
+        return {
+            "clients": {name: acc.summary() for name, acc in self.clients.items()},
+            "tasks": {task_id: acc.total.to_dict() for task_id, acc in self.tasks.items()},
+        }
+
+
+usage_tracker = UsageTracker()
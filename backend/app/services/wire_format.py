@@ -0,0 +1,125 @@
+"""
+紧凑输出格式 - 让模型输出短键名、无空白的 JSON，本地再展开成完整的 schema
+
+生成延迟与输出 token 数成正比，缩进和长键名在每个场景里都要重复一遍。
+紧凑格式只改变模型与我们之间的传输格式，展开后仍然构造 Stage1Output / Stage2Output。
+能在本地推出的字段（场景编号、元数据计数、单场景提示词的 scene_id）不再让模型输出。
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+DIALOGUE_KEYS = {"c": "character", "t": "text", "e": "emotion"}
+CHARACTER_KEYS = {"i": "id", "n": "name", "d": "description", "p": "personality", "a": "aliases"}
+SCENE_KEYS = {
+    "d": "description",
+    "v": "composition",
+    "c": "characters",
+    "n": "narration",
+    "g": ("dialogues", DIALOGUE_KEYS),
+    "ip": "image_prompt",
+    "np": "negative_prompt",
+    "st": "style_tags",
+}
+PROMPT_KEYS = {"i": "scene_id", "p": "image_prompt", "np": "negative_prompt", "st": "style_tags", "c": "characters_in_scene"}
+
+STAGE1_STREAM_KEYS = ("c", "s")
+
+
+def expand_keys(data: Any, keys: Dict[str, Any]) -> Any:
+    """按键名表把短键展开为完整键名；表里没有的键原样保留（模型偶尔仍输出完整键名）"""
+    if isinstance(data, list):
+        return [expand_keys(item, keys) for item in data]
+    if not isinstance(data, dict):
+        return data
+    
+    expanded = {}
+    for key, value in data.items():
+        spec = keys.get(key, key)
+        if isinstance(spec, tuple):
+            name, sub_keys = spec
+            expanded[name] = expand_keys(value, sub_keys)
+        else:
+            expanded[spec] = value
+    return expanded
+
+
+def expand_character(item: Any) -> Any:
+    return expand_keys(item, CHARACTER_KEYS)
+
+
+def expand_scene(item: Any, position: int) -> Any:
+    """场景按出现顺序编号；模型自己给了编号时保留"""
+    scene = expand_keys(item, SCENE_KEYS)
+    if isinstance(scene, dict):
+        scene.setdefault("scene_id", f"scene_{position:03d}")
+        scene.setdefault("order", position)
+    return scene
+
+
+def expand_stage1(data: Any) -> Dict[str, Any]:
+    """{"t", "c", "s"} -> {"metadata", "characters", "scenes"}，元数据计数按实际数量填写"""
+    if not isinstance(data, dict):
+        return {}
+    if "scenes" in data or "metadata" in data:
+        # 模型没有按紧凑格式输出
+        return data
+    
+    characters = [expand_character(item) for item in data.get("c") or []]
+    scenes = [expand_scene(item, position) for position, item in enumerate(data.get("s") or [], 1)]
+    return {
+        "metadata": {
+            "total_scenes": len(scenes),
+            "story_title": data.get("t") or "",
+            "total_characters": len(characters),
+        },
+        "characters": characters,
+        "scenes": scenes,
+    }
+
+
+def expand_prompt(data: Any, scene_id: Optional[str] = None, characters: Optional[List[str]] = None) -> Any:
+    """单个提示词条目；单场景请求时 scene_id 和出场角色由调用方补上"""
+    prompt = expand_keys(data, PROMPT_KEYS)
+    if isinstance(prompt, dict):
+        if scene_id is not None:
+            prompt.setdefault("scene_id", scene_id)
+        if characters is not None:
+            prompt.setdefault("characters_in_scene", list(characters))
+    return prompt
+
+
+def expand_prompt_batch(data: Any) -> Dict[str, Any]:
+    """{"ps": [...]} -> {"prompts": [...]}"""
+    items = data.get("ps", data.get("prompts", [])) if isinstance(data, dict) else data
+    return {"prompts": [expand_prompt(item) for item in items or []]}
+
+
+def stage1_schema(fused_prompts: bool = False) -> str:
+    """Stage1 分析提示词中的紧凑格式说明"""
+    prompt_fields = ',"ip":"英文图像提示词","np":"负向提示词","st":["anime"]' if fused_prompts else ""
+    prompt_legend = "，ip=image_prompt 图像提示词，np=negative_prompt 负向提示词，st=style_tags 风格标签" if fused_prompts else ""
+    
+    return f"""请按照以下紧凑JSON格式输出结构化数据（使用短键名，不要换行、缩进和多余空格）：
+
+{{"t":"故事标题（根据内容推断）","c":[{{"i":"char_001","n":"角色名称","d":"角色外貌特征描述（用于图像生成）","p":"性格特点","a":["其他称呼，没有则为空数组"]}}],"s":[{{"d":"场景的视觉描述（环境、氛围、光线等）","v":"镜头构图（如：远景/中景/特写，俯视/平视/仰视）","c":["char_001"],"n":"旁白文字","g":[{{"c":"char_001","t":"对话内容","e":"情绪"}}]{prompt_fields}}}]}}
+
+键名说明：t=故事标题；c=角色列表（i=角色ID，n=名称，d=外貌描述，p=性格，a=别名）；s=按故事顺序排列的场景列表（d=场景描述，v=构图，c=出场角色ID，n=旁白，g=对话列表：c=角色ID，t=对话文本，e=情绪{prompt_legend}）"""
+
+
+def stage2_schema() -> str:
+    """Stage2 单场景提示词的紧凑格式说明"""
+    return """请按照以下紧凑JSON格式输出（使用短键名，不要换行、缩进和多余空格）：
+
+{"p":"详细的英文图像生成提示词（包含场景、角色、构图、风格、质量标签）","np":"负向提示词（要避免的元素）","st":["anime","high_quality","4k"]}
+
+键名说明：p=图像提示词，np=负向提示词，st=风格标签"""
+
+
+def stage2_batch_schema() -> str:
+    """Stage2 批量提示词的紧凑格式说明"""
+    return """请按照以下紧凑JSON格式输出，ps 数组中每个场景一项，顺序与场景列表一致（使用短键名，不要换行、缩进和多余空格）：
+
+{"ps":[{"i":"场景ID","p":"详细的英文图像生成提示词（包含场景、角色、构图、风格、质量标签）","np":"负向提示词（要避免的元素）","st":["anime","high_quality","4k"],"c":["角色ID"]}]}
+
+键名说明：ps=提示词列表，i=场景ID，p=图像提示词，np=负向提示词，st=风格标签，c=出场角色ID"""
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+共享连接池基准测试
+
+在本地启动一个假的 /chat/completions 端点，分别用
+「每次请求新建 AsyncClient」和「共享连接池」两种方式
+并发发起 100 个 Stage2 / Stage3 请求，对比单请求延迟和吞吐量。
+
+运行：
+    cd backend && python ../tests/backend/benchmarks/bench_http_pool.py
+"""
+
+import asyncio
+import base64
+import json
+import socket
+import statistics
+import sys
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "backend"))
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from PIL import Image
+
+from app.config import settings
+from app.services.http_pool import HTTP2_AVAILABLE, close_http_client
+from app.services.openrouter_client import OpenRouterClient
+from app.services.stage3_image_generation import Stage3ImageGenerationService
+
+
+CONCURRENCY = 100
+FAKE_LATENCY = 0.02
+
+
+def _build_fake_app() -> FastAPI:
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), color="red").save(buffer, format="PNG")
+    image_url = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    
+    stage2_content = json.dumps({
+        "scene_id": "scene_001",
+        "image_prompt": "anime style, masterpiece",
+        "negative_prompt": "low quality",
+        "style_tags": ["anime"],
+        "characters_in_scene": [],
+    })
+    
+    fake_app = FastAPI()
+    
+    @fake_app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(FAKE_LATENCY)
+        
+        message = {"role": "assistant", "content": stage2_content}
+        if "image" in body["model"]:
+            message = {"role": "assistant", "content": "", "images": [{"image_url": {"url": image_url}}]}
+        
+        return {"choices": [{"message": message}]}
+    
+    return fake_app
+
+
+def _start_server() -> tuple:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    
+    config = uvicorn.Config(_build_fake_app(), host="127.0.0.1", port=port, log_level="error")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    
+    while not server.started:
+        time.sleep(0.05)
+    
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def _per_call_post(url: str, payload: dict) -> dict:
+    """基线：旧实现，每次请求新建 AsyncClient"""
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        response = await client.post(url, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+
+async def _timed(coro) -> float:
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+def _report(label: str, latencies: list, wall: float):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<28} p50={statistics.median(latencies) * 1000:7.1f}ms  "
+          f"p95={p95 * 1000:7.1f}ms  throughput={len(latencies) / wall:7.1f} req/s")
+
+
+async def _run(label: str, factory):
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[_timed(factory(i)) for i in range(CONCURRENCY)])
+    _report(label, latencies, time.perf_counter() - start)
+
+
+async def main():
+    server, base_url = _start_server()
+    url = f"{base_url}/chat/completions"
+    
+    client = OpenRouterClient(api_key="bench", base_url=base_url)
+    stage3 = Stage3ImageGenerationService(client=client, output_dir="/tmp/bench_http_pool")
+    
+    # 每个请求的消息都不同，避免被 single-flight 合并或命中响应缓存、图像缓存
+    def messages(i: int) -> list:
+        return [{"role": "user", "content": f"scene {i}"}]
+    
+    print(f"并发数: {CONCURRENCY}, 假端点延迟: {FAKE_LATENCY * 1000:.0f}ms\n")
+    
+    try:
+        await _run("Stage2 per-call client", lambda i: _per_call_post(
+            url, {"model": "fake/text", "messages": messages(i)}))
+        await _run("Stage2 shared pool", lambda i: client.structured_completion(
+            messages=messages(i), model="fake/text", bypass_cache=True))
+        
+        await _run("Stage3 per-call client", lambda i: _per_call_post(
+            url, {"model": "fake/image", "messages": messages(i)}))
+        await _run("Stage3 shared pool", lambda i: stage3.generate_image_from_prompt(
+            prompt=f"scene {i}", model="fake/image"))
+        
+        print(f"\n连接池: http2={settings.http2_enabled and HTTP2_AVAILABLE}, "
+              f"max_connections={settings.http_max_connections}, "
+              f"max_keepalive={settings.http_max_keepalive_connections}")
+    finally:
+        await close_http_client()
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+提示词缓存基准测试：Stage2 逐场景提示词生成时，开启与关闭 cache_control 断点的对比
+
+Fake OpenRouter 按显式断点模拟服务商的提示词缓存，并按 --prompt-tokens-per-second
+模拟输入处理耗时（命中缓存的部分不计）。输出每种配置的缓存命中率、总耗时和估算费用。
+
+运行：
+    cd backend && python ../tests/backend/benchmarks/bench_prompt_cache.py --scenes 30 --characters 12
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "backend"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+os.environ.setdefault("OPENROUTER_API_KEY", "fake-key")
+
+from fake_openrouter import FakeOpenRouterConfig, FakeOpenRouterServer
+from app.config import settings
+from app.models.schemas import Stage1Output
+from app.services.http_pool import close_http_client
+from app.services.openrouter_client import OpenRouterClient
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="提示词缓存基准测试")
+    parser.add_argument("--scenes", type=int, default=30)
+    parser.add_argument("--characters", type=int, default=12, help="角色数，决定共用角色表的长度")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    return parser.parse_args()
+
+
+def build_stage1_output(scenes: int, characters: int, story: int) -> Stage1Output:
+    return Stage1Output(**{
+        "metadata": {"total_scenes": scenes, "story_title": f"基准测试{story}", "total_characters": characters},
+        "characters": [
+            {"id": f"char_{i:03d}", "name": f"角色{story}-{i}", "description": "黑色短发，深蓝色风衣，身材修长，左眉有一道浅疤，常戴一块旧怀表" * 2}
+            for i in range(1, characters + 1)
+        ],
+        "scenes": [
+            {
+                "scene_id": f"scene_{i:03d}",
+                "order": i,
+                "description": f"第{i}个场景：黄昏的城市街道，霓虹灯逐渐亮起",
+                "composition": "中景，平视",
+                "characters": [f"char_{(i % characters) + 1:03d}"],
+                "narration": f"旁白{i}",
+            }
+            for i in range(1, scenes + 1)
+        ],
+    })
+
+
+async def main():
+    args = parse_args()
+    
+    server = FakeOpenRouterServer(FakeOpenRouterConfig(
+        latency_distribution="fixed",
+        latency_mean=args.latency,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        seed=42,
+    ))
+    base_url = server.start()
+    
+    print(f"场景数: {args.scenes}, 角色数: {args.characters}, 并发度: {args.concurrency}\n")
+    print(f"{'cache_control':<16}{'命中调用':>10}{'命中 token':>12}{'总耗时':>10}{'费用':>12}")
+    
+    for story, enabled in enumerate((False, True), 1):
+        settings.llm_prompt_cache_control = enabled
+        # 每种配置用不同的角色表，避免共用上一轮写入的缓存
+        stage1 = build_stage1_output(args.scenes, args.characters, story)
+        client = OpenRouterClient(api_key="fake-key", base_url=base_url, cache=None)
+        service = Stage2ImagePromptService(client=client)
+        
+        start = time.perf_counter()
+        await service.generate_all_prompts(stage1, bypass_cache=True, concurrent=True, max_concurrency=args.concurrency)
+        elapsed = time.perf_counter() - start
+        
+        summary = client.usage.summary()
+        print(f"{str(enabled):<16}{summary['prompt_cache_hit_calls']:>10.0%}{summary['prompt_cache_hit_rate']:>12.0%}"
+              f"{elapsed:>9.2f}s{summary['cost']:>12.6f}")
+    
+    await close_http_client()
+    server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
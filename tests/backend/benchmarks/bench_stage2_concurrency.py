@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Stage2 并发度基准测试
+
+用模拟 OpenRouter 客户端（固定延迟 + 抖动）对比不同并发度下
+generate_all_prompts 的总耗时。
+
+运行：
+    cd backend && python ../tests/backend/benchmarks/bench_stage2_concurrency.py
+"""
+
+import asyncio
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "backend"))
+
+from app.models.schemas import Stage1Output
+from app.services.prompt_layout import message_text
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+
+
+SCENES_COUNT = 50
+MOCK_LATENCY = 0.2
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+
+
+class MockOpenRouterClient:
+    """模拟一次 Stage2 LLM 调用：约 MOCK_LATENCY 秒后返回合法的 Stage2Output JSON"""
+    
+    async def structured_completion(self, messages, model, temperature=0.7, max_tokens=1024, bypass_cache=False, stage="unknown"):
+        await asyncio.sleep(MOCK_LATENCY * random.uniform(0.8, 1.2))
+        scene_id = re.search(r"场景ID：(\S+)", message_text(messages[0])).group(1)
+        return {
+            "scene_id": scene_id,
+            "image_prompt": "anime style, masterpiece",
+            "negative_prompt": "low quality",
+            "style_tags": ["anime"],
+            "characters_in_scene": [],
+        }
+
+
+def build_stage1_output() -> Stage1Output:
+    return Stage1Output(**{
+        "metadata": {"total_scenes": SCENES_COUNT, "story_title": "基准测试", "total_characters": 1},
+        "characters": [{"id": "char_001", "name": "张三", "description": "黑发青年"}],
+        "scenes": [
+            {
+                "scene_id": f"scene_{i:03d}",
+                "order": i,
+                "description": "清晨的街道",
+                "composition": "远景",
+                "characters": ["char_001"],
+                "narration": "旁白",
+            }
+            for i in range(1, SCENES_COUNT + 1)
+        ],
+    })
+
+
+async def main():
+    service = Stage2ImagePromptService(client=MockOpenRouterClient())
+    stage1_output = build_stage1_output()
+    
+    print(f"场景数: {SCENES_COUNT}, 模拟单次调用延迟: {MOCK_LATENCY * 1000:.0f}ms\n")
+    print(f"{'并发度':<8}{'总耗时':>10}{'加速比':>10}")
+    
+    start = time.perf_counter()
+    await service.generate_all_prompts(stage1_output)
+    baseline = time.perf_counter() - start
+    print(f"{'串行':<8}{baseline:>9.2f}s{1.0:>9.1f}x")
+    
+    for level in CONCURRENCY_LEVELS:
+        start = time.perf_counter()
+        prompts = await service.generate_all_prompts(stage1_output, concurrent=True, max_concurrency=level)
+        elapsed = time.perf_counter() - start
+        assert [p.scene_id for p in prompts] == [s.scene_id for s in stage1_output.scenes]
+        print(f"{level:<8}{elapsed:>9.2f}s{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
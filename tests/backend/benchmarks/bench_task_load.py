@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+全流程离线压测：对本地 Fake OpenRouter 并发运行多个 TaskOrchestrator.run_task
+
+不需要 OpenRouter API Key 和网络。每个任务的阶段状态和 token 统计从 task_metadata.json 读取，
+同时输出替身服务的请求统计和客户端侧的 token/费用统计。
+
+Stage1-3 全部走替身服务；Stage4（火山引擎 TTS）和 Stage5（ffmpeg）不经过 OpenRouter，
+缺少对应凭证或工具时任务会在 Stage4 标记为失败，不影响前三个阶段的压测结果。
+
+运行：
+    cd backend && python ../tests/backend/benchmarks/bench_task_load.py --tasks 8 --scenes 6 --rate-429 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "backend"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+os.environ.setdefault("OPENROUTER_API_KEY", "fake-key")
+
+from fake_openrouter import FakeOpenRouterConfig, FakeOpenRouterServer
+from app.config import settings
+from app.services.http_pool import close_http_client
+from app.services.task_orchestrator import TaskOrchestrator
+from app.services.usage_tracker import usage_tracker
+
+
+STORY = (
+    "夜幕降临，林远站在天台上望着城市的灯火。苏晴推门而入，带来了一封神秘的信。"
+    "信上只有一个地址和一个时间。两人决定当晚就出发。街道上空无一人，只有风声。"
+    "他们在旧仓库门口停下，门缝里透出微弱的光。林远深吸一口气，推开了门。"
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="全流程离线压测")
+    parser.add_argument("--tasks", type=int, default=4, help="并发任务数")
+    parser.add_argument("--scenes", type=int, default=5, help="每个任务的场景数")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--truncation-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stage1-mode", choices=["llm", "draft"], default="llm",
+                        help="draft 使用规则分镜，压测时跳过 Stage1 的模型调用")
+    return parser.parse_args()
+
+
+async def run_one(orchestrator: TaskOrchestrator, index: int, scenes: int) -> str:
+    task_id = orchestrator.create_task(f"load_{index:03d}")
+    try:
+        # 每个任务的文本不同，避免被 single-flight 合并成一次调用
+        await orchestrator.run_task(text=f"第{index + 1}章。{STORY}", scenes_count=scenes, task_id=task_id)
+    except Exception as e:
+        print(f"   任务 {task_id} 失败: {e}")
+    return task_id
+
+
+async def main():
+    args = parse_args()
+    
+    server = FakeOpenRouterServer(FakeOpenRouterConfig(
+        latency_mean=args.latency,
+        image_latency_mean=args.image_latency,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        truncation_rate=args.truncation_rate,
+        seed=args.seed,
+    ))
+    settings.openrouter_base_url = server.start()
+    settings.llm_cache_enabled = False
+    settings.stage1_mode = args.stage1_mode
+    
+    with tempfile.TemporaryDirectory() as output_dir:
+        orchestrator = TaskOrchestrator(output_base_dir=output_dir)
+        
+        start = time.perf_counter()
+        task_ids = await asyncio.gather(*[
+            run_one(orchestrator, i, args.scenes) for i in range(args.tasks)
+        ])
+        wall = time.perf_counter() - start
+        
+        print(f"\n{'='*60}")
+        print(f"并发任务: {args.tasks}, 每任务场景: {args.scenes}, 总耗时: {wall:.2f}s")
+        print(f"{'='*60}")
+        
+        for task_id in task_ids:
+            metadata = orchestrator.get_task_status(task_id)
+            stages = {name: info["status"] for name, info in metadata["stages"].items()}
+            usage = metadata.get("usage") or {}
+            print(f"{task_id}: {metadata['status']:<10} {stages} "
+                  f"calls={usage.get('calls', 0)} tokens={usage.get('total_tokens', 0)}")
+    
+    print("\nFake OpenRouter:", json.dumps(server.stats.to_dict(), ensure_ascii=False))
+    print("Usage:", json.dumps(usage_tracker.stats()["clients"], ensure_ascii=False, indent=2))
+    
+    await close_http_client()
+    server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+输出格式基准测试：完整格式（长键名 + 缩进）与紧凑格式（短键名、无空白）
+
+用示例故事（tests/backend/stage1/mock_input_*.txt）对本地 Fake OpenRouter 运行
+Stage1 分析和 Stage2 提示词生成（逐场景 + 批量），对比输出 token 数和耗时。
+替身服务按 --tokens-per-second 模拟生成速度，输出越长等待越久；token 数按替身服务的
+估算方式（约 2 字符 1 token）统计，与真实分词器有差异，主要看相对比例。
+
+运行：
+    cd backend && python ../tests/backend/benchmarks/bench_wire_format.py --scenes 10 --tokens-per-second 80
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root / "backend"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+os.environ.setdefault("OPENROUTER_API_KEY", "fake-key")
+
+from fake_openrouter import FakeOpenRouterConfig, FakeOpenRouterServer
+from app.services.http_pool import close_http_client
+from app.services.openrouter_client import OpenRouterClient
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+
+
+STORIES = sorted((project_root / "tests" / "backend" / "stage1").glob("mock_input_*.txt"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="输出格式基准测试")
+    parser.add_argument("--scenes", type=int, default=10, help="每个故事的场景数")
+    parser.add_argument("--latency", type=float, default=0.05, help="每次请求的固定首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="模拟的输出速度")
+    return parser.parse_args()
+
+
+async def run_pipeline(base_url: str, story: str, scenes: int, compact: bool) -> dict:
+    """返回 {步骤: (输出 token 数, 耗时)}"""
+    results = {}
+    
+    async def measure(name, factory):
+        # 每一步用独立的客户端，usage 只统计这一步
+        client = OpenRouterClient(api_key="fake-key", base_url=base_url, cache=None)
+        start = time.perf_counter()
+        value = await factory(client)
+        results[name] = (client.usage.summary()["completion_tokens"], time.perf_counter() - start)
+        return value
+    
+    stage1 = await measure(
+        "stage1",
+        lambda client: Stage1TextAnalysisService(client=client, compact=compact).analyze_text(story, scenes, bypass_cache=True),
+    )
+    await measure(
+        "stage2",
+        lambda client: Stage2ImagePromptService(client=client, compact=compact).generate_all_prompts(
+            stage1, bypass_cache=True, concurrent=True,
+        ),
+    )
+    await measure(
+        "stage2_batch",
+        lambda client: Stage2ImagePromptService(client=client, compact=compact).generate_all_prompts_batched(
+            stage1, bypass_cache=True,
+        ),
+    )
+    return results
+
+
+async def main():
+    args = parse_args()
+    
+    server = FakeOpenRouterServer(FakeOpenRouterConfig(
+        latency_distribution="fixed",
+        latency_mean=args.latency,
+        output_tokens_per_second=args.tokens_per_second,
+        seed=42,
+    ))
+    base_url = server.start()
+    
+    print(f"场景数: {args.scenes}, 输出速度: {args.tokens_per_second:.0f} token/s\n")
+    print(f"{'故事':<28}{'步骤':<14}{'完整 tokens':>12}{'紧凑 tokens':>12}{'节省':>8}{'完整耗时':>10}{'紧凑耗时':>10}")
+    
+    for path in STORIES:
+        story = path.read_text(encoding="utf-8")
+        verbose = await run_pipeline(base_url, story, args.scenes, compact=False)
+        compact = await run_pipeline(base_url, story, args.scenes, compact=True)
+        
+        for step in verbose:
+            (v_tokens, v_time), (c_tokens, c_time) = verbose[step], compact[step]
+            saving = 1 - c_tokens / v_tokens if v_tokens else 0.0
+            print(f"{path.name:<28}{step:<14}{v_tokens:>12}{c_tokens:>12}{saving:>7.0%}{v_time:>9.2f}s{c_time:>9.2f}s")
+    
+    await close_http_client()
+    server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
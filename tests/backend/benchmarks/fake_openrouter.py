@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+本地 OpenRouter 替身服务 - 离线压测/基准测试用
+
+实现 POST /chat/completions，按请求内容返回符合 schema 的结果：
+- Stage1 文本分析：{"metadata", "characters", "scenes"}
+- Stage2 提示词（单场景 / 批量 prompts）
+- Stage3 图像：message.images 中的 base64 PNG
+- 截断续写请求：返回上一次被截断内容的剩余部分
+
+支持配置延迟分布、429 / 5xx 注入比例和截断比例，支持 stream=True 的 SSE 输出，
+响应中带 usage（含估算的 cost）。GET /stats 返回请求计数。
+
+独立运行：
+    python tests/backend/benchmarks/fake_openrouter.py --port 8787 --latency 0.5 --rate-429 0.05
+    # 然后在 backend/.env 中设置 OPENROUTER_BASE_URL=http://127.0.0.1:8787
+
+进程内使用：
+    server = FakeOpenRouterServer(FakeOpenRouterConfig(latency_mean=0.2))
+    base_url = server.start()
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Dict, List, Optional, Set
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+
+@dataclass
+class FakeOpenRouterConfig:
+    # 文本请求延迟（秒）：fixed / uniform / lognormal
+    latency_distribution: str = "lognormal"
+    latency_mean: float = 0.3
+    latency_jitter: float = 0.5
+    # 图像请求的平均延迟（秒），分布与文本相同
+    image_latency_mean: float = 2.0
+    # 故障注入比例
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    retry_after: float = 1.0
+    # 以 finish_reason=length 截断输出的比例
+    truncation_rate: float = 0.0
+    # 流式输出时每个 SSE 块的字符数与间隔
+    stream_chunk_chars: int = 40
+    stream_chunk_interval: float = 0.01
+    image_size: int = 256
+    # 输出速度（token/秒），>0 时按输出长度额外等待，用于对比输出格式对延迟的影响
+    output_tokens_per_second: float = 0.0
+    # 输入处理速度（token/秒），>0 时按未命中提示词缓存的输入长度额外等待
+    prompt_tokens_per_second: float = 0.0
+    # 命中提示词缓存的输入 token 按原价的比例计费
+    cached_price_ratio: float = 0.1
+    # 估算 cost 用的单价（美元 / 1K tokens）
+    price_per_1k_tokens: float = 0.001
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeOpenRouterStats:
+    requests: int = 0
+    by_kind: Dict[str, int] = field(default_factory=dict)
+    injected_429: int = 0
+    injected_5xx: int = 0
+    truncated: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "by_kind": dict(self.by_kind),
+            "injected_429": self.injected_429,
+            "injected_5xx": self.injected_5xx,
+            "truncated": self.truncated,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+        }
+
+
+CONTINUATION_MARKER = "从中断处紧接着继续输出"
+EXPAND_MARKER = "需要展开的场景："
+COMPACT_MARKER = "紧凑JSON格式"
+
+
+class FakeOpenRouter:
+    def __init__(self, config: Optional[FakeOpenRouterConfig] = None):
+        self.config = config or FakeOpenRouterConfig()
+        self.stats = FakeOpenRouterStats()
+        self.random = random.Random(self.config.seed)
+        
+        # 被截断的输出：已返回的前缀 -> 完整文本
+        self._truncated: Dict[str, str] = {}
+        self._image_cache: Dict[int, str] = {}
+        # 提示词缓存：见过的 cache_control 断点之前的完整前缀
+        self._prompt_cache: Set[str] = set()
+        
+        self.app = FastAPI()
+        self.app.post("/chat/completions")(self.chat_completions)
+        self.app.get("/stats")(lambda: self.stats.to_dict())
+    
+    # ========== 请求处理 ==========
+    
+    async def chat_completions(self, request: Request):
+        payload = await request.json()
+        self.stats.requests += 1
+        
+        kind = self._classify(payload)
+        self.stats.by_kind[kind] = self.stats.by_kind.get(kind, 0) + 1
+        
+        cached_chars = self._lookup_prompt_cache(payload)
+        prompt_tokens = self._prompt_chars(payload) // 2
+        self.stats.prompt_tokens += prompt_tokens
+        self.stats.cached_prompt_tokens += cached_chars // 2
+        
+        latency = self._latency(kind)
+        if self.config.prompt_tokens_per_second > 0:
+            latency += (prompt_tokens - cached_chars // 2) / self.config.prompt_tokens_per_second
+        await asyncio.sleep(latency)
+        
+        roll = self.random.random()
+        if roll < self.config.rate_429:
+            self.stats.injected_429 += 1
+            return JSONResponse(
+                {"error": {"code": 429, "message": "Rate limit exceeded (injected)"}},
+                status_code=429,
+                headers={"Retry-After": str(self.config.retry_after)},
+            )
+        if roll < self.config.rate_429 + self.config.rate_5xx:
+            self.stats.injected_5xx += 1
+            status = self.random.choice([500, 502, 503])
+            return JSONResponse({"error": {"code": status, "message": "Upstream error (injected)"}}, status_code=status)
+        
+        if kind == "image":
+            message = {"role": "assistant", "content": "", "images": [self._image_payload()]}
+            return self._completion(payload, message, finish_reason="stop", cached_chars=cached_chars)
+        
+        content = self._build_content(kind, payload)
+        if self.config.output_tokens_per_second > 0:
+            await asyncio.sleep(self._usage(payload, content)["completion_tokens"] / self.config.output_tokens_per_second)
+        finish_reason = "stop"
+        if kind != "continuation" and self.random.random() < self.config.truncation_rate:
+            cut = self.random.randint(len(content) // 3, max(len(content) // 3, len(content) - 2))
+            self._truncated[content[:cut]] = content
+            content = content[:cut]
+            finish_reason = "length"
+            self.stats.truncated += 1
+        
+        if payload.get("stream"):
+            return StreamingResponse(
+                self._sse(payload, content, finish_reason, cached_chars),
+                media_type="text/event-stream",
+            )
+        
+        message = {"role": "assistant", "content": content}
+        return self._completion(payload, message, finish_reason=finish_reason, cached_chars=cached_chars)
+    
+    @staticmethod
+    def _text(content) -> str:
+        """content 为多段（带 cache_control 的提示词）时按顺序拼接"""
+        if isinstance(content, list):
+            return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return content or ""
+    
+    def _prompt_chars(self, payload: dict) -> int:
+        return sum(len(self._text(m.get("content"))) for m in payload.get("messages", []))
+    
+    def _lookup_prompt_cache(self, payload: dict) -> int:
+        """
+        模拟显式断点的提示词缓存（Anthropic 语义）：每个 cache_control 断点之前的完整前缀
+        写入缓存；之后的请求在某个断点处与缓存的前缀完全相同时，该前缀计为命中
+        """
+        prefix = ""
+        breakpoints = []
+        for message in payload.get("messages", []):
+            content = message.get("content")
+            for part in content if isinstance(content, list) else [{"text": content or ""}]:
+                if not isinstance(part, dict):
+                    continue
+                prefix += part.get("text", "")
+                if part.get("cache_control"):
+                    breakpoints.append(prefix)
+        
+        hit = max((len(bp) for bp in breakpoints if bp in self._prompt_cache), default=0)
+        self._prompt_cache.update(breakpoints)
+        return hit
+    
+    def _classify(self, payload: dict) -> str:
+        messages = payload.get("messages") or [{}]
+        last = self._text(messages[-1].get("content"))
+        
+        if CONTINUATION_MARKER in last:
+            return "continuation"
+        if "image" in payload.get("model", "") or last.startswith("Generate an image:"):
+            return "image"
+        if '"prompts"' in last or '{"ps":' in last:
+            return "stage2_batch"
+        if EXPAND_MARKER in last:
+            return "stage1_expand"
+        if '"outline"' in last:
+            return "stage1_outline"
+        # 融合模式的 Stage1 提示词里也有 "image_prompt"，先按故事文本识别
+        if "故事文本：" in last:
+            return "stage1"
+        if '"image_prompt"' in last or '"np":' in last:
+            return "stage2"
+        return "stage1"
+    
+    def _latency(self, kind: str) -> float:
+        mean = self.config.image_latency_mean if kind == "image" else self.config.latency_mean
+        if mean <= 0:
+            return 0.0
+        
+        jitter = self.config.latency_jitter
+        if self.config.latency_distribution == "fixed":
+            return mean
+        if self.config.latency_distribution == "uniform":
+            return self.random.uniform(mean * (1 - jitter), mean * (1 + jitter))
+        # lognormal：长尾，sigma=jitter，均值保持为 mean
+        return self.random.lognormvariate(0, jitter) * mean / math.exp(jitter ** 2 / 2)
+    
+    def _completion(self, payload: dict, message: dict, finish_reason: str, cached_chars: int = 0) -> dict:
+        return {
+            "id": f"gen-fake-{self.stats.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": self._usage(payload, message.get("content") or "", cached_chars),
+        }
+    
+    async def _sse(self, payload: dict, content: str, finish_reason: str, cached_chars: int = 0):
+        size = max(1, self.config.stream_chunk_chars)
+        for start in range(0, len(content), size):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content[start:start + size]}}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(self.config.stream_chunk_interval)
+        
+        final = {
+            "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+            "usage": self._usage(payload, content, cached_chars),
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    def _usage(self, payload: dict, content: str, cached_chars: int = 0) -> dict:
+        # 粗略估算：中文约 1 字 1 token，英文约 4 字符 1 token，这里统一按 2 字符 1 token
+        prompt_tokens = max(1, self._prompt_chars(payload) // 2)
+        cached_tokens = min(prompt_tokens, cached_chars // 2)
+        completion_tokens = max(1, len(content) // 2)
+        total = prompt_tokens + completion_tokens
+        billed = total - cached_tokens * (1 - self.config.cached_price_ratio)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            "completion_tokens": completion_tokens,
+            "total_tokens": total,
+            "cost": round(billed / 1000 * self.config.price_per_1k_tokens, 8),
+        }
+    
+    # ========== 内容生成 ==========
+    
+    def _build_content(self, kind: str, payload: dict) -> str:
+        prompt = self._text(payload["messages"][-1]["content"])
+        
+        if kind == "continuation":
+            prefix = self._text(payload["messages"][-2]["content"])
+            full = self._truncated.pop(prefix, None)
+            return full[len(prefix):] if full is not None else ""
+        
+        # 模型会照着提示词里的示例排版：完整格式带缩进，紧凑格式用短键名、无空白
+        if COMPACT_MARKER in prompt:
+            return json.dumps(self._compact(kind, self._build_document(kind, prompt)), ensure_ascii=False, separators=(",", ":"))
+        return json.dumps(self._build_document(kind, prompt), ensure_ascii=False, indent=2)
+    
+    def _build_document(self, kind: str, prompt: str) -> dict:
+        if kind == "stage2":
+            scene_id = re.search(r"场景ID：(\S+)", prompt)
+            characters = re.search(r"出场角色ID：(.*)", prompt)
+            return self._stage2_item(
+                scene_id.group(1) if scene_id else "scene_001",
+                [c.strip() for c in characters.group(1).split(",") if c.strip() != "无"] if characters else [],
+            )
+        
+        if kind == "stage2_batch":
+            scene_ids = re.findall(r"^\[(scene_[^\]]+)\]", prompt, flags=re.MULTILINE)
+            return {"prompts": [self._stage2_item(scene_id, []) for scene_id in scene_ids]}
+        
+        if kind == "stage1_outline":
+            document = self._stage1_document(prompt)
+            document["outline"] = [
+                {"scene_id": scene["scene_id"], "order": scene["order"], "summary": scene["narration"]}
+                for scene in document.pop("scenes")
+            ]
+            return document
+        
+        if kind == "stage1_expand":
+            total = len(re.findall(r"^scene_\d+:", prompt, flags=re.MULTILINE))
+            wanted = prompt.split(EXPAND_MARKER, 1)[1].split("\n", 1)[0].split("、")
+            scenes = self._stage1_document(prompt, scenes_count=total)["scenes"]
+            return {"scenes": [scene for scene in scenes if scene["scene_id"] in wanted]}
+        
+        return self._stage1_document(prompt)
+    
+    @staticmethod
+    def _compact(kind: str, document: dict) -> dict:
+        """按 app.services.wire_format 的短键名改写；场景编号、元数据等可在本地推出的字段省略"""
+        def prompt_item(item: dict, with_ids: bool) -> dict:
+            compact = {"p": item["image_prompt"], "np": item["negative_prompt"], "st": item["style_tags"]}
+            if with_ids:
+                compact.update({"i": item["scene_id"], "c": item["characters_in_scene"]})
+            return compact
+        
+        if kind == "stage2":
+            return prompt_item(document, with_ids=False)
+        if kind == "stage2_batch":
+            return {"ps": [prompt_item(item, with_ids=True) for item in document["prompts"]]}
+        if kind != "stage1":
+            return document
+        
+        scenes = []
+        for scene in document["scenes"]:
+            compact = {
+                "d": scene["description"],
+                "v": scene["composition"],
+                "c": scene["characters"],
+                "n": scene["narration"],
+                "g": [{"c": d["character"], "t": d["text"], "e": d["emotion"]} for d in scene["dialogues"]],
+            }
+            if "image_prompt" in scene:
+                compact.update({"ip": scene["image_prompt"], "np": scene["negative_prompt"], "st": scene["style_tags"]})
+            scenes.append(compact)
+        
+        return {
+            "t": document["metadata"]["story_title"],
+            "c": [
+                {"i": c["id"], "n": c["name"], "d": c["description"], "p": c["personality"]}
+                for c in document["characters"]
+            ],
+            "s": scenes,
+        }
+    
+    def _stage1_document(self, prompt: str, scenes_count: Optional[int] = None) -> dict:
+        if scenes_count is None:
+            match = re.search(r'"total_scenes":\s*(\d+)', prompt) or re.search(r"拆分为 (\d+) 个分镜场景", prompt)
+            scenes_count = int(match.group(1)) if match else 3
+        
+        story = prompt.split("故事文本：", 1)[-1].split("请将上面的故事", 1)[0].split("角色表：", 1)[0].strip()
+        sentences = [s for s in re.split(r"(?<=[。！？!?.])", story) if s.strip()] or ["故事开始了。"]
+        
+        characters = [
+            {"id": "char_001", "name": "林远", "description": "黑色短发，深蓝色风衣，身材修长", "personality": "沉稳"},
+            {"id": "char_002", "name": "苏晴", "description": "齐肩棕发，白色连衣裙，眼神明亮", "personality": "活泼"},
+        ]
+        
+        scenes = []
+        for i in range(scenes_count):
+            sentence = sentences[i * len(sentences) // scenes_count].strip()
+            cast = ["char_001"] if i % 2 == 0 else ["char_001", "char_002"]
+            scenes.append({
+                "scene_id": f"scene_{i + 1:03d}",
+                "order": i + 1,
+                "description": f"黄昏的城市街道，霓虹灯逐渐亮起，{sentence}",
+                "composition": self.random.choice(["远景，平视", "中景，俯视", "特写，仰视"]),
+                "characters": cast,
+                "narration": sentence,
+                "dialogues": [
+                    {"character": cast[-1], "text": "我们得快点出发了。", "emotion": "急切"},
+                ],
+            })
+            if '"image_prompt"' in prompt or '"ip":' in prompt:
+                # 融合模式：场景里直接带上图像提示词
+                scenes[-1].update({
+                    key: value for key, value in self._stage2_item(scenes[-1]["scene_id"], cast).items()
+                    if key in ("image_prompt", "negative_prompt", "style_tags")
+                })
+        
+        return {
+            "metadata": {
+                "total_scenes": scenes_count,
+                "story_title": "离线测试故事",
+                "total_characters": len(characters),
+            },
+            "characters": characters,
+            "scenes": scenes,
+        }
+    
+    @staticmethod
+    def _stage2_item(scene_id: str, characters: List[str]) -> dict:
+        return {
+            "scene_id": scene_id,
+            "image_prompt": (
+                f"anime style, {scene_id}, city street at dusk, neon lights, cinematic lighting, "
+                "masterpiece, best quality, highly detailed, 4k"
+            ),
+            "negative_prompt": "low quality, blurry, deformed, extra limbs, watermark",
+            "style_tags": ["anime", "high_quality", "4k"],
+            "characters_in_scene": characters,
+        }
+    
+    def _image_payload(self) -> dict:
+        size = self.config.image_size
+        if size not in self._image_cache:
+            buffer = BytesIO()
+            Image.new("RGB", (size, size), (40, 60, 120)).save(buffer, format="PNG")
+            self._image_cache[size] = base64.b64encode(buffer.getvalue()).decode()
+        
+        return {
+            "type": "image_url",
+            "image_url": {"url": f"data:image/png;base64,{self._image_cache[size]}"},
+        }
+
+
+class FakeOpenRouterServer:
+    """在后台线程中运行 FakeOpenRouter，start() 返回 base_url"""
+    
+    def __init__(self, config: Optional[FakeOpenRouterConfig] = None):
+        self.fake = FakeOpenRouter(config)
+        self.server: Optional[uvicorn.Server] = None
+    
+    @property
+    def stats(self) -> FakeOpenRouterStats:
+        return self.fake.stats
+    
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        if port == 0:
+            sock = socket.socket()
+            sock.bind((host, 0))
+            port = sock.getsockname()[1]
+            sock.close()
+        
+        self.server = uvicorn.Server(uvicorn.Config(self.fake.app, host=host, port=port, log_level="critical"))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.02)
+        
+        return f"http://{host}:{port}"
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.should_exit = True
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地 OpenRouter 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency", type=float, default=0.3, help="文本请求平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--image-latency", type=float, default=2.0, help="图像请求平均延迟（秒）")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--truncation-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = FakeOpenRouterConfig(
+        latency_distribution=args.distribution,
+        latency_mean=args.latency,
+        latency_jitter=args.jitter,
+        image_latency_mean=args.image_latency,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        truncation_rate=args.truncation_rate,
+        seed=args.seed,
+    )
+    
+    print(f"🧪 Fake OpenRouter listening on http://{args.host}:{args.port}")
+    print(f"   OPENROUTER_BASE_URL=http://{args.host}:{args.port}")
+    uvicorn.run(FakeOpenRouter(config).app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import pytest
+from app.services import openrouter_client
+from app.services.http_pool import close_http_client
+from app.services.openrouter_client import OpenRouterClient
+from app.services.resilience import ResilienceRegistry
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+from app.services.stage3_image_generation import Stage3ImageGenerationService
+from ..benchmarks.fake_openrouter import FakeOpenRouterConfig, FakeOpenRouterServer
+
+
+@pytest.fixture(scope="module")
+def fake():
+    server = FakeOpenRouterServer(FakeOpenRouterConfig(latency_mean=0, image_latency_mean=0, seed=1))
+    server.base_url = server.start()
+    yield server
+    server.stop()
+
+
+class TestFakeOpenRouterFunctional:
+    
+    @pytest.fixture
+    def client(self, fake, monkeypatch):
+        fake.fake.config.rate_429 = 0.0
+        fake.fake.config.truncation_rate = 0.0
+        monkeypatch.setattr(openrouter_client, "resilience_policies", ResilienceRegistry())
+        monkeypatch.setattr(openrouter_client.settings, "retry_base_delay", 0.001)
+        return OpenRouterClient(api_key="test", base_url=fake.base_url, cache=None)
+    
+    @pytest.mark.asyncio
+    async def test_stage1_to_stage3_offline(self, client, tmp_path):
+        stage1 = await Stage1TextAnalysisService(client=client).analyze_text("夜幕降临。两人出发了。", scenes_count=4)
+        prompts = await Stage2ImagePromptService(client=client).generate_all_prompts(stage1, concurrent=True)
+        image = await Stage3ImageGenerationService(client=client, output_dir=str(tmp_path)).generate_scene_image(prompts[0])
+        
+        assert [scene.scene_id for scene in stage1.scenes] == [f"scene_00{i}" for i in range(1, 5)]
+        assert [prompt.scene_id for prompt in prompts] == [scene.scene_id for scene in stage1.scenes]
+        assert image.width == 256
+        assert client.usage.summary()["by_stage"]["stage3"]["calls"] == 1
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_outlined_stage1_offline(self, client, fake, monkeypatch):
+        monkeypatch.setattr(openrouter_client.settings, "stage1_outline_min_scenes", 20)
+        monkeypatch.setattr(openrouter_client.settings, "stage1_outline_batch_size", 10)
+        before = dict(fake.stats.by_kind)
+        
+        stage1 = await Stage1TextAnalysisService(client=client).analyze_text("夜幕降临。两人出发了。" * 10, scenes_count=25)
+        
+        assert [scene.order for scene in stage1.scenes] == list(range(1, 26))
+        assert fake.stats.by_kind["stage1_outline"] - before.get("stage1_outline", 0) == 1
+        assert fake.stats.by_kind["stage1_expand"] - before.get("stage1_expand", 0) == 3
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_fused_stage1_skips_stage2_requests(self, client, fake):
+        stage1 = await Stage1TextAnalysisService(client=client, fused_prompts=True).analyze_text("夜幕降临。两人出发了。", scenes_count=3)
+        before = dict(fake.stats.by_kind)
+        
+        prompts = await Stage2ImagePromptService(client=client).generate_all_prompts(stage1, concurrent=True)
+        
+        assert all(prompt.image_prompt for prompt in prompts)
+        assert fake.stats.by_kind == before
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_compact_output_offline(self, client):
+        stage1 = await Stage1TextAnalysisService(client=client, compact=True).analyze_text("夜幕降临。两人出发了。", scenes_count=3)
+        prompts = await Stage2ImagePromptService(client=client, compact=True).generate_all_prompts(stage1, concurrent=True)
+        
+        assert [scene.scene_id for scene in stage1.scenes] == ["scene_001", "scene_002", "scene_003"]
+        assert [prompt.scene_id for prompt in prompts] == [scene.scene_id for scene in stage1.scenes]
+        assert prompts[1].characters_in_scene == stage1.scenes[1].characters
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_stage2_fan_out_hits_prompt_cache(self, client):
+        stage1 = await Stage1TextAnalysisService(client=client).analyze_text("雨夜。仓库。天台。码头。", scenes_count=4)
+        
+        await Stage2ImagePromptService(client=client).generate_all_prompts(stage1, bypass_cache=True)
+        
+        # 至多第一次请求写入缓存，其余请求命中固定前缀和角色表（替身服务在本模块内共用）
+        stage2 = client.usage.summary()["by_stage"]["stage2"]
+        assert stage2["prompt_cache_hit_calls"] >= 0.75
+        assert stage2["prompt_cache_hit_rate"] > 0.5
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_streamed_stage1(self, client):
+        kinds = [kind async for kind, _ in Stage1TextAnalysisService(client=client).analyze_text_stream("故事。", 2)]
+        
+        assert kinds == ["character", "character", "scene", "scene", "result"]
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_truncated_output_is_continued(self, client, fake):
+        fake.fake.config.truncation_rate = 1.0
+        before = fake.stats.truncated
+        
+        result = await client.structured_completion(
+            messages=[{"role": "user", "content": '{"total_scenes": 3}'}],
+            model="m",
+            bypass_cache=True,
+        )
+        
+        assert len(result["scenes"]) == 3
+        assert fake.stats.truncated == before + 1
+        assert fake.stats.by_kind["continuation"] >= 1
+        await close_http_client()
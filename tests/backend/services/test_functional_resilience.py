@@ -0,0 +1,161 @@
+import asyncio
+import socket
+import threading
+import time
+import httpx
+import pytest
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from app.services import openrouter_client
+from app.services.http_pool import close_http_client
+from app.services.openrouter_client import OpenRouterClient
+from app.services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResiliencePolicy,
+    ResilienceRegistry,
+    RetryBudget,
+)
+
+
+class FaultInjectingServer:
+    """本地故障注入桩服务：按队列依次返回预设的状态码，队列空了返回 200"""
+    
+    def __init__(self):
+        self.faults = []
+        self.requests = 0
+        self.app = FastAPI()
+        
+        @self.app.post("/chat/completions")
+        async def chat_completions():
+            self.requests += 1
+            status = self.faults.pop(0) if self.faults else 200
+            if status != 200:
+                return JSONResponse({"error": "injected"}, status_code=status, headers={"Retry-After": "0"})
+            return {"choices": [{"message": {"content": '{"ok": true}'}}]}
+    
+    def start(self) -> str:
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="critical"))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.02)
+        
+        return f"http://127.0.0.1:{port}"
+    
+    def stop(self):
+        self.server.should_exit = True
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = FaultInjectingServer()
+    server.base_url = server.start()
+    yield server
+    server.stop()
+
+
+class TestResilienceFunctional:
+    
+    @pytest.fixture
+    def client(self, stub, monkeypatch):
+        stub.faults.clear()
+        stub.requests = 0
+        
+        registry = ResilienceRegistry()
+        monkeypatch.setattr(openrouter_client, "resilience_policies", registry)
+        monkeypatch.setattr(openrouter_client.settings, "retry_base_delay", 0.001)
+        
+        client = OpenRouterClient(api_key="test", base_url=stub.base_url)
+        client.registry = registry
+        return client
+    
+    @pytest.mark.asyncio
+    async def test_transient_5xx_is_retried(self, client, stub):
+        stub.faults.extend([502, 503])
+        
+        result = await client.structured_completion(messages=[], model="m", bypass_cache=True)
+        
+        assert result == {"ok": True}
+        assert stub.requests == 3
+        assert client.registry.stats()["openrouter.chat"]["retries"] == 2
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_client_error_is_not_retried(self, client, stub):
+        stub.faults.append(400)
+        
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.chat_completion(messages=[], model="m")
+        
+        assert stub.requests == 1
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_attempts(self, client, stub, monkeypatch):
+        monkeypatch.setattr(openrouter_client.settings, "retry_max_attempts", 3)
+        stub.faults.extend([500] * 5)
+        
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.chat_completion(messages=[], model="m")
+        
+        assert stub.requests == 3
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_breaker_opens_after_repeated_failures(self, client, stub, monkeypatch):
+        monkeypatch.setattr(openrouter_client.settings, "retry_max_attempts", 1)
+        monkeypatch.setattr(openrouter_client.settings, "circuit_failure_threshold", 2)
+        stub.faults.extend([500] * 5)
+        
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.chat_completion(messages=[], model="m")
+        
+        with pytest.raises(CircuitOpenError):
+            await client.chat_completion(messages=[], model="m")
+        
+        assert stub.requests == 2
+        await close_http_client()
+
+
+class TestResiliencePolicyUnit:
+    
+    def test_full_jitter_backoff_is_bounded(self):
+        policy = ResiliencePolicy("e", base_delay=1.0, max_delay=5.0)
+        
+        delays = [policy.backoff(attempt) for attempt in range(10) for _ in range(20)]
+        
+        assert all(0 <= d <= 5.0 for d in delays)
+        assert policy.backoff(0, retry_after=3.0) >= 3.0
+    
+    def test_half_open_allows_single_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        
+        assert breaker.allow()
+        assert not breaker.allow()
+        
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+    
+    @pytest.mark.asyncio
+    async def test_budget_limits_retries(self):
+        policy = ResiliencePolicy("e", max_attempts=10, base_delay=0, budget=RetryBudget(ratio=0, min_tokens=2))
+        attempts = 0
+        
+        async def send():
+            nonlocal attempts
+            attempts += 1
+            raise httpx.ConnectError("refused")
+        
+        with pytest.raises(httpx.ConnectError):
+            await policy.call(send)
+        
+        assert attempts == 3
+        assert policy.stats()["budget_exhausted"] == 1
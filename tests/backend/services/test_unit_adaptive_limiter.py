@@ -0,0 +1,112 @@
+import asyncio
+import time
+import httpx
+import pytest
+from app.services import openrouter_client
+from app.services.adaptive_limiter import AIMDLimiter, ModelLimiterRegistry, parse_retry_after
+from app.services.openrouter_client import OpenRouterClient
+from app.services.resilience import ResilienceRegistry
+
+
+class TestAdaptiveLimiterUnit:
+    
+    def test_parse_retry_after(self):
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("garbage") is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    
+    @pytest.mark.asyncio
+    async def test_additive_increase_per_window(self):
+        limiter = AIMDLimiter(initial_limit=4, max_limit=10)
+        
+        for _ in range(4):
+            ticket = await limiter.acquire()
+            limiter.release(ticket)
+        
+        assert 4.9 < limiter.limit < 5.0
+    
+    @pytest.mark.asyncio
+    async def test_multiplicative_decrease_once_per_window(self):
+        limiter = AIMDLimiter(initial_limit=8)
+        tickets = [await limiter.acquire() for _ in range(4)]
+        
+        for ticket in tickets:
+            limiter.release(ticket, outcome="overload")
+        
+        assert limiter.limit == 4
+        assert limiter.overloads == 4
+    
+    @pytest.mark.asyncio
+    async def test_in_flight_never_exceeds_limit(self):
+        limiter = AIMDLimiter(initial_limit=3, max_limit=3)
+        peak = 0
+        
+        async def worker():
+            nonlocal peak
+            ticket = await limiter.acquire()
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+            limiter.release(ticket)
+        
+        await asyncio.gather(*[worker() for _ in range(12)])
+        
+        assert peak == 3
+        assert limiter.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_retry_after_blocks_new_requests(self):
+        limiter = AIMDLimiter(initial_limit=4)
+        ticket = await limiter.acquire()
+        limiter.release(ticket, outcome="overload", retry_after=0.1)
+        
+        start = time.monotonic()
+        ticket = await limiter.acquire()
+        limiter.release(ticket)
+        
+        assert time.monotonic() - start >= 0.09
+    
+    @pytest.mark.asyncio
+    async def test_retry_after_holds_already_queued_waiters(self):
+        limiter = AIMDLimiter(initial_limit=1, min_limit=1)
+        ticket = await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        
+        start = time.monotonic()
+        limiter.release(ticket, outcome="overload", retry_after=0.2)
+        await asyncio.sleep(0.05)
+        assert not queued.done()
+        
+        limiter.release(await queued)
+        
+        assert time.monotonic() - start >= 0.19
+        assert limiter.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_client_feeds_status_back_to_limiter(self, monkeypatch):
+        registry = ModelLimiterRegistry()
+        monkeypatch.setattr(openrouter_client, "model_limiters", registry)
+        monkeypatch.setattr(openrouter_client, "resilience_policies", ResilienceRegistry())
+        monkeypatch.setattr(openrouter_client.settings, "retry_max_attempts", 1)
+        
+        statuses = iter([200, 429])
+        
+        def handler(request):
+            status = next(statuses)
+            if status == 200:
+                return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(openrouter_client, "get_http_client", lambda: http_client)
+        
+        client = OpenRouterClient(api_key="test", base_url="http://fake")
+        await client.chat_completion(messages=[], model="m")
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.chat_completion(messages=[], model="m")
+        
+        stats = registry.stats()["m"]
+        assert stats["successes"] == 1
+        assert stats["overloads"] == 1
+        assert stats["in_flight"] == 0
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import httpx
+import pytest
+from app.services import openrouter_client
+from app.services.hedging import LatencyHistogram, ModelLatencyRegistry, hedged_call, latency_key
+from app.services.openrouter_client import OpenRouterClient
+from app.services.resilience import ResilienceRegistry
+
+
+class TestLatencyHistogramUnit:
+    
+    def test_quantiles_follow_observations(self):
+        histogram = LatencyHistogram()
+        for _ in range(90):
+            histogram.observe(0.1)
+        for _ in range(10):
+            histogram.observe(5.0)
+        
+        assert 0.1 <= histogram.quantile(0.5) < 0.13
+        assert 5.0 <= histogram.quantile(0.95) < 6.3
+    
+    def test_window_decays_old_samples(self):
+        histogram = LatencyHistogram(window=100)
+        for _ in range(100):
+            histogram.observe(5.0)
+        for _ in range(300):
+            histogram.observe(0.1)
+        
+        assert histogram.quantile(0.9) < 1.0
+        assert histogram.observed == 400
+    
+    def test_no_hedge_without_enough_samples(self, monkeypatch):
+        monkeypatch.setattr("app.services.hedging.settings.hedging_min_samples", 5)
+        monkeypatch.setattr("app.services.hedging.settings.hedging_min_delay", 0.0)
+        registry = ModelLatencyRegistry()
+        
+        for _ in range(4):
+            registry.observe("m@stage2", 0.2)
+        assert registry.hedge_delay("m@stage2") is None
+        
+        registry.observe("m@stage2", 0.2)
+        assert registry.hedge_delay("m@stage2") == pytest.approx(0.2, rel=0.25)
+
+
+class TestHedgedCallUnit:
+    
+    @staticmethod
+    def delayed(seconds, value=None, error=None):
+        async def run():
+            await asyncio.sleep(seconds)
+            if error:
+                raise error
+            return value
+        return run
+    
+    @pytest.mark.asyncio
+    async def test_fast_primary_does_not_hedge(self):
+        registry = ModelLatencyRegistry()
+        
+        result = await hedged_call("k", self.delayed(0.01, "primary"), self.delayed(0, "backup"), 0.5, registry)
+        
+        assert result == "primary"
+        assert registry.hedges == {}
+    
+    @pytest.mark.asyncio
+    async def test_slow_primary_is_hedged_and_cancelled(self):
+        registry = ModelLatencyRegistry()
+        cancelled = asyncio.Event()
+        
+        async def slow_primary():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        result = await hedged_call("k", slow_primary, self.delayed(0.01, "backup"), 0.02, registry)
+        await asyncio.sleep(0)
+        
+        assert result == "backup"
+        assert registry.hedges == {"k": 1}
+        assert registry.hedge_wins == {"k": 1}
+        assert cancelled.is_set()
+    
+    @pytest.mark.asyncio
+    async def test_failed_backup_falls_back_to_primary(self):
+        registry = ModelLatencyRegistry()
+        
+        result = await hedged_call(
+            "k",
+            self.delayed(0.05, "primary"),
+            self.delayed(0, error=ValueError("backup failed")),
+            0.01,
+            registry,
+        )
+        
+        assert result == "primary"
+        assert registry.hedge_wins == {}
+
+
+class TestClientHedgingUnit:
+    
+    @pytest.mark.asyncio
+    async def test_slow_model_is_hedged_to_fallback(self, monkeypatch):
+        async def handler(request):
+            model = json.loads(request.content)["model"]
+            if model == "slow":
+                await asyncio.sleep(1)
+            return httpx.Response(200, json={
+                "model": model,
+                "choices": [{"message": {"content": model}, "finish_reason": "stop"}],
+            })
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        registry = ModelLatencyRegistry()
+        monkeypatch.setattr(openrouter_client, "get_http_client", lambda: http_client)
+        monkeypatch.setattr(openrouter_client, "resilience_policies", ResilienceRegistry())
+        monkeypatch.setattr(openrouter_client, "model_latencies", registry)
+        monkeypatch.setattr(openrouter_client.settings, "hedging_enabled", True)
+        monkeypatch.setattr(openrouter_client.settings, "hedging_min_samples", 1)
+        monkeypatch.setattr(openrouter_client.settings, "hedging_min_delay", 0.0)
+        monkeypatch.setattr(openrouter_client.settings, "hedging_fallback_models", {"slow": "fast"})
+        registry.observe(latency_key("slow", "stage2"), 0.05)
+        
+        client = OpenRouterClient(api_key="test", base_url="http://fake", cache=None)
+        content = await client.chat_completion(messages=[], model="slow", stage="stage2")
+        
+        assert content == "fast"
+        assert registry.hedge_wins == {"slow@stage2": 1}
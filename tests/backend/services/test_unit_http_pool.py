@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from app.services import http_pool
+from app.services.http_pool import get_http_client, close_http_client
+
+
+class TestHttpPoolUnit:
+    
+    @pytest.mark.asyncio
+    async def test_client_is_shared(self):
+        client = get_http_client()
+        
+        assert get_http_client() is client
+        
+        await close_http_client()
+    
+    @pytest.mark.asyncio
+    async def test_close_releases_client(self):
+        client = get_http_client()
+        
+        await close_http_client()
+        
+        assert client.is_closed
+        assert http_pool._client is None
+        assert get_http_client() is not client
+        
+        await close_http_client()
+    
+    def test_new_event_loop_gets_new_client(self):
+        async def grab():
+            return get_http_client()
+        
+        first = asyncio.run(grab())
+        second = asyncio.run(grab())
+        
+        assert first is not second
+    
+    @pytest.mark.asyncio
+    async def test_pool_limits_from_settings(self, monkeypatch):
+        monkeypatch.setattr(http_pool.settings, "http_max_connections", 7)
+        await close_http_client()
+        
+        client = get_http_client()
+        pool = client._transport._pool
+        
+        assert pool._max_connections == 7
+        
+        await close_http_client()
@@ -0,0 +1,76 @@
+import base64
+import os
+import pytest
+from io import BytesIO
+from unittest.mock import AsyncMock
+from PIL import Image
+from app.models.schemas import Stage2Output
+from app.services.image_cache import INDEX_FILE, ImageCache, make_image_key
+from app.services.stage3_image_generation import Stage3ImageGenerationService
+
+
+def write_png(path, size=(64, 48), color="red"):
+    Image.new("RGB", size, color=color).save(path, format="PNG")
+    return str(path)
+
+
+class TestImageCacheUnit:
+    
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return ImageCache(cache_dir=str(tmp_path / "cache"), max_bytes=1_000_000)
+    
+    def test_key_depends_on_all_parameters(self):
+        base = make_image_key("a cat", "blurry", "model-a", "1024x1024", "standard")
+        
+        assert base == make_image_key("a cat", "blurry", "model-a", "1024x1024", "standard")
+        assert base != make_image_key("a dog", "blurry", "model-a", "1024x1024", "standard")
+        assert base != make_image_key("a cat", None, "model-a", "1024x1024", "standard")
+        assert base != make_image_key("a cat", "blurry", "model-b", "1024x1024", "standard")
+        assert base != make_image_key("a cat", "blurry", "model-a", "512x512", "standard")
+        assert base != make_image_key("a cat", "blurry", "model-a", "1024x1024", "hd")
+    
+    def test_hit_is_hardlinked_into_target(self, cache, tmp_path):
+        source = write_png(tmp_path / "scene_001.png")
+        cache.store("ab" * 32, source, 64, 48)
+        
+        target = tmp_path / "task" / "scene_002.png"
+        assert cache.link_to("ab" * 32, str(target)) == (64, 48)
+        assert os.stat(target).st_ino == os.stat(source).st_ino
+        assert cache.link_to("cd" * 32, str(target)) is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+    
+    def test_index_survives_restart_in_lru_order(self, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+        cache = ImageCache(cache_dir=cache_dir)
+        for i, key in enumerate(["aa" * 32, "bb" * 32]):
+            cache.store(key, write_png(tmp_path / f"{i}.png"), 64, 48)
+        size = cache.stats()["total_bytes"] // 2
+        cache.link_to("aa" * 32, str(tmp_path / "hit.png"))
+        cache.store("cc" * 32, write_png(tmp_path / "2.png"), 64, 48)
+        
+        # 重启后只从索引文件恢复，容量只够两个条目时淘汰最久未使用的 bb
+        reopened = ImageCache(cache_dir=cache_dir, max_bytes=size * 2)
+        
+        assert (tmp_path / "cache" / INDEX_FILE).is_file()
+        assert reopened.stats()["evictions"] == 1
+        assert reopened.link_to("bb" * 32, str(tmp_path / "miss.png")) is None
+        assert reopened.link_to("aa" * 32, str(tmp_path / "a.png")) == (64, 48)
+    
+    @pytest.mark.asyncio
+    async def test_service_skips_api_on_cache_hit(self, cache, tmp_path):
+        service = Stage3ImageGenerationService(client=AsyncMock(), output_dir=str(tmp_path / "task_a"), cache=cache)
+        png = BytesIO()
+        Image.new("RGB", (32, 32)).save(png, format="PNG")
+        service.request_image_source = AsyncMock(return_value="data:image/png;base64," + base64.b64encode(png.getvalue()).decode())
+        prompt = Stage2Output(scene_id="scene_001", image_prompt="a cat", negative_prompt="blurry")
+        
+        first = await service.generate_scene_image(prompt, model="model-a")
+        service.output_dir = str(tmp_path / "task_b")
+        os.makedirs(service.output_dir)
+        second = await service.generate_scene_image(prompt, model="model-a")
+        
+        assert service.request_image_source.await_count == 1
+        assert (second.width, second.height) == (32, 32)
+        assert os.stat(second.image_path).st_ino == os.stat(first.image_path).st_ino
@@ -0,0 +1,48 @@
+import base64
+import os
+import pytest
+from io import BytesIO
+from PIL import Image
+from app.config import settings
+from app.services.image_io import persist_image, probe_image, save_bytes, write_base64
+
+
+def png_bytes(size=(40, 30), mode="RGBA"):
+    buffer = BytesIO()
+    Image.new(mode, size, (10, 20, 30, 255)[:len(mode)]).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestImageIOUnit:
+    
+    def test_base64_is_decoded_in_chunks(self, tmp_path):
+        data = png_bytes()
+        encoded = base64.encodebytes(data).decode()  # 每 76 个字符一个换行
+        
+        write_base64(f"data:image/png;base64,{encoded}", str(tmp_path / "a.png"), chunk_chars=10)
+        
+        assert (tmp_path / "a.png").read_bytes() == data
+    
+    def test_png_passthrough_keeps_original_bytes(self, tmp_path):
+        data = png_bytes()
+        
+        assert save_bytes(data, str(tmp_path / "scene_001.png")) == (40, 30)
+        assert (tmp_path / "scene_001.png").read_bytes() == data
+        assert os.listdir(tmp_path) == ["scene_001.png"]
+    
+    def test_reencode_to_configured_format(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "stage3_image_format", "jpeg")
+        
+        assert save_bytes(png_bytes(), str(tmp_path / "scene_001.jpg")) == (40, 30)
+        assert probe_image(str(tmp_path / "scene_001.jpg")) == ("JPEG", 40, 30)
+    
+    @pytest.mark.asyncio
+    async def test_overwrite_does_not_touch_hardlinked_copy(self, tmp_path):
+        target = tmp_path / "scene_001.png"
+        save_bytes(png_bytes((8, 8)), str(target))
+        os.link(target, tmp_path / "cached")
+        
+        data_url = "data:image/png;base64," + base64.b64encode(png_bytes((16, 16))).decode()
+        assert await persist_image(data_url, str(target)) == (16, 16)
+        
+        assert probe_image(str(tmp_path / "cached"))[1:] == (8, 8)
@@ -0,0 +1,185 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from app.models.schemas import Character, Scene, Stage1Output, Stage2Output, Stage3Output
+from app.services import task_orchestrator
+from app.services.incremental import match_scenes, reuse_file, scene_fingerprint, stash_directory
+from app.services.prompt_layout import message_text
+from app.services.task_orchestrator import TaskOrchestrator
+
+
+def chapters(count, edited=None):
+    return "\n".join(
+        f"第{i}章\n" + ("情节转折。" if i == edited else "情节推进。") + "情节推进。" * 19
+        for i in range(1, count + 1)
+    )
+
+
+async def fake_completion(messages, **kwargs):
+    """每块的场景旁白取自块内容，块文本变了场景内容也跟着变"""
+    prompt = message_text(messages[0])
+    chunk = prompt.split("故事文本：\n", 1)[1].split("\n\n请按照", 1)[0]
+    scenes = 2
+    return {
+        "metadata": {"total_scenes": scenes, "story_title": "长篇", "total_characters": 1},
+        "characters": [{"id": "char_001", "name": "林远", "description": "黑发青年"}],
+        "scenes": [
+            {
+                "scene_id": f"scene_{i:03d}",
+                "order": i,
+                "description": "场景",
+                "composition": "中景",
+                "characters": ["char_001"],
+                "narration": f"{chunk[:12]}-{i}",
+            }
+            for i in range(1, scenes + 1)
+        ],
+    }
+
+
+class StopAfterStage3(Exception):
+    pass
+
+
+class TestIncrementalUnit:
+    
+    @pytest.fixture(autouse=True)
+    def api_key(self, monkeypatch):
+        # TaskOrchestrator 会创建 OpenRouterClient；测试中用到的 client 都会被替换成假对象
+        monkeypatch.setattr("app.services.openrouter_client.settings.openrouter_api_key", "test")
+    
+    def test_fingerprint_ignores_character_numbering(self):
+        scene = Scene(scene_id="scene_001", order=1, description="d", composition="c", narration="n", characters=["char_001"])
+        renumbered = scene.model_copy(update={"scene_id": "scene_009", "characters": ["char_007"]})
+        
+        first = scene_fingerprint(scene, {"char_001": Character(id="char_001", name="林远", description="黑发")})
+        second = scene_fingerprint(renumbered, {"char_007": Character(id="char_007", name="林远", description="黑发")})
+        changed = scene_fingerprint(renumbered, {"char_007": Character(id="char_007", name="林远", description="白发")})
+        
+        assert first == second
+        assert first != changed
+    
+    def test_match_scenes_follows_content_not_position(self):
+        previous = {"scene_001": "a", "scene_002": "b", "scene_003": "b"}
+        current = {"scene_001": "x", "scene_002": "a", "scene_003": "b", "scene_004": "b", "scene_005": "b"}
+        
+        assert match_scenes(previous, current) == {
+            "scene_002": "scene_001",
+            "scene_003": "scene_002",
+            "scene_004": "scene_003",
+        }
+    
+    def test_reused_file_is_renamed_to_new_scene(self, tmp_path):
+        images = tmp_path / "images"
+        images.mkdir()
+        (images / "scene_002.png").write_bytes(b"old")
+        
+        stash = stash_directory(images)
+        path = reuse_file(str(images / "scene_002.png"), stash, images, "scene_002", "scene_003")
+        
+        assert sorted(p.name for p in images.iterdir()) == ["scene_003.png"]
+        assert (images / "scene_003.png").read_bytes() == b"old"
+        assert path == str(images / "scene_003.png")
+        assert reuse_file(str(images / "scene_009.png"), stash, images, "scene_009", "scene_001") is None
+    
+    def test_prompts_follow_input_scene_not_echoed_id(self):
+        scenes = [
+            Scene(scene_id=f"scene_00{i}", order=i, description="d", composition="c", narration="n")
+            for i in (1, 2, 3)
+        ]
+        reused = {"scene_002": Stage2Output(scene_id="scene_002", image_prompt="reused")}
+        generated = [Stage2Output(scene_id="scene_1", image_prompt="a"), Stage2Output(scene_id="scene_002", image_prompt="c")]
+        
+        ordered = TaskOrchestrator._prompts_in_scene_order(scenes, generated, reused)
+        
+        assert [(p.scene_id, p.image_prompt) for p in ordered] == [
+            ("scene_001", "a"), ("scene_002", "reused"), ("scene_003", "c"),
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_streamed_fused_stage1_is_reused_on_resubmission(self, tmp_path, monkeypatch):
+        def stop(output_dir):
+            raise StopAfterStage3()
+        
+        monkeypatch.setattr(task_orchestrator, "Stage3ImageGenerationService", stop)
+        
+        text = chapters(1)
+        output = Stage1Output(**await fake_completion([{"role": "user", "content": f"故事文本：\n{text}\n\n请按照"}]))
+        
+        async def prompt(scene):
+            return Stage2Output(scene_id=scene.scene_id, image_prompt=scene.narration)
+        
+        async def fake_streaming(text, scenes_count):
+            return output, [asyncio.create_task(prompt(scene)) for scene in output.scenes]
+        
+        orchestrator = TaskOrchestrator(output_base_dir=str(tmp_path), stage1_streaming=True)
+        orchestrator.stage1_service.fused_prompts = True
+        orchestrator.stage1_service.client = AsyncMock()
+        orchestrator.stage1_service.client.structured_completion.side_effect = fake_completion
+        orchestrator._run_stage1_streaming = fake_streaming
+        task_id = orchestrator.create_task()
+        
+        for _ in range(2):
+            with pytest.raises(StopAfterStage3):
+                await orchestrator.run_task(text, scenes_count=2, task_id=task_id)
+        
+        assert orchestrator.stage1_service.client.structured_completion.await_count == 0
+    
+    @pytest.mark.asyncio
+    async def test_resubmission_only_recomputes_edited_chapter(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_chunk_threshold_chars", 100)
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_chunk_max_chars", 120)
+        
+        generated_images = []
+        
+        class FakeStage3:
+            def __init__(self, output_dir):
+                self.output_dir = output_dir
+            
+            async def iter_images(self, stage2_outputs, model, on_progress):
+                for done, prompt in enumerate(stage2_outputs, 1):
+                    generated_images.append(prompt.scene_id)
+                    path = f"{self.output_dir}/{prompt.scene_id}.png"
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(prompt.image_prompt)
+                    image = Stage3Output(scene_id=prompt.scene_id, image_path=path, width=1, height=1)
+                    on_progress(done, len(stage2_outputs), image)
+                    yield image
+        
+        def stop(output_dir):
+            raise StopAfterStage3()
+        
+        async def fake_prompts(stage1_output, **kwargs):
+            return [
+                Stage2Output(scene_id=scene.scene_id, image_prompt=scene.narration, characters_in_scene=scene.characters)
+                for scene in stage1_output.scenes
+            ]
+        
+        monkeypatch.setattr(task_orchestrator, "Stage3ImageGenerationService", FakeStage3)
+        monkeypatch.setattr(task_orchestrator, "Stage4TTSService", stop)
+        
+        orchestrator = TaskOrchestrator(output_base_dir=str(tmp_path), stage1_streaming=False)
+        orchestrator.stage1_service.client = AsyncMock()
+        orchestrator.stage1_service.client.structured_completion.side_effect = fake_completion
+        orchestrator.stage2_service.generate_all_prompts_batched = AsyncMock(side_effect=fake_prompts)
+        orchestrator.stage2_service.generate_all_prompts = AsyncMock(side_effect=fake_prompts)
+        task_id = orchestrator.create_task()
+        
+        with pytest.raises(StopAfterStage3):
+            await orchestrator.run_task(chapters(3), scenes_count=6, task_id=task_id)
+        assert orchestrator.stage1_service.client.structured_completion.await_count == 3
+        images_dir = tmp_path / task_id / "stage3" / "images"
+        first_image = (images_dir / "scene_001.png").read_text(encoding="utf-8")
+        
+        generated_images.clear()
+        with pytest.raises(StopAfterStage3):
+            await orchestrator.run_task(chapters(3, edited=2), scenes_count=6, task_id=task_id)
+        
+        assert orchestrator.stage1_service.client.structured_completion.await_count == 4
+        assert generated_images == ["scene_003", "scene_004"]
+        assert sorted(p.name for p in images_dir.iterdir()) == [f"scene_{i:03d}.png" for i in range(1, 7)]
+        assert (images_dir / "scene_001.png").read_text(encoding="utf-8") == first_image
+        assert not (images_dir.parent / "images.prev").exists()
+        
+        stage1_status = orchestrator.get_task_status(task_id)["stages"]["stage1"]
+        assert stage1_status["invalidated_scenes"] == ["scene_003", "scene_004"]
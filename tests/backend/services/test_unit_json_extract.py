@@ -0,0 +1,99 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.services.json_extract import JSONExtractError, extract_json, is_complete_json
+from app.services.openrouter_client import CONTINUATION_PROMPT, OpenRouterClient
+from .test_unit_llm_cache import chat_response
+
+
+class TestJSONExtractUnit:
+    
+    def test_extracts_object_surrounded_by_prose(self):
+        text = '好的，以下是结果：\n```json\n{"scenes": [{"id": 1}]}\n```\n希望对你有帮助 {注意}'
+        
+        extracted = extract_json(text)
+        
+        assert extracted.value == {"scenes": [{"id": 1}]}
+        assert extracted.complete
+    
+    def test_extracts_top_level_array(self):
+        assert extract_json('结果: [1, 2, {"a": "]"}] 完').value == [1, 2, {"a": "]"}]
+    
+    def test_removes_trailing_commas(self):
+        assert extract_json('{"a": [1, 2,], "b": "x,]",}').value == {"a": [1, 2], "b": "x,]"}
+    
+    @pytest.mark.parametrize("text, expected", [
+        ('{"scenes": [{"id": 1}, {"id": 2', {"scenes": [{"id": 1}, {"id": 2}]}),
+        ('{"scenes": [{"id": 1}, {"desc": "半句', {"scenes": [{"id": 1}, {"desc": "半句"}]}),
+        ('{"scenes": [{"id": 1},', {"scenes": [{"id": 1}]}),
+        ('{"a": 1, "b":', {"a": 1}),
+        ('{"a": 1, "key', {"a": 1}),
+        ('{"a": 1, "b": tr', {"a": 1}),
+        ('{"a": [1, 2.5', {"a": [1, 2.5]}),
+        ('{"a": "x\\', {"a": "x"}),
+    ])
+    def test_repairs_truncated_output(self, text, expected):
+        extracted = extract_json(text)
+        
+        assert extracted.value == expected
+        assert not extracted.complete
+    
+    def test_skips_brackets_that_are_not_json(self):
+        assert extract_json('Here is the result [v2]: {"a": 1}').value == {"a": 1}
+        assert extract_json('第 [v1] 版 {注意} {"a": [1').value == {"a": [1]}
+        with pytest.raises(JSONExtractError):
+            extract_json("结果 [v2] 见 {附件}")
+    
+    def test_raises_when_no_json(self):
+        with pytest.raises(JSONExtractError):
+            extract_json("抱歉，我无法完成这个请求。")
+    
+    def test_is_complete_json(self):
+        assert is_complete_json('x {"a": "}"} y')
+        assert not is_complete_json('{"a": [1')
+        assert not is_complete_json('[v2]: {"a": [1')
+
+
+class TestStructuredCompletionContinuation:
+    
+    @pytest.mark.asyncio
+    async def test_truncated_response_is_continued(self):
+        client = OpenRouterClient(api_key="test", cache=None)
+        client.chat_completion_raw = AsyncMock(side_effect=[
+            chat_response('```json\n{"scenes": [{"id": 1}, {"id"', finish_reason="length"),
+            chat_response(': 2}]}\n```'),
+        ])
+        messages = [{"role": "user", "content": "分析"}]
+        
+        result = await client.structured_completion(messages=messages, model="m", bypass_cache=True)
+        
+        assert result == {"scenes": [{"id": 1}, {"id": 2}]}
+        continuation_messages = client.chat_completion_raw.await_args_list[1].kwargs["messages"]
+        assert continuation_messages[:1] == messages
+        assert continuation_messages[1]["role"] == "assistant"
+        assert continuation_messages[2]["content"] == CONTINUATION_PROMPT
+    
+    @pytest.mark.asyncio
+    async def test_restarted_continuation_replaces_partial_output(self):
+        client = OpenRouterClient(api_key="test", cache=None)
+        client.chat_completion_raw = AsyncMock(side_effect=[
+            chat_response('{"scenes": [{"id": 1}, {"id"', finish_reason="length"),
+            chat_response('{"scenes": [{"id": 1}, {"id": 2}]}'),
+        ])
+        
+        result = await client.structured_completion(messages=[], model="m", bypass_cache=True)
+        
+        assert result == {"scenes": [{"id": 1}, {"id": 2}]}
+    
+    @pytest.mark.asyncio
+    async def test_repairs_after_continuations_exhausted(self, monkeypatch):
+        monkeypatch.setattr("app.services.openrouter_client.settings.llm_max_continuations", 1)
+        client = OpenRouterClient(api_key="test", cache=None)
+        client.chat_completion_raw = AsyncMock(side_effect=[
+            chat_response('{"scenes": [{"id": 1}', finish_reason="length"),
+            chat_response(', {"id": 2}, {"id"', finish_reason="length"),
+        ])
+        
+        result = await client.structured_completion(messages=[], model="m", bypass_cache=True)
+        
+        assert result == {"scenes": [{"id": 1}, {"id": 2}]}
+        assert client.chat_completion_raw.await_count == 2
@@ -0,0 +1,171 @@
+import json
+import httpx
+import pytest
+from app.services import openrouter_client
+from app.services.llm_cache import LLMResponseCache
+from app.services.json_stream import IncrementalJSONParser
+from app.services.openrouter_client import OpenRouterClient
+from app.services.resilience import ResilienceRegistry
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+
+
+STAGE1_DOC = {
+    "metadata": {"total_scenes": 2, "story_title": "测试 {故事}", "total_characters": 1},
+    "characters": [
+        {"id": "char_001", "name": "张三", "description": "穿着 \"风衣\" 的男子", "personality": "勇敢"}
+    ],
+    "scenes": [
+        {
+            "scene_id": f"scene_00{i}",
+            "order": i,
+            "description": "街道 [清晨]",
+            "composition": "远景",
+            "characters": ["char_001"],
+            "narration": "旁白",
+            "dialogues": [{"character": "char_001", "text": "你好}", "emotion": "愉悦"}],
+        }
+        for i in (1, 2)
+    ],
+}
+
+
+def sse_body(text: str, chunk_size: int = 7, finish_reason: str = "stop") -> bytes:
+    lines = [": OPENROUTER PROCESSING", ""]
+    for i in range(0, len(text), chunk_size):
+        chunk = {"choices": [{"delta": {"content": text[i:i + chunk_size]}}]}
+        lines += [f"data: {json.dumps(chunk, ensure_ascii=False)}", ""]
+    lines += [f"data: {json.dumps({'choices': [{'delta': {}, 'finish_reason': finish_reason}]})}", ""]
+    lines += ["data: [DONE]", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+class TestIncrementalJSONParserUnit:
+    
+    def test_emits_elements_as_soon_as_they_close(self):
+        text = "```json\n" + json.dumps(STAGE1_DOC, ensure_ascii=False) + "\n```"
+        first_scene_end = text.index('"scene_002"')
+        parser = IncrementalJSONParser()
+        
+        events = parser.feed(text[:first_scene_end])
+        
+        assert [key for key, _ in events] == ["characters", "scenes"]
+        assert events[1][1]["scene_id"] == "scene_001"
+        
+        events = parser.feed(text[first_scene_end:])
+        
+        assert [value["scene_id"] for _, value in events] == ["scene_002"]
+        assert parser.done
+        assert parser.result() == STAGE1_DOC
+    
+    def test_braces_inside_strings_are_ignored(self):
+        parser = IncrementalJSONParser()
+        events = []
+        for ch in json.dumps(STAGE1_DOC, ensure_ascii=False):
+            events += parser.feed(ch)
+        
+        assert len(events) == 3
+        assert events[0][1]["description"] == '穿着 "风衣" 的男子'
+    
+    def test_other_keys_are_not_streamed(self):
+        parser = IncrementalJSONParser(stream_keys=("scenes",))
+        
+        events = parser.feed(json.dumps(STAGE1_DOC))
+        
+        assert {key for key, _ in events} == {"scenes"}
+
+
+    def test_malformed_element_is_repaired_or_skipped(self):
+        parser = IncrementalJSONParser()
+        
+        events = parser.feed('{"metadata":{},"characters":[{"id":"c1","name":"a",},')
+        events += parser.feed('{"id": "c2" "name": "b"}],"scenes":[]}')
+        
+        assert events == [("characters", {"id": "c1", "name": "a"})]
+        assert parser.done
+
+
+class TestStreamingCompletionUnit:
+    
+    @pytest.fixture
+    def client(self, monkeypatch):
+        body = sse_body(json.dumps(STAGE1_DOC, ensure_ascii=False))
+        
+        def handler(request):
+            assert json.loads(request.content)["stream"] is True
+            return httpx.Response(200, content=body, headers={"Content-Type": "text/event-stream"})
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(openrouter_client, "get_http_client", lambda: http_client)
+        monkeypatch.setattr(openrouter_client, "resilience_policies", ResilienceRegistry())
+        
+        return OpenRouterClient(api_key="test", base_url="http://fake")
+    
+    @pytest.mark.asyncio
+    async def test_stream_chat_completion_reassembles_content(self, client):
+        parts = [delta async for delta in client.stream_chat_completion(messages=[], model="m")]
+        
+        assert len(parts) > 1
+        assert json.loads("".join(parts)) == STAGE1_DOC
+    
+    @pytest.mark.asyncio
+    async def test_stage1_stream_yields_characters_scenes_then_result(self, client):
+        service = Stage1TextAnalysisService(client=client)
+        
+        kinds = []
+        async for kind, value in service.analyze_text_stream("故事", scenes_count=2):
+            kinds.append(kind)
+        
+        assert kinds == ["character", "scene", "scene", "result"]
+        assert value.metadata.total_scenes == 2
+    
+    def streaming_client(self, monkeypatch, tmp_path, bodies):
+        responses = iter(bodies)
+        
+        def handler(request):
+            return httpx.Response(200, content=next(responses), headers={"Content-Type": "text/event-stream"})
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(openrouter_client, "get_http_client", lambda: http_client)
+        monkeypatch.setattr(openrouter_client, "resilience_policies", ResilienceRegistry())
+        monkeypatch.setattr(openrouter_client.settings, "single_flight_enabled", False)
+        cache = LLMResponseCache(cache_dir=str(tmp_path / "llm"), max_bytes=100_000, ttl_seconds=60)
+        
+        return OpenRouterClient(api_key="test", base_url="http://fake", cache=cache)
+    
+    @pytest.mark.asyncio
+    async def test_truncated_stream_is_continued_and_cached(self, monkeypatch, tmp_path):
+        text = json.dumps(STAGE1_DOC, ensure_ascii=False)
+        cut = text.index('"scene_002"')
+        client = self.streaming_client(monkeypatch, tmp_path, [
+            sse_body(text[:cut], finish_reason="length"),
+            sse_body("```json\n" + text[cut:] + "\n```"),
+        ])
+        
+        events = [event async for event in client.stream_structured_completion(messages=[], model="m")]
+        
+        assert [key for key, _ in events] == ["characters", "scenes", "scenes", None]
+        assert events[-1][1] == STAGE1_DOC
+        assert client.cache.stats()["entries"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_repaired_truncated_stream_is_not_cached(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(openrouter_client.settings, "llm_max_continuations", 0)
+        text = json.dumps(STAGE1_DOC, ensure_ascii=False)
+        client = self.streaming_client(monkeypatch, tmp_path, [
+            sse_body(text[:text.index('"scene_002"')], finish_reason="length"),
+        ])
+        
+        events = [event async for event in client.stream_structured_completion(messages=[], model="m")]
+        
+        assert [s["scene_id"] for s in events[-1][1]["scenes"]] == ["scene_001"]
+        assert client.cache.stats()["entries"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_trailing_comma_in_streamed_element_does_not_abort(self, monkeypatch, tmp_path):
+        text = json.dumps(STAGE1_DOC, ensure_ascii=False).replace('"勇敢"}', '"勇敢",}')
+        client = self.streaming_client(monkeypatch, tmp_path, [sse_body(text)])
+        
+        events = [event async for event in client.stream_structured_completion(messages=[], model="m")]
+        
+        assert [key for key, _ in events] == ["characters", "scenes", "scenes", None]
+        assert events[-1][1] == STAGE1_DOC
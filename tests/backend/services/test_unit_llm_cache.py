@@ -0,0 +1,89 @@
+import os
+import time
+import pytest
+from unittest.mock import AsyncMock
+from app.services.llm_cache import LLMResponseCache, make_cache_key
+from app.services.openrouter_client import OpenRouterClient
+
+
+def chat_response(content, finish_reason="stop"):
+    return {"choices": [{"message": {"content": content}, "finish_reason": finish_reason}]}
+
+
+class TestLLMCacheUnit:
+    
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return LLMResponseCache(cache_dir=str(tmp_path / "llm"), max_bytes=10_000, ttl_seconds=60)
+    
+    @pytest.fixture
+    def messages(self):
+        return [{"role": "user", "content": "分析这个故事"}]
+    
+    def test_key_depends_on_all_parameters(self, messages):
+        base = make_cache_key("model-a", messages, 0.7, 1024)
+        
+        assert base == make_cache_key("model-a", list(messages), 0.7, 1024)
+        assert base != make_cache_key("model-b", messages, 0.7, 1024)
+        assert base != make_cache_key("model-a", messages, 0.2, 1024)
+        assert base != make_cache_key("model-a", messages, 0.7, 2048)
+    
+    def test_set_then_get_counts_hits_and_misses(self, cache):
+        assert cache.get("ab" * 32) is None
+        
+        cache.set("ab" * 32, {"scenes": [1, 2]})
+        
+        assert cache.get("ab" * 32) == {"scenes": [1, 2]}
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+    
+    def test_expired_entry_is_dropped(self, cache):
+        cache.ttl_seconds = 0.01
+        cache.set("cd" * 32, {"x": 1})
+        time.sleep(0.02)
+        
+        assert cache.get("cd" * 32) is None
+        assert cache.stats()["expirations"] == 1
+        assert cache.stats()["entries"] == 0
+    
+    def test_lru_eviction_respects_size_bound(self, cache):
+        payload = {"text": "x" * 3000}
+        cache.set("01" * 32, payload)
+        cache.set("02" * 32, payload)
+        cache.get("01" * 32)
+        cache.set("03" * 32, payload)
+        cache.set("04" * 32, payload)
+        
+        stats = cache.stats()
+        assert stats["total_bytes"] <= cache.max_bytes
+        assert stats["evictions"] >= 1
+        assert cache.get("02" * 32) is None
+        assert cache.get("04" * 32) == payload
+    
+    def test_index_survives_restart(self, cache):
+        cache.set("ef" * 32, {"y": 2})
+        
+        reopened = LLMResponseCache(cache_dir=str(cache.cache_dir), max_bytes=10_000, ttl_seconds=60)
+        
+        assert reopened.get("ef" * 32) == {"y": 2}
+    
+    @pytest.mark.asyncio
+    async def test_structured_completion_uses_cache(self, cache, messages):
+        client = OpenRouterClient(api_key="test", cache=cache)
+        client.chat_completion_raw = AsyncMock(return_value=chat_response('```json\n{"ok": true}\n```'))
+        
+        first = await client.structured_completion(messages=messages, model="m")
+        second = await client.structured_completion(messages=messages, model="m")
+        
+        assert first == second == {"ok": True}
+        assert client.chat_completion_raw.await_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_bypass_flag_skips_cache(self, cache, messages):
+        client = OpenRouterClient(api_key="test", cache=cache)
+        client.chat_completion_raw = AsyncMock(return_value=chat_response('{"ok": true}'))
+        
+        await client.structured_completion(messages=messages, model="m")
+        await client.structured_completion(messages=messages, model="m", bypass_cache=True)
+        
+        assert client.chat_completion_raw.await_count == 2
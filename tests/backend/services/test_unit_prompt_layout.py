@@ -0,0 +1,54 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.services import prompt_layout
+from app.services.prompt_layout import PromptLayout, message_text
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+from app.services.usage_tracker import UsageAccumulator, UsageRecord
+from ..stage2.test_unit_batch_prompts import make_stage1_output
+
+
+class TestPromptLayoutUnit:
+    
+    def test_stage2_requests_differ_only_in_the_scene_section(self):
+        stage1 = make_stage1_output(2)
+        service = Stage2ImagePromptService(client=AsyncMock())
+        
+        first, second = (service._build_prompt_generation_request(scene, stage1.characters) for scene in stage1.scenes)
+        
+        assert (first.static, first.shared) == (second.static, second.shared)
+        assert "scene_001" in first.dynamic and "scene_001" not in first.static + first.shared
+        assert "黑发青年" in first.shared
+    
+    def test_stage1_prefix_is_independent_of_story_and_scene_count(self):
+        service = Stage1TextAnalysisService(client=AsyncMock())
+        
+        first = service._build_analysis_prompt("第一个故事。", 4)
+        second = service._build_analysis_prompt("第二个故事。", 12)
+        
+        assert first.static == second.static
+        assert first.text.startswith(first.static) and first.text.endswith("拆分为 4 个分镜场景。")
+    
+    def test_cache_control_breakpoints(self, monkeypatch):
+        layout = PromptLayout(static="固定说明", shared="角色表", dynamic="场景")
+        
+        monkeypatch.setattr(prompt_layout.settings, "llm_prompt_cache_control", True)
+        parts = layout.messages()[0]["content"]
+        assert [("cache_control" in part) for part in parts] == [True, True, False]
+        assert message_text(layout.messages()[0]) == layout.text
+        
+        monkeypatch.setattr(prompt_layout.settings, "llm_prompt_cache_control", False)
+        assert layout.messages() == [{"role": "user", "content": layout.text}]
+    
+    def test_cache_hits_are_reported(self):
+        usage = UsageAccumulator()
+        for cached in (0, 80, 90):
+            usage.add(UsageRecord.from_usage(
+                "m", "stage2", {"prompt_tokens": 100, "completion_tokens": 10, "prompt_tokens_details": {"cached_tokens": cached}}, 0.1,
+            ))
+        
+        summary = usage.summary()
+        
+        assert summary["cached_tokens"] == 170
+        assert summary["prompt_cache_hit_rate"] == pytest.approx(170 / 300, abs=1e-4)
+        assert summary["by_stage"]["stage2"]["prompt_cache_hit_calls"] == pytest.approx(2 / 3, abs=1e-4)
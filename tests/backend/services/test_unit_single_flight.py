@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from app.services.openrouter_client import OpenRouterClient
+from app.services.single_flight import SingleFlight, single_flights
+from app.services.stage3_image_generation import Stage3ImageGenerationService
+
+
+class TestSingleFlightUnit:
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight("test")
+        calls = 0
+        
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+        
+        results = await asyncio.gather(*[flight.do("k", fetch) for _ in range(5)])
+        
+        assert results == [1] * 5
+        assert flight.stats() == {"leaders": 1, "deduplicated": 4, "in_flight": 0}
+    
+    @pytest.mark.asyncio
+    async def test_sequential_calls_are_not_merged(self):
+        flight = SingleFlight("test")
+        fetch = AsyncMock(return_value="x")
+        
+        await flight.do("k", fetch)
+        await flight.do("k", fetch)
+        
+        assert fetch.await_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_errors_are_shared(self):
+        flight = SingleFlight("test")
+        
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+        
+        results = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+        
+        assert all(isinstance(r, ValueError) for r in results)
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        flight = SingleFlight("test")
+        
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "done"
+        
+        first = asyncio.ensure_future(flight.do("k", fetch))
+        second = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        
+        assert await second == "done"
+    
+    @pytest.mark.asyncio
+    async def test_chat_completion_is_deduplicated(self):
+        client = OpenRouterClient(api_key="test")
+        
+        async def slow_once(payload, stage):
+            await asyncio.sleep(0.01)
+            return {"choices": [{"message": {"content": '{"ok": true}'}, "finish_reason": "stop"}]}
+        
+        client._chat_completion_once = AsyncMock(side_effect=slow_once)
+        messages = [{"role": "user", "content": "single-flight chat"}]
+        
+        await asyncio.gather(*[
+            client.chat_completion(messages=messages, model="m") for _ in range(3)
+        ])
+        
+        assert client._chat_completion_once.await_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_image_requests_are_deduplicated(self, tmp_path):
+        service = Stage3ImageGenerationService(client=OpenRouterClient(api_key="test"), output_dir=str(tmp_path))
+        
+        async def slow_image(*args):
+            await asyncio.sleep(0.01)
+            return "data:image/png;base64,cG5n"
+        
+        service._request_image = AsyncMock(side_effect=slow_image)
+        before = single_flights.get("openrouter.image").deduplicated
+        
+        images = await asyncio.gather(*[service.generate_image_from_prompt("same prompt") for _ in range(4)])
+        
+        assert images == [b"png"] * 4
+        assert service._request_image.await_count == 1
+        assert single_flights.get("openrouter.image").deduplicated - before == 3
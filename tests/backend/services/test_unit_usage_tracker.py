@@ -0,0 +1,84 @@
+import asyncio
+import json
+import httpx
+import pytest
+from app.services import openrouter_client
+from app.services.openrouter_client import OpenRouterClient
+from app.services.resilience import ResilienceRegistry
+from app.services.usage_tracker import UsageAccumulator, UsageRecord, UsageTracker
+
+
+USAGE = {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150, "cost": 0.0021}
+
+
+class TestUsageTrackerUnit:
+    
+    def test_record_from_usage_block(self):
+        record = UsageRecord.from_usage("m", "stage1", {"prompt_tokens": 10, "completion_tokens": 5}, 0.5)
+        
+        assert record.total_tokens == 15
+        assert record.cost == 0.0
+        assert UsageRecord.from_usage("m", "stage1", None, 0.1).total_tokens == 0
+    
+    def test_accumulator_groups_by_stage_and_model(self):
+        accumulator = UsageAccumulator()
+        accumulator.add(UsageRecord.from_usage("a", "stage1", USAGE, 1.0))
+        accumulator.add(UsageRecord.from_usage("b", "stage2", USAGE, 0.5))
+        accumulator.add(UsageRecord.from_usage("b", "stage2", USAGE, 0.5))
+        
+        summary = accumulator.summary()
+        
+        assert summary["calls"] == 3
+        assert summary["total_tokens"] == 450
+        assert summary["cost"] == pytest.approx(0.0063)
+        assert summary["by_stage"]["stage2"]["calls"] == 2
+        assert summary["by_model"]["a"]["prompt_tokens"] == 120
+    
+    @pytest.mark.asyncio
+    async def test_bound_task_is_inherited_by_child_tasks(self):
+        tracker = UsageTracker()
+        token = tracker.bind_task("task_1")
+        try:
+            await asyncio.create_task(self._record_later(tracker))
+        finally:
+            tracker.unbind_task(token)
+        
+        tracker.record("default", UsageRecord.from_usage("m", "stage2", USAGE, 0.1))
+        
+        assert tracker.task_summary("task_1")["calls"] == 1
+        assert tracker.stats()["clients"]["default"]["calls"] == 2
+    
+    @staticmethod
+    async def _record_later(tracker):
+        await asyncio.sleep(0)
+        tracker.record("default", UsageRecord.from_usage("m", "stage1", USAGE, 0.1))
+
+
+class TestClientUsageUnit:
+    
+    @pytest.fixture
+    def client(self, monkeypatch):
+        def handler(request):
+            payload = json.loads(request.content)
+            assert payload["usage"] == {"include": True}
+            return httpx.Response(200, json={
+                "choices": [{"message": {"content": '{"ok": true}'}, "finish_reason": "stop"}],
+                "usage": USAGE,
+            })
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(openrouter_client, "get_http_client", lambda: http_client)
+        monkeypatch.setattr(openrouter_client, "resilience_policies", ResilienceRegistry())
+        monkeypatch.setattr(openrouter_client, "usage_tracker", UsageTracker())
+        
+        return OpenRouterClient(api_key="test", base_url="http://fake", cache=None, name="usage-test")
+    
+    @pytest.mark.asyncio
+    async def test_structured_completion_records_usage(self, client):
+        await client.structured_completion(messages=[], model="m", bypass_cache=True, stage="stage2")
+        
+        summary = client.usage.summary()
+        assert summary["calls"] == 1
+        assert summary["by_stage"]["stage2"]["total_tokens"] == 150
+        assert summary["latency_seconds"] >= 0
+        assert openrouter_client.usage_tracker.stats()["clients"]["usage-test"]["cost"] == pytest.approx(0.0021)
@@ -0,0 +1,77 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.models.schemas import Stage1Output
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+from app.services.prompt_layout import message_text
+from app.services.wire_format import expand_stage1
+
+
+COMPACT_STAGE1 = {
+    "t": "雨夜",
+    "c": [{"i": "char_001", "n": "林远", "d": "黑发青年", "a": ["小林"]}],
+    "s": [
+        {"d": "雨夜的小巷", "v": "远景", "c": ["char_001"], "n": "旁白一", "g": [{"c": "char_001", "t": "走吧", "e": "平静"}]},
+        {"d": "仓库门口", "v": "特写", "c": ["char_001"], "n": "旁白二"},
+    ],
+}
+
+
+class TestWireFormatUnit:
+    
+    def test_compact_stage1_expands_to_full_schema(self):
+        output = Stage1Output(**expand_stage1(COMPACT_STAGE1))
+        
+        assert output.metadata.story_title == "雨夜"
+        assert output.metadata.total_scenes == 2
+        assert output.characters[0].aliases == ["小林"]
+        assert [(s.scene_id, s.order, s.composition) for s in output.scenes] == [
+            ("scene_001", 1, "远景"),
+            ("scene_002", 2, "特写"),
+        ]
+        assert output.scenes[0].dialogues[0].text == "走吧"
+    
+    def test_full_schema_passes_through(self):
+        full = expand_stage1(COMPACT_STAGE1)
+        
+        assert expand_stage1(full) == full
+    
+    @pytest.mark.asyncio
+    async def test_stage1_requests_and_parses_compact_output(self):
+        client = AsyncMock()
+        client.structured_completion.return_value = COMPACT_STAGE1
+        service = Stage1TextAnalysisService(client=client, compact=True)
+        
+        output = await service.analyze_text("故事。", scenes_count=2)
+        
+        prompt = message_text(client.structured_completion.call_args.kwargs["messages"][0])
+        assert '"s":[{' in prompt and '"scenes"' not in prompt
+        assert service.validate_output(output)
+        assert '"scenes": [' in Stage1TextAnalysisService(client=client, compact=False)._build_analysis_prompt("故事", 2).text
+    
+    @pytest.mark.asyncio
+    async def test_stage2_fills_ids_omitted_from_compact_output(self):
+        stage1 = Stage1Output(**expand_stage1(COMPACT_STAGE1))
+        client = AsyncMock()
+        client.structured_completion.return_value = {"p": "rainy alley", "np": "blurry", "st": ["anime"]}
+        
+        prompt = await Stage2ImagePromptService(client=client, compact=True).generate_image_prompt(
+            stage1.scenes[1], stage1.characters,
+        )
+        
+        assert prompt.scene_id == "scene_002"
+        assert prompt.characters_in_scene == ["char_001"]
+        assert prompt.negative_prompt == "blurry"
+    
+    @pytest.mark.asyncio
+    async def test_stage2_batch_compact_output(self):
+        stage1 = Stage1Output(**expand_stage1(COMPACT_STAGE1))
+        client = AsyncMock()
+        client.structured_completion.return_value = {
+            "ps": [{"i": scene.scene_id, "p": f"prompt {scene.order}", "c": ["char_001"]} for scene in stage1.scenes]
+        }
+        
+        prompts = await Stage2ImagePromptService(client=client, compact=True).generate_all_prompts_batched(stage1)
+        
+        assert client.structured_completion.await_count == 1
+        assert [p.image_prompt for p in prompts] == ["prompt 1", "prompt 2"]
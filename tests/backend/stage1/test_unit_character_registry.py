@@ -0,0 +1,115 @@
+import time
+import pytest
+from app.models.schemas import Character, Dialogue, Scene
+from app.services.character_registry import CharacterRegistry, normalize_name, remap_scene
+
+
+def char(name, description="外貌", char_id="char_001", aliases=()):
+    return Character(id=char_id, name=name, description=description, aliases=list(aliases))
+
+
+class TestCharacterRegistryUnit:
+    
+    def test_normalize_name(self):
+        assert normalize_name(" 李　明 ") == "李明"
+        assert normalize_name("Harry·Potter") == "harrypotter"
+    
+    def test_nickname_merges_into_full_name(self):
+        registry = CharacterRegistry()
+        
+        first = registry.add(char("李明", "黑发青年"))
+        assert registry.add(char("小李")) == first
+        assert registry.add(char("阿明")) == first
+        assert registry.add(char("李先生", "黑发青年，戴眼镜，穿灰色西装")) == first
+        
+        merged = registry.characters[0]
+        assert len(registry.characters) == 1
+        assert merged.name == "李明"
+        assert merged.aliases == ["小李", "阿明", "李先生"]
+        assert merged.description == "黑发青年，戴眼镜，穿灰色西装"
+    
+    def test_full_name_arriving_later_becomes_canonical(self):
+        registry = CharacterRegistry()
+        
+        nickname_id = registry.add(char("小李"))
+        full_id = registry.add(char("李明"))
+        
+        assert full_id == nickname_id
+        assert registry.characters[0].name == "李明"
+        assert registry.characters[0].aliases == ["小李"]
+    
+    def test_ambiguous_nickname_is_not_merged(self):
+        registry = CharacterRegistry()
+        registry.add(char("李明"))
+        registry.add(char("李强"))
+        
+        registry.add(char("小李"))
+        
+        assert [c.name for c in registry.characters] == ["李明", "李强", "小李"]
+    
+    def test_excluded_match_is_registered_as_new(self):
+        registry = CharacterRegistry()
+        li = registry.add(char("李明"))
+        wang = registry.add(char("王芳"))
+        
+        assert registry.add(char("小李"), exclude={li, wang}) not in (li, wang)
+        assert registry.add(char("王总"), exclude={li, wang}) not in (li, wang)
+        assert registry.add(char("李明")) == li
+        assert [c.name for c in registry.characters] == ["李明", "王芳", "小李", "王总"]
+    
+    def test_explicit_alias_and_fuzzy_match(self):
+        registry = CharacterRegistry()
+        zhang = registry.add(char("张三丰", aliases=["张真人"]))
+        harry = registry.add(char("Harry Potter"))
+        
+        assert registry.add(char("张真人")) == zhang
+        assert registry.add(char("Harry Poter")) != harry
+        assert registry.add(char("Harry Potier")) == harry
+    
+    def test_remap_scene_rewrites_references(self):
+        scene = Scene(
+            scene_id="scene_001", order=1, description="d", composition="c", narration="n",
+            characters=["char_001", "char_002"],
+            dialogues=[Dialogue(character="char_002", text="你好")],
+        )
+        
+        remapped = remap_scene(scene, {"char_001": "char_007", "char_002": "char_007"})
+        
+        assert remapped.characters == ["char_007"]
+        assert remapped.dialogues[0].character == "char_007"
+    
+    def test_unknown_local_id_gets_fresh_global_id(self):
+        registry = CharacterRegistry()
+        id_map = {"char_001": registry.add(char("林远"))}
+        registry.add(char("苏晴"))
+        scene = Scene(
+            scene_id="scene_001", order=1, description="d", composition="c", narration="n",
+            characters=["char_001", "char_002"],
+            dialogues=[Dialogue(character="char_002", text="你好")],
+        )
+        
+        remapped = remap_scene(scene, id_map, registry)
+        
+        assert remapped.characters == ["char_001", "char_003"]
+        assert remapped.dialogues[0].character == "char_003"
+        assert id_map["char_002"] == "char_003"
+        assert [c.name for c in registry.characters] == ["林远", "苏晴", "char_002"]
+        with pytest.raises(ValueError):
+            remap_scene(scene, {"char_001": "char_001"})
+    
+    def test_hundreds_of_characters_is_fast(self):
+        registry = CharacterRegistry()
+        surnames = "赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜"
+        given = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红娥玲"
+        
+        start = time.perf_counter()
+        for s in surnames:
+            for g in given:
+                registry.add(char(s + g))
+        for s in surnames:
+            for g in given:
+                registry.add(char(s + g + "先生"))
+        elapsed = time.perf_counter() - start
+        
+        assert len(registry.characters) == len(surnames) * len(given)
+        assert elapsed < 2.0
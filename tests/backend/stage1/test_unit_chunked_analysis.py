@@ -0,0 +1,200 @@
+import asyncio
+import re
+import pytest
+from unittest.mock import AsyncMock
+from app.models.schemas import Stage1Output
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.prompt_layout import message_text
+from app.services.text_chunking import allocate_scenes, merge_to_count, merge_unallocated, split_text
+
+
+def partial_output(names, scenes):
+    """模拟单块分析结果：角色 ID 总是从 char_001 开始局部编号"""
+    characters = [
+        {"id": f"char_{i:03d}", "name": name, "description": f"{name}的外貌"}
+        for i, name in enumerate(names, 1)
+    ]
+    return {
+        "metadata": {"total_scenes": scenes, "story_title": "长篇", "total_characters": len(names)},
+        "characters": characters,
+        "scenes": [
+            {
+                "scene_id": f"scene_{i:03d}",
+                "order": i,
+                "description": "场景",
+                "composition": "中景",
+                "characters": [characters[-1]["id"]],
+                "narration": "旁白",
+                "dialogues": [{"character": characters[-1]["id"], "text": "台词"}],
+            }
+            for i in range(1, scenes + 1)
+        ],
+    }
+
+
+class TestTextChunkingUnit:
+    
+    def test_chunks_respect_limit_and_chapters(self):
+        chapter = "\n".join(["这是一段情节描写。" * 10] * 4)
+        text = "\n".join(f"第{i}章 标题\n{chapter}" for i in range(1, 4))
+        
+        chunks = split_text(text, max_chars=500)
+        
+        assert all(len(chunk) <= 500 for chunk in chunks)
+        assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+        assert sum(chunk.startswith("第") for chunk in chunks) == 3
+    
+    def test_overlong_paragraph_is_split_by_sentence(self):
+        chunks = split_text("句子。" * 100, max_chars=31)
+        
+        assert all(len(chunk) <= 31 for chunk in chunks)
+        assert all(chunk.endswith("。") for chunk in chunks)
+    
+    def test_local_edit_only_changes_nearby_chunks(self):
+        paragraphs = [f"段落{i}：" + "情节推进。" * (5 + i % 7) for i in range(300)]
+        before = split_text("\n".join(paragraphs), max_chars=600)
+        paragraphs[5] += "新增一句。"
+        after = split_text("\n".join(paragraphs), max_chars=600)
+        
+        assert len(before) > 10
+        assert len(set(before) - set(after)) <= 2
+    
+    def test_allocation_is_proportional_with_minimum_one(self):
+        assert allocate_scenes([100, 300, 600], 10) == [2, 3, 5]
+        assert allocate_scenes([10, 10000], 3) == [1, 2]
+        assert sum(allocate_scenes([7, 13, 29, 3], 17)) == 17
+    
+    def test_merge_to_count_joins_shortest_neighbours(self):
+        assert merge_to_count(["aaaa", "b", "c", "dddd"], 3) == ["aaaa", "b\nc", "dddd"]
+    
+    def test_merge_to_count_respects_max_chars(self):
+        assert merge_to_count(["aaaa", "b", "c", "dddd"], 1, max_chars=6) == ["aaaa", "b\nc", "dddd"]
+    
+    def test_unallocated_chunks_join_nearest_neighbour(self):
+        chunks = ["a", "b", "c", "d", "e", "f", "g"]
+        
+        assert merge_unallocated(chunks, [0, 1, 0, 0, 0, 1, 0]) == (["a\nb\nc\nd", "e\nf\ng"], [1, 1])
+    
+    def test_pinned_chunks_keep_their_scene_count(self):
+        assert allocate_scenes([100, 300, 600], 10, pinned={0: 3, 2: 4}) == [3, 3, 4]
+        # 其余块分不到至少 1 个时忽略 pinned
+        assert allocate_scenes([100, 300, 600], 10, pinned={0: 5, 2: 5}) == [2, 3, 5]
+    
+    def test_allocation_spreads_scenes_when_chunks_outnumber_them(self):
+        assert allocate_scenes([100] * 9, 3) == [0, 1, 0, 0, 1, 0, 0, 1, 0]
+        assert sum(allocate_scenes([10, 500, 20, 300, 80], 2)) == 2
+
+
+class TestChunkedAnalysisUnit:
+    
+    @pytest.fixture
+    def service(self, monkeypatch):
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_chunk_threshold_chars", 100)
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_chunk_max_chars", 120)
+        return Stage1TextAnalysisService(client=AsyncMock())
+    
+    @pytest.mark.asyncio
+    async def test_long_text_is_analysed_per_chunk_and_merged(self, service):
+        in_flight = peak = 0
+        
+        async def fake_completion(messages, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            
+            prompt = message_text(messages[0])
+            part = int(re.search(r"第 (\d+)/\d+ 部分", prompt).group(1))
+            scenes = int(re.search(r"拆分为 (\d+) 个分镜场景", prompt).group(1))
+            # 第 3 块里主角以称呼 "小林" 出现
+            names = ["林远"] if part == 1 else ["林远" if part == 2 else "小林", f"配角{part}"]
+            return partial_output(names, scenes)
+        
+        service.client.structured_completion.side_effect = fake_completion
+        text = "\n".join(f"第{i}章\n" + "情节推进。" * 20 for i in range(1, 4))
+        
+        output = await service.analyze_text(text, scenes_count=6)
+        
+        assert service.client.structured_completion.await_count == 3
+        assert peak > 1
+        assert [scene.scene_id for scene in output.scenes] == [f"scene_{i:03d}" for i in range(1, 7)]
+        assert [scene.order for scene in output.scenes] == list(range(1, 7))
+        assert [char.name for char in output.characters] == ["林远", "配角2", "配角3"]
+        assert output.metadata.total_characters == 3
+        assert output.characters[0].aliases == ["小林"]
+        assert output.scenes[-1].characters == ["char_003"]
+        assert output.scenes[-1].dialogues[0].character == "char_003"
+        assert service.validate_output(output)
+    
+    def test_characters_from_one_chunk_are_never_merged(self, service):
+        partials = [
+            Stage1Output.model_validate(partial_output(["李明", "小李", "王芳", "王总"], 1)),
+            Stage1Output.model_validate(partial_output(["小李", "王总"], 1)),
+        ]
+        
+        output = service._merge_partials(partials)
+        
+        assert [char.name for char in output.characters] == ["李明", "小李", "王芳", "王总"]
+        assert [scene.characters for scene in output.scenes] == [["char_004"], ["char_004"]]
+    
+    @pytest.mark.asyncio
+    async def test_local_edit_only_recomputes_nearby_chunks(self, service, monkeypatch):
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_chunk_max_chars", 600)
+        requested = []
+        
+        async def fake_completion(messages, **kwargs):
+            scenes = int(re.search(r"拆分为 (\d+) 个分镜场景", message_text(messages[0])).group(1))
+            requested.append(scenes)
+            return partial_output(["林远"], scenes)
+        
+        service.client.structured_completion.side_effect = fake_completion
+        paragraphs = [f"段落{i}：" + "情节推进。" * (5 + i % 7) for i in range(150)]
+        _, records = await service.analyze_text_incremental("\n".join(paragraphs), scenes_count=30)
+        
+        requested.clear()
+        paragraphs[5] += "新增一句。"
+        output, _ = await service.analyze_text_incremental(
+            "\n".join(paragraphs), scenes_count=30,
+            previous_chunks={record.fingerprint: record for record in records},
+        )
+        
+        assert len(records) > 10
+        assert len(requested) == 1
+        assert output.metadata.total_scenes == 30
+    
+    def test_whole_text_is_planned_when_scenes_are_few(self, service):
+        text = "\n".join(f"第{i}章\n" + "情节推进。" * 20 for i in range(1, 11))
+        
+        plan = service.plan_chunks(text, scenes_count=3)
+        
+        assert [chunk_scenes for _, chunk_scenes in plan] == [1, 1, 1]
+        assert "\n".join(chunk for chunk, _ in plan) == text
+        assert [chunk.split("\n")[0] for chunk, _ in plan] == ["第1章", "第5章", "第8章"]
+    
+    @pytest.mark.asyncio
+    async def test_chunk_with_many_scenes_uses_outline(self, service, monkeypatch):
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_outline_min_scenes", 5)
+        service.client.structured_completion.side_effect = (
+            lambda messages, **kwargs: partial_output(["林远"], int(re.search(r"拆分为 (\d+) 个分镜场景", message_text(messages[0])).group(1)))
+        )
+        service.analyze_text_outlined = AsyncMock(
+            side_effect=lambda chunk, scenes, **kwargs: Stage1Output.model_validate(partial_output(["苏晴"], scenes))
+        )
+        text = "第1章\n" + "情节推进。" * 4 + "\n第2章\n" + "情节推进。" * 20
+        
+        output = await service.analyze_text(text, scenes_count=8)
+        
+        assert service.analyze_text_outlined.await_count == 1
+        assert service.analyze_text_outlined.await_args.args[1] >= 5
+        assert service.client.structured_completion.await_count == 1
+        assert output.metadata.total_scenes == 8
+    
+    @pytest.mark.asyncio
+    async def test_short_text_uses_single_request(self, service):
+        service.client.structured_completion.return_value = partial_output(["林远"], 2)
+        
+        await service.analyze_text("短故事。", scenes_count=2)
+        
+        prompt = message_text(service.client.structured_completion.await_args.kwargs["messages"][0])
+        assert "部分" not in prompt.split("\n")[0]
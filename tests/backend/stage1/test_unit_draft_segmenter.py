@@ -0,0 +1,119 @@
+import time
+from pathlib import Path
+import pytest
+from app.services.draft_segmenter import segment_text
+from app.services.stage1_validation import check_output
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+
+
+STORY = """夜行记
+第一章 出发
+林远说：“我们今晚就出发。”苏晴笑道：“好，我去收拾行李。”
+天色渐暗，街上的行人越来越少。
+第二章 码头
+他说：“船快开了。”欧阳锋低声道：“跟紧我。”
+码头上雾气弥漫，汽笛声远远传来。
+林远问：“还有多久？”"""
+
+SAMPLES_DIR = Path(__file__).parent
+
+
+class TestDraftSegmenterUnit:
+    
+    def test_output_is_valid_stage1(self):
+        service = Stage1TextAnalysisService(mode="draft")
+        
+        output = segment_text(STORY, 3)
+        
+        assert service.validate_output(output)
+        assert output.metadata.story_title == "夜行记"
+        assert [scene.order for scene in output.scenes] == [1, 2, 3]
+    
+    def test_dialogue_and_speakers_are_extracted(self):
+        output = segment_text(STORY, 2)
+        
+        names = {char.id: char.name for char in output.characters}
+        dialogues = [(names[d.character], d.text) for scene in output.scenes for d in scene.dialogues]
+        
+        assert list(names.values()) == ["林远", "苏晴", "欧阳锋", "路人"]
+        assert ("苏晴", "好，我去收拾行李。") in dialogues
+        assert ("路人", "船快开了。") in dialogues
+        assert all("“" not in scene.narration for scene in output.scenes)
+    
+    @pytest.mark.parametrize("sample, expected", [
+        ("mock_input_journey.txt", {
+            "师父，前面山高路险，怕是有妖怪作祟。": "悟空",
+            "悟空，出家人当以慈悲为怀，莫要妄加揣测。": "唐僧",
+            "俺老猪早就饿了，不如先找个地方歇歇脚，化些斋饭来吃。": "猪八戒",
+            "二师兄，你这张嘴就知道吃。": "沙僧",
+            "看招！": "妖怪",
+            "猴哥这次遇到硬茬了。": "猪八戒",
+            "悟空，它已逃走，我们还是赶路要紧。": "唐僧",
+        }),
+        ("mock_input_threebody.txt", {
+            "这到底是什么？": "汪淼",
+            "不可能！": "路人",
+            "我遇到了一些奇怪的事情。": "汪淼",
+            "是倒计时。": "叶文洁",
+        }),
+    ])
+    def test_speakers_in_sample_stories(self, sample, expected):
+        output = segment_text((SAMPLES_DIR / sample).read_text(encoding="utf-8"), 5)
+        
+        names = {char.id: char.name for char in output.characters}
+        speakers = {d.text: names[d.character] for scene in output.scenes for d in scene.dialogues}
+        
+        assert {text: speakers[text] for text in expected} == expected
+        assert not [name for name in names.values() if name[-1] in "地着了"]
+    
+    @pytest.mark.parametrize("sample", ["mock_input_journey.txt", "mock_input_threebody.txt"])
+    @pytest.mark.parametrize("scenes_count", [1, 5, 10, 17, 30])
+    def test_sample_stories_pass_validation(self, sample, scenes_count):
+        output = segment_text((SAMPLES_DIR / sample).read_text(encoding="utf-8"), scenes_count)
+        
+        assert check_output(output) == []
+        assert not [scene.description for scene in output.scenes if scene.description[0] in "“”「」\""]
+    
+    def test_dialogue_only_scene_gets_narration(self):
+        output = segment_text("林远说：“走吧。”\n“是倒计时。”“什么？”", 2)
+        
+        assert check_output(output) == []
+        assert output.scenes[1].narration == "路人说：是倒计时。"
+        assert output.scenes[1].description == "路人说：是倒计时。"
+    
+    def test_speech_verbs_are_not_names(self):
+        output = segment_text("张三嘟囔道：“又下雨了。”\n李四低声嘀咕：“别吵。”\n张三抱怨：“真烦。”", 1)
+        
+        assert not [char.name for char in output.characters if "嘟囔" in char.name or "嘀咕" in char.name]
+        assert "张三" in [char.name for char in output.characters]
+    
+    def test_text_without_dialogue_gets_placeholder_character(self):
+        output = segment_text("风吹过山岗。云慢慢散开。", 2)
+        
+        assert [char.name for char in output.characters] == ["主角"]
+        assert len(output.scenes) == 2
+    
+    def test_million_characters_is_fast(self):
+        paragraph = "林远说：“我们走吧。”苏晴答：“好。”远处传来钟声，城市慢慢安静下来，灯火一盏盏熄灭。"
+        text = "\n".join([paragraph] * (1_000_000 // len(paragraph)))
+        
+        start = time.perf_counter()
+        output = segment_text(text, 100)
+        elapsed = time.perf_counter() - start
+        
+        assert len(output.scenes) == 100
+        assert elapsed < 2.0
+    
+    @pytest.mark.asyncio
+    async def test_service_draft_mode_needs_no_client(self):
+        service = Stage1TextAnalysisService(mode="draft")
+        
+        output = await service.analyze_text(STORY, scenes_count=3)
+        
+        assert service.client is None
+        assert len(output.scenes) == 3
+        assert not service.should_stream(STORY, 3)
+    
+    def test_unknown_mode_is_rejected(self):
+        with pytest.raises(ValueError):
+            Stage1TextAnalysisService(mode="magic")
@@ -0,0 +1,95 @@
+import asyncio
+import re
+import pytest
+from unittest.mock import AsyncMock
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.prompt_layout import message_text
+
+
+CHARACTERS = [{"id": "char_001", "name": "林远", "description": "黑发青年"}]
+
+
+def outline_result(count):
+    return {
+        "metadata": {"total_scenes": count, "story_title": "长篇", "total_characters": 1},
+        "characters": CHARACTERS,
+        "outline": [{"scene_id": f"scene_{i:03d}", "order": i, "summary": f"情节{i}"} for i in range(1, count + 1)],
+    }
+
+
+def expanded_scene(scene_id):
+    return {
+        "scene_id": scene_id,
+        "order": 0,
+        "description": "场景",
+        "composition": "中景",
+        "characters": ["char_001"],
+        "narration": f"{scene_id} 旁白",
+    }
+
+
+class TestOutlineAnalysisUnit:
+    
+    @pytest.fixture
+    def service(self, monkeypatch):
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_outline_min_scenes", 10)
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_outline_batch_size", 4)
+        return Stage1TextAnalysisService(client=AsyncMock())
+    
+    @pytest.mark.asyncio
+    async def test_outline_then_parallel_expansion(self, service):
+        in_flight = peak = 0
+        
+        async def fake_completion(messages, **kwargs):
+            nonlocal in_flight, peak
+            prompt = message_text(messages[0])
+            if "需要展开的场景：" not in prompt:
+                return outline_result(10)
+            
+            assert '"name": "林远"' in prompt
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            wanted = re.search(r"需要展开的场景：(.*)", prompt).group(1).split("、")
+            return {"scenes": [expanded_scene(scene_id) for scene_id in wanted]}
+        
+        service.client.structured_completion.side_effect = fake_completion
+        
+        output = await service.analyze_text("故事。", scenes_count=10)
+        
+        # 1 次大纲 + 3 批展开（4 + 4 + 2）
+        assert service.client.structured_completion.await_count == 4
+        assert peak == 3
+        assert [scene.order for scene in output.scenes] == list(range(1, 11))
+        assert output.scenes[9].narration == "scene_010 旁白"
+        assert service.validate_output(output)
+        assert not service.should_stream("故事。", 10)
+    
+    @pytest.mark.asyncio
+    async def test_renumbered_expansion_falls_back_to_position(self, service):
+        async def fake_completion(messages, **kwargs):
+            prompt = message_text(messages[0])
+            if "需要展开的场景：" not in prompt:
+                return outline_result(10)
+            count = len(re.search(r"需要展开的场景：(.*)", prompt).group(1).split("、"))
+            return {"scenes": [expanded_scene(f"s{i}") for i in range(count)]}
+        
+        service.client.structured_completion.side_effect = fake_completion
+        
+        output = await service.analyze_text("故事。", scenes_count=10)
+        
+        assert [scene.scene_id for scene in output.scenes] == [f"scene_{i:03d}" for i in range(1, 11)]
+    
+    @pytest.mark.asyncio
+    async def test_small_scene_count_uses_single_request(self, service):
+        service.client.structured_completion.return_value = {
+            "metadata": {"total_scenes": 1, "story_title": "短篇", "total_characters": 1},
+            "characters": CHARACTERS,
+            "scenes": [expanded_scene("scene_001")],
+        }
+        
+        await service.analyze_text("故事。", scenes_count=3)
+        
+        assert service.client.structured_completion.await_count == 1
+        assert service.should_stream("故事。", 3)
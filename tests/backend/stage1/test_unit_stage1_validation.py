@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from app.models.schemas import Scene
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.prompt_layout import message_text
+from app.services.stage1_validation import (
+    EMPTY_SCENE,
+    UNKNOWN_CHARACTER,
+    Stage1ValidationError,
+    check_output,
+    parse_output,
+    repair_output,
+)
+
+
+def scene(order, scene_id=None, characters=("char_001",), narration=None):
+    return {
+        "scene_id": scene_id or f"scene_{order:03d}",
+        "order": order,
+        "description": "雨夜的小巷",
+        "composition": "中景，平视",
+        "characters": list(characters),
+        "narration": f"旁白{order}" if narration is None else narration,
+    }
+
+
+def analysis_result(scenes):
+    return {
+        "metadata": {"total_scenes": len(scenes), "story_title": "测试", "total_characters": 1},
+        "characters": [{"id": "char_001", "name": "林远", "description": "黑发青年"}],
+        "scenes": scenes,
+    }
+
+
+class TestStage1ValidationUnit:
+    
+    def test_issues_are_reported_per_scene(self):
+        output, _ = parse_output(analysis_result([scene(1), scene(2, characters=["char_009"])]))
+        
+        issues = check_output(output)
+        
+        assert [(issue.code, issue.scene_id, issue.character_id) for issue in issues] == [
+            (UNKNOWN_CHARACTER, "scene_002", "char_009"),
+        ]
+        assert not Stage1TextAnalysisService(client=AsyncMock()).validate_output(output)
+    
+    def test_local_repair_adds_stubs_and_renumbers(self):
+        result = analysis_result([scene(2, "s_b", characters=["char_002"]), scene(1, "s_a")])
+        result["metadata"]["total_scenes"] = 5
+        output, _ = parse_output(result)
+        
+        repaired, fixed = repair_output(output)
+        
+        assert check_output(repaired) == []
+        assert {issue.code for issue in fixed} >= {UNKNOWN_CHARACTER, "scene_count_mismatch", "scene_numbering"}
+        assert [(s.scene_id, s.narration) for s in repaired.scenes] == [("scene_001", "旁白1"), ("scene_002", "旁白2")]
+        assert [char.id for char in repaired.characters] == ["char_001", "char_002"]
+        assert repaired.metadata.total_characters == 2
+    
+    @pytest.mark.asyncio
+    async def test_only_broken_scenes_are_requested_again(self):
+        broken = scene(2)
+        del broken["narration"]
+        client = AsyncMock()
+        client.structured_completion.side_effect = [
+            analysis_result([scene(1), broken, scene(3)]),
+            {"scenes": [scene(2, narration="重新生成的旁白")]},
+        ]
+        
+        output = await Stage1TextAnalysisService(client=client).analyze_text("故事。", scenes_count=3)
+        
+        retry_prompt = message_text(client.structured_completion.call_args_list[1].kwargs["messages"][0])
+        assert "需要展开的场景：scene_002\n" in retry_prompt
+        assert [s.narration for s in output.scenes] == ["旁白1", "重新生成的旁白", "旁白3"]
+    
+    @pytest.mark.asyncio
+    async def test_unrepairable_output_raises_structured_error(self):
+        client = AsyncMock()
+        client.structured_completion.side_effect = [
+            analysis_result([scene(1), scene(2, narration="")]),
+            {"scenes": []},
+        ]
+        
+        with pytest.raises(Stage1ValidationError) as exc_info:
+            await Stage1TextAnalysisService(client=client).analyze_text("故事。", scenes_count=2)
+        
+        assert [(issue.code, issue.scene_id) for issue in exc_info.value.issues] == [(EMPTY_SCENE, "scene_002")]
+    
+    @pytest.mark.asyncio
+    async def test_streamed_result_is_repaired_and_broken_scene_not_streamed(self):
+        broken = scene(2)
+        del broken["narration"]
+        result = analysis_result([scene(1), broken, scene(3, characters=["char_002"])])
+        
+        async def fake_stream(**kwargs):
+            for char in result["characters"]:
+                yield "characters", char
+            for item in result["scenes"]:
+                yield "scenes", item
+            yield None, result
+        
+        client = AsyncMock()
+        client.stream_structured_completion = fake_stream
+        client.structured_completion.return_value = {"scenes": [scene(2, narration="重新生成的旁白")]}
+        
+        events = [(kind, value) async for kind, value in Stage1TextAnalysisService(client=client).analyze_text_stream("故事。", 3)]
+        
+        assert [value.scene_id for kind, value in events if kind == "scene"] == ["scene_001", "scene_003"]
+        final = events[-1][1]
+        assert [s.narration for s in final.scenes] == ["旁白1", "重新生成的旁白", "旁白3"]
+        assert [char.id for char in final.characters] == ["char_001", "char_002"]
+    
+    @pytest.mark.asyncio
+    async def test_outline_expansion_missing_scene_is_requested_again(self, monkeypatch):
+        monkeypatch.setattr("app.services.stage1_text_analysis.settings.stage1_outline_min_scenes", 2)
+        client = AsyncMock()
+        client.structured_completion.side_effect = [
+            {
+                "metadata": {"story_title": "长篇"},
+                "characters": [{"id": "char_001", "name": "林远", "description": "黑发青年"}],
+                "outline": [{"summary": "情节1"}, {"summary": "情节2"}],
+            },
+            {"scenes": [scene(1)]},
+            {"scenes": [scene(2, narration="补充的旁白")]},
+        ]
+        
+        output = await Stage1TextAnalysisService(client=client).analyze_text("故事。", scenes_count=2)
+        
+        assert [s.narration for s in output.scenes] == ["旁白1", "补充的旁白"]
+        assert output.metadata.story_title == "长篇"
+    
+    @pytest.mark.asyncio
+    async def test_orchestrator_regenerates_prompts_for_repaired_scenes(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("app.services.openrouter_client.settings.openrouter_api_key", "test")
+        from app.models.schemas import Stage2Output
+        from app.services.task_orchestrator import TaskOrchestrator
+        
+        orchestrator = TaskOrchestrator(output_base_dir=str(tmp_path))
+        streamed = [Scene(**scene(1)), Scene(**scene(2, narration="旧旁白"))]
+        final, _ = parse_output(analysis_result([scene(1), scene(2, narration="修复后的旁白"), scene(3)]))
+        
+        async def fake_stream(text, scenes_count):
+            for item in streamed:
+                yield "scene", item
+            yield "result", final
+        
+        async def fake_prompt(scene, characters, semaphore, bypass_cache=False):
+            return Stage2Output(scene_id=scene.scene_id, image_prompt=scene.narration)
+        
+        orchestrator.stage1_service.analyze_text_stream = fake_stream
+        orchestrator.stage2_service.generate_image_prompt_bounded = fake_prompt
+        
+        output, tasks = await orchestrator._run_stage1_streaming("故事。", 3)
+        prompts = await asyncio.gather(*tasks)
+        
+        assert output is final
+        assert [p.image_prompt for p in prompts] == ["旁白1", "修复后的旁白", "旁白3"]
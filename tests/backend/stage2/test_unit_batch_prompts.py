@@ -0,0 +1,116 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.config import settings
+from app.models.schemas import Stage1Output, Stage2Output
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+
+
+def make_stage1_output(scenes_count: int) -> Stage1Output:
+    return Stage1Output(**{
+        "metadata": {"total_scenes": scenes_count, "story_title": "测试", "total_characters": 1},
+        "characters": [{"id": "char_001", "name": "张三", "description": "黑发青年"}],
+        "scenes": [
+            {
+                "scene_id": f"scene_{i:03d}",
+                "order": i,
+                "description": "清晨的街道",
+                "composition": "远景",
+                "characters": ["char_001"],
+                "narration": "旁白",
+            }
+            for i in range(1, scenes_count + 1)
+        ],
+    })
+
+
+def prompt_item(scene_id: str) -> dict:
+    return {"scene_id": scene_id, "image_prompt": f"prompt for {scene_id}", "characters_in_scene": ["char_001"]}
+
+
+class TestStage2BatchUnit:
+    
+    @pytest.fixture
+    def service(self):
+        return Stage2ImagePromptService(client=AsyncMock())
+    
+    def test_batches_respect_token_budget(self, service, monkeypatch):
+        monkeypatch.setattr(settings, "stage2_batch_max_tokens", 1000)
+        monkeypatch.setattr(settings, "stage2_batch_max_scenes", 8)
+        scenes = make_stage1_output(7).scenes
+        
+        batches = service._plan_batches(scenes)
+        
+        per_scene = service._estimate_output_tokens(scenes[0])
+        assert all(len(batch) * per_scene <= 1000 for batch in batches)
+        assert [scene.scene_id for batch in batches for scene in batch] == [s.scene_id for s in scenes]
+    
+    def test_batches_respect_max_scenes(self, service, monkeypatch):
+        monkeypatch.setattr(settings, "stage2_batch_max_tokens", 100000)
+        monkeypatch.setattr(settings, "stage2_batch_max_scenes", 4)
+        
+        batches = service._plan_batches(make_stage1_output(10).scenes)
+        
+        assert [len(batch) for batch in batches] == [4, 4, 2]
+    
+    def test_batch_prompt_contains_shared_character_sheet_once(self, service):
+        stage1 = make_stage1_output(3)
+        
+        prompt = service._build_batch_prompt_request(stage1.scenes, stage1.characters).text
+        
+        assert prompt.count("黑发青年") == 1
+        assert all(scene.scene_id in prompt for scene in stage1.scenes)
+    
+    @pytest.mark.asyncio
+    async def test_single_request_for_whole_batch(self, service):
+        stage1 = make_stage1_output(3)
+        service.client.structured_completion.return_value = {
+            "prompts": [prompt_item(scene.scene_id) for scene in stage1.scenes]
+        }
+        
+        prompts = await service.generate_all_prompts_batched(stage1)
+        
+        assert [p.scene_id for p in prompts] == ["scene_001", "scene_002", "scene_003"]
+        assert service.client.structured_completion.await_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_only_missing_scenes_are_retried(self, service):
+        stage1 = make_stage1_output(4)
+        service.client.structured_completion.return_value = {
+            "prompts": [prompt_item("scene_001"), {"scene_id": "scene_002"}, prompt_item("scene_004")]
+        }
+        service.generate_image_prompt = AsyncMock(
+            side_effect=lambda scene, characters, bypass_cache=False: Stage2Output(**prompt_item(scene.scene_id))
+        )
+        
+        prompts = await service.generate_all_prompts_batched(stage1)
+        
+        assert [p.scene_id for p in prompts] == ["scene_001", "scene_002", "scene_003", "scene_004"]
+        retried = [call.args[0].scene_id for call in service.generate_image_prompt.await_args_list]
+        assert retried == ["scene_002", "scene_003"]
+    
+    @pytest.mark.asyncio
+    async def test_unparseable_batch_is_split(self, service):
+        stage1 = make_stage1_output(4)
+        service.client.structured_completion.side_effect = [
+            ValueError("Failed to parse JSON response"),
+            {"prompts": [prompt_item("scene_001"), prompt_item("scene_002")]},
+            {"prompts": [prompt_item("scene_003"), prompt_item("scene_004")]},
+        ]
+        
+        prompts = await service.generate_all_prompts_batched(stage1)
+        
+        assert len(prompts) == 4
+        assert service.client.structured_completion.await_count == 3
+    
+    @pytest.mark.asyncio
+    async def test_wrong_echoed_scene_id_is_replaced(self, service):
+        stage1 = make_stage1_output(2)
+        service.client.structured_completion.side_effect = [
+            {"prompts": [prompt_item("scene_001")]},
+            prompt_item("scene_1"),
+        ]
+        
+        prompts = await service.generate_all_prompts_batched(stage1)
+        
+        assert [p.scene_id for p in prompts] == ["scene_001", "scene_002"]
+        assert prompts[1].image_prompt == "prompt for scene_1"
@@ -0,0 +1,55 @@
+import asyncio
+import random
+import pytest
+from unittest.mock import AsyncMock
+from app.models.schemas import Stage2Output
+from app.services.stage2_image_prompt import Stage2ImagePromptService, Stage2PromptError
+from .test_unit_batch_prompts import make_stage1_output
+
+
+class TestStage2ConcurrentUnit:
+    
+    @pytest.fixture
+    def service(self):
+        service = Stage2ImagePromptService(client=AsyncMock())
+        service.peak = 0
+        service.active = 0
+        
+        async def fake_generate(scene, characters, bypass_cache=False):
+            service.active += 1
+            service.peak = max(service.peak, service.active)
+            await asyncio.sleep(random.uniform(0.001, 0.01))
+            service.active -= 1
+            if scene.scene_id == getattr(service, "fail_on", None):
+                raise ValueError("model error")
+            return Stage2Output(scene_id=scene.scene_id, image_prompt="p")
+        
+        service.generate_image_prompt = fake_generate
+        return service
+    
+    @pytest.mark.asyncio
+    async def test_results_keep_scene_order(self, service):
+        stage1 = make_stage1_output(12)
+        
+        prompts = await service.generate_all_prompts(stage1, concurrent=True, max_concurrency=4)
+        
+        assert [p.scene_id for p in prompts] == [s.scene_id for s in stage1.scenes]
+    
+    @pytest.mark.asyncio
+    async def test_semaphore_bounds_in_flight_scenes(self, service):
+        await service.generate_all_prompts(make_stage1_output(12), concurrent=True, max_concurrency=3)
+        
+        assert service.peak == 3
+    
+    @pytest.mark.asyncio
+    async def test_failure_is_reported_per_scene_without_cancelling_others(self, service):
+        service.fail_on = "scene_002"
+        
+        with pytest.raises(Stage2PromptError) as exc_info:
+            await service.generate_all_prompts(make_stage1_output(5), concurrent=True)
+        
+        error = exc_info.value
+        assert list(error.failures) == ["scene_002"]
+        assert [r.scene_id if r else None for r in error.results] == [
+            "scene_001", None, "scene_003", "scene_004", "scene_005"
+        ]
@@ -0,0 +1,58 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.config import settings
+from app.services.stage1_text_analysis import Stage1TextAnalysisService
+from app.services.prompt_layout import message_text
+from app.services.stage2_image_prompt import Stage2ImagePromptService
+from .test_unit_batch_prompts import make_stage1_output, prompt_item
+
+
+def fuse(stage1, scene_ids):
+    for scene in stage1.scenes:
+        if scene.scene_id in scene_ids:
+            scene.image_prompt = f"fused prompt for {scene.scene_id}"
+            scene.negative_prompt = "blurry"
+            scene.style_tags = ["anime"]
+    return stage1
+
+
+class TestStage2FusedPromptsUnit:
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("concurrent", [False, True])
+    async def test_fused_scenes_skip_the_model(self, concurrent):
+        client = AsyncMock()
+        stage1 = fuse(make_stage1_output(3), {"scene_001", "scene_002", "scene_003"})
+        
+        prompts = await Stage2ImagePromptService(client=client).generate_all_prompts(stage1, concurrent=concurrent)
+        
+        client.structured_completion.assert_not_called()
+        assert [p.image_prompt for p in prompts] == [f"fused prompt for scene_00{i}" for i in range(1, 4)]
+        assert prompts[0].negative_prompt == "blurry"
+        assert prompts[0].characters_in_scene == ["char_001"]
+    
+    @pytest.mark.asyncio
+    async def test_batched_mode_only_requests_missing_scenes(self, monkeypatch):
+        monkeypatch.setattr(settings, "stage2_batch_max_scenes", 8)
+        client = AsyncMock()
+        client.structured_completion.return_value = {
+            "prompts": [prompt_item("scene_002"), prompt_item("scene_004")]
+        }
+        stage1 = fuse(make_stage1_output(4), {"scene_001", "scene_003"})
+        
+        prompts = await Stage2ImagePromptService(client=client).generate_all_prompts_batched(stage1)
+        
+        assert client.structured_completion.await_count == 1
+        request = message_text(client.structured_completion.call_args.kwargs["messages"][0])
+        assert "[scene_002]" in request and "[scene_001]" not in request
+        assert [p.scene_id for p in prompts] == ["scene_001", "scene_002", "scene_003", "scene_004"]
+        assert prompts[0].image_prompt == "fused prompt for scene_001"
+        assert prompts[1].image_prompt == "prompt for scene_002"
+    
+    def test_stage1_prompt_requests_image_prompts_only_when_fused(self):
+        plain = Stage1TextAnalysisService(client=AsyncMock(), fused_prompts=False)
+        fused = Stage1TextAnalysisService(client=AsyncMock(), fused_prompts=True)
+        
+        assert '"image_prompt"' not in plain._build_analysis_prompt("故事", 5).text
+        assert '"image_prompt"' in fused._build_analysis_prompt("故事", 5).text
+        assert fused._max_tokens(20) > plain._max_tokens(20)
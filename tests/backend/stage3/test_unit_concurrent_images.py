@@ -0,0 +1,113 @@
+import asyncio
+import random
+import pytest
+from unittest.mock import AsyncMock
+from app.config import settings
+from app.models.schemas import Stage2Output, Stage3Output
+from app.services.stage3_image_generation import Stage3ImageError, Stage3ImageGenerationService
+
+
+def make_prompts(count: int):
+    return [Stage2Output(scene_id=f"scene_{i:03d}", image_prompt=f"Prompt {i}") for i in range(1, count + 1)]
+
+
+class TestStage3ConcurrentUnit:
+    
+    @pytest.fixture
+    def service(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "stage3_retry_delay", 0.0)
+        
+        service = Stage3ImageGenerationService(client=AsyncMock(), output_dir=str(tmp_path))
+        service.peak = 0
+        service.active = 0
+        service.calls = {}
+        service.fail_times = {}
+        
+        async def fake_generate(stage2_output, **kwargs):
+            scene_id = stage2_output.scene_id
+            service.calls[scene_id] = service.calls.get(scene_id, 0) + 1
+            service.active += 1
+            service.peak = max(service.peak, service.active)
+            await asyncio.sleep(random.uniform(0.001, 0.01))
+            service.active -= 1
+            if service.calls[scene_id] <= service.fail_times.get(scene_id, 0):
+                raise ValueError("No image found in response")
+            return Stage3Output(scene_id=scene_id, image_path=f"/tmp/{scene_id}.png", width=1024, height=1024)
+        
+        service.generate_scene_image = fake_generate
+        return service
+    
+    @pytest.mark.asyncio
+    async def test_semaphore_bounds_in_flight_scenes(self, service):
+        images = await service.generate_all_images(make_prompts(10), max_concurrency=3)
+        
+        assert service.peak == 3
+        assert [img.scene_id for img in images] == [f"scene_{i:03d}" for i in range(1, 11)]
+    
+    @pytest.mark.asyncio
+    async def test_transient_failure_is_retried_per_scene(self, service):
+        service.fail_times = {"scene_002": 1}
+        
+        images = await service.generate_all_images(make_prompts(3), max_attempts=2)
+        
+        assert len(images) == 3
+        assert service.calls == {"scene_001": 1, "scene_002": 2, "scene_003": 1}
+    
+    @pytest.mark.asyncio
+    async def test_exhausted_scene_keeps_finished_images(self, service):
+        service.fail_times = {"scene_002": 5}
+        
+        with pytest.raises(Stage3ImageError) as exc_info:
+            await service.generate_all_images(make_prompts(4), max_attempts=3)
+        
+        error = exc_info.value
+        assert error.failed_scene_ids == ["scene_002"]
+        assert error.failures[0].attempts == 3
+        assert [img.scene_id for img in error.completed] == ["scene_001", "scene_003", "scene_004"]
+        assert error.results[1] is None
+    
+    @pytest.mark.asyncio
+    async def test_serial_mode_continues_after_failure(self, service):
+        service.fail_times = {"scene_001": 5}
+        
+        with pytest.raises(Stage3ImageError) as exc_info:
+            await service.generate_all_images(make_prompts(3), concurrent=False, max_attempts=1)
+        
+        assert exc_info.value.failed_scene_ids == ["scene_001"]
+        assert service.calls == {"scene_001": 1, "scene_002": 1, "scene_003": 1}
+    
+    @pytest.mark.asyncio
+    async def test_iter_images_yields_as_completed_with_progress(self, service):
+        service.fail_times = {"scene_003": 5}
+        progress = []
+        yielded = []
+        
+        with pytest.raises(Stage3ImageError) as exc_info:
+            async for image in service.iter_images(
+                make_prompts(5), max_attempts=1, on_progress=lambda done, total, result: progress.append((done, total)),
+            ):
+                yielded.append(image.scene_id)
+        
+        assert sorted(yielded) == ["scene_001", "scene_002", "scene_004", "scene_005"]
+        assert progress == [(i, 5) for i in range(1, 6)]
+        assert exc_info.value.failed_scene_ids == ["scene_003"]
+    
+    @pytest.mark.asyncio
+    async def test_iter_images_first_result_arrives_before_slow_scenes(self, service):
+        release = asyncio.Event()
+        fast = service.generate_scene_image
+        
+        async def slow_except_first(stage2_output, **kwargs):
+            if stage2_output.scene_id != "scene_002":
+                await release.wait()
+            return await fast(stage2_output, **kwargs)
+        
+        service.generate_scene_image = slow_except_first
+        images = service.iter_images(make_prompts(4))
+        
+        first = await asyncio.wait_for(images.__anext__(), timeout=1)
+        release.set()
+        rest = [image.scene_id async for image in images]
+        
+        assert first.scene_id == "scene_002"
+        assert sorted(rest) == ["scene_001", "scene_003", "scene_004"]